@@ -0,0 +1,330 @@
+# app/fastq_stats.py
+"""
+Streaming FASTQ statistics (NumPy): the `native` QC engine used by tasks.py.
+
+FastqStats accumulates FastQC's core modules from raw FASTQ bytes fed in
+chunks of any size, so it can sit on an S3 stream without a local copy:
+- per-position quality (mean, median, quartiles, 10th/90th percentiles)
+- per-position base composition and N content
+- per-read mean quality, GC content and length distributions
+- duplication levels and overrepresented sequences, estimated like FastQC
+  from the first DUPLICATION_PREFIX_BP bases of each read and only for the
+  first TRACKED_SEQUENCES distinct prefixes seen
+
+Records are parsed in batches of BATCH_BYTES with vectorised indexing; only
+the (at most TRACKED_SEQUENCES) tracked prefixes are kept as Python objects.
+"""
+
+import json
+import os
+
+import numpy as np
+
+PHRED_OFFSET = 33
+MAX_QUALITY = 93  # '~' in Phred+33
+BATCH_BYTES = 8 * 1024 * 1024
+DUPLICATION_PREFIX_BP = 50
+TRACKED_SEQUENCES = 100_000
+OVERREPRESENTED_FRACTION = 0.001  # FastQC reports sequences above 0.1% of reads
+OVERREPRESENTED_LIMIT = 20
+DUPLICATION_LEVELS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 50, 100, 500, 1000, 5000, 10000)
+QUALITY_QUANTILES = {"p10": 0.10, "q1": 0.25, "median": 0.50, "q3": 0.75, "p90": 0.90}
+
+BASES = "ACGTN"
+_BASE_CODE = np.full(256, 4, dtype=np.uint8)  # anything but A/C/G/T (either case) counts as N
+for _code, _base in enumerate(b"ACGT"):
+    _BASE_CODE[_base] = _code
+    _BASE_CODE[_base + 32] = _code
+# Odd multiplier for the polynomial prefix hash; uint64 arithmetic wraps, which is what we want.
+_HASH_POWERS = np.cumprod(np.full(DUPLICATION_PREFIX_BP, 0x9E3779B97F4A7C15, dtype=np.uint64), dtype=np.uint64)
+
+
+class FastqStats:
+    """
+    Incremental FASTQ statistics. Feed raw bytes with `update()` (records may
+    span calls), call `end_segment()` after each independent byte range when
+    sampling, and `report()` for the result.
+    """
+
+    def __init__(self):
+        self.reads = 0
+        self.bases = 0
+        self.bytes_examined = 0
+        self._pending = bytearray()
+        self._quality = np.zeros((0, MAX_QUALITY + 1), dtype=np.int64)  # [position, phred] -> bases
+        self._composition = np.zeros((0, len(BASES)), dtype=np.int64)  # [position, A/C/G/T/N] -> bases
+        self._lengths = np.zeros(1, dtype=np.int64)  # [length] -> reads
+        self._read_quality = np.zeros(MAX_QUALITY + 1, dtype=np.int64)  # [rounded mean phred] -> reads
+        self._gc = np.zeros(101, dtype=np.int64)  # [GC %] -> reads
+        self._tracked_keys = np.zeros(0, dtype=np.uint64)  # sorted
+        self._tracked_counts = np.zeros(0, dtype=np.int64)
+        self._tracked_sequences = {}
+        self._tracked_reads = 0
+
+    def update(self, data):
+        """Adds raw FASTQ bytes. Complete records are processed once BATCH_BYTES have accumulated."""
+        self._pending += data
+        self.bytes_examined += len(data)
+        if len(self._pending) >= BATCH_BYTES:
+            self._process_complete_records()
+
+    def end_segment(self, discard_partial=True):
+        """
+        Processes everything buffered. With `discard_partial`, a trailing
+        incomplete record (a sampled byte range cut mid-record) is dropped;
+        otherwise it is an error, because the input itself is truncated.
+        """
+        if not discard_partial and self._pending and not self._pending.endswith(b"\n"):
+            self._pending += b"\n"  # the last line of a file need not end in a newline
+        self._process_complete_records()
+        if self._pending.strip():
+            if not discard_partial:
+                raise ValueError("FASTQ input ends with an incomplete record")
+            self.bytes_examined -= len(self._pending)
+        self._pending.clear()
+
+    def _process_complete_records(self):
+        data = self._pending
+        if not data:
+            return
+        newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10)
+        complete_lines = len(newlines) // 4 * 4
+        if complete_lines == 0:
+            return
+        cut = int(newlines[complete_lines - 1]) + 1
+        self._process(bytes(data[:cut]), newlines[:complete_lines])
+        del self._pending[:cut]
+
+    def _grow(self, length):
+        if length > self._quality.shape[0]:
+            extra = length - self._quality.shape[0]
+            self._quality = np.vstack([self._quality, np.zeros((extra, MAX_QUALITY + 1), dtype=np.int64)])
+            self._composition = np.vstack([self._composition, np.zeros((extra, len(BASES)), dtype=np.int64)])
+        if length + 1 > self._lengths.size:
+            self._lengths = np.concatenate([self._lengths, np.zeros(length + 1 - self._lengths.size, dtype=np.int64)])
+
+    def _process(self, data, newlines):
+        raw = np.frombuffer(data, dtype=np.uint8)
+        starts = np.empty(len(newlines), dtype=np.int64)
+        starts[0] = 0
+        starts[1:] = newlines[:-1] + 1
+        ends = newlines.astype(np.int64)
+        carriage_return = (ends > starts) & (raw[ends - 1] == 13)
+        ends[carriage_return] -= 1
+
+        header_starts, sequence_starts, plus_starts, quality_starts = (starts[i::4] for i in range(4))
+        if not (np.all(raw[header_starts] == ord("@")) and np.all(raw[plus_starts] == ord("+"))):
+            raise ValueError("Malformed FASTQ: expected 4-line records with '@' header and '+' separator lines")
+        lengths = ends[1::4] - sequence_starts
+        if np.any(ends[3::4] - quality_starts != lengths):
+            raise ValueError("Malformed FASTQ: a quality line differs in length from its sequence")
+
+        reads = lengths.size
+        total = int(lengths.sum())
+        longest = int(lengths.max())
+        self._grow(longest)
+        self.reads += reads
+        self.bases += total
+        self._lengths[:longest + 1] += np.bincount(lengths, minlength=longest + 1)
+        if total == 0:
+            return
+
+        if lengths.min() == longest:
+            # Fixed-length reads (the usual case): gather [read, position] matrices directly.
+            columns = np.arange(longest)
+            bases = _BASE_CODE[raw[sequence_starts[:, None] + columns]]
+            quality = raw[quality_starts[:, None] + columns].astype(np.int64) - PHRED_OFFSET
+            position = np.broadcast_to(columns, quality.shape)
+        else:
+            read_offsets = np.cumsum(lengths) - lengths
+            position = np.arange(total, dtype=np.int64) - np.repeat(read_offsets, lengths)
+            bases = _BASE_CODE[raw[np.repeat(sequence_starts, lengths) + position]]
+            quality = raw[np.repeat(quality_starts, lengths) + position].astype(np.int64) - PHRED_OFFSET
+        np.clip(quality, 0, MAX_QUALITY, out=quality)
+
+        rows = self._quality.shape[0]
+        self._quality += np.bincount((position * (MAX_QUALITY + 1) + quality).ravel(),
+                                     minlength=rows * (MAX_QUALITY + 1)).reshape(rows, MAX_QUALITY + 1)
+        self._composition += np.bincount((position * len(BASES) + bases).ravel(),
+                                         minlength=rows * len(BASES)).reshape(rows, len(BASES))
+
+        is_gc = (bases == 1) | (bases == 2)
+        if quality.ndim == 2:
+            read_lengths = longest
+            quality_sums = quality.sum(axis=1)
+            gc = np.count_nonzero(is_gc, axis=1)
+        else:
+            # Zero-length reads own no bases, so reduceat runs over the others only.
+            nonempty = lengths > 0
+            segment_starts = read_offsets[nonempty]
+            read_lengths = lengths[nonempty]
+            quality_sums = np.add.reduceat(quality, segment_starts)
+            gc = np.add.reduceat(is_gc.astype(np.int64), segment_starts)
+        self._read_quality += np.bincount(np.rint(quality_sums / read_lengths).astype(np.int64), minlength=MAX_QUALITY + 1)
+        self._gc += np.bincount(np.rint(100 * gc / read_lengths).astype(np.int64), minlength=101)
+
+        self._track_duplicates(data, raw, sequence_starts, lengths)
+
+    def _track_duplicates(self, data, raw, sequence_starts, lengths):
+        prefix = np.minimum(lengths, DUPLICATION_PREFIX_BP)
+        columns = np.arange(DUPLICATION_PREFIX_BP)
+        inside = columns[None, :] < prefix[:, None]
+        index = np.minimum(sequence_starts[:, None] + columns[None, :], raw.size - 1)
+        # Codes 1-5 for bases, 6 past the end of the read, so prefixes of different lengths never collide.
+        codes = np.where(inside, _BASE_CODE[raw[index]].astype(np.uint64) + np.uint64(1), np.uint64(6))
+        keys = (codes * _HASH_POWERS).sum(axis=1, dtype=np.uint64)
+
+        unique, first, counts = np.unique(keys, return_index=True, return_counts=True)
+        slot = np.searchsorted(self._tracked_keys, unique)
+        found = slot < self._tracked_keys.size
+        found[found] = self._tracked_keys[slot[found]] == unique[found]
+        self._tracked_counts[slot[found]] += counts[found]
+        self._tracked_reads += int(counts[found].sum())
+
+        room = TRACKED_SEQUENCES - self._tracked_keys.size
+        new = np.flatnonzero(~found)
+        if room <= 0 or new.size == 0:
+            return
+        # Like FastQC, the first distinct sequences seen are the ones tracked.
+        new = new[np.argsort(first[new], kind="stable")][:room]
+        for i in new:
+            start = int(sequence_starts[first[i]])
+            self._tracked_sequences[int(unique[i])] = data[start:start + int(prefix[first[i]])].decode("ascii", "replace")
+        keys = np.concatenate([self._tracked_keys, unique[new]])
+        order = np.argsort(keys, kind="stable")
+        self._tracked_keys = keys[order]
+        self._tracked_counts = np.concatenate([self._tracked_counts, counts[new]])[order]
+        self._tracked_reads += int(counts[new].sum())
+
+    def report(self) -> dict:
+        """
+        The statistics as a JSON-ready dict, including FastQC-style pass/warn/fail
+        module flags. Anything still buffered is treated as the end of the input.
+        """
+        if self._pending:
+            self.end_segment(discard_partial=False)
+        positions = self._quality.shape[0]
+        per_position = []
+        if positions:
+            coverage = self._quality.sum(axis=1)
+            phred = np.arange(MAX_QUALITY + 1)
+            mean_quality = (self._quality * phred).sum(axis=1) / np.maximum(coverage, 1)
+            cumulative = np.cumsum(self._quality, axis=1)
+            quantiles = {name: np.argmax(cumulative >= q * coverage[:, None], axis=1) for name, q in QUALITY_QUANTILES.items()}
+            composition = 100 * self._composition / np.maximum(coverage, 1)[:, None]
+            for p in range(positions):
+                row = {"position": p + 1, "reads": int(coverage[p]), "mean_quality": round(float(mean_quality[p]), 2)}
+                row.update({name: int(values[p]) for name, values in quantiles.items()})
+                row.update({f"{base}_percent": round(float(composition[p, i]), 3) for i, base in enumerate(BASES)})
+                per_position.append(row)
+
+        lengths = np.flatnonzero(self._lengths)
+        read_quality = np.flatnonzero(self._read_quality)
+        gc = np.flatnonzero(self._gc)
+        n_bases = int(self._composition[:, 4].sum())
+        report = {
+            "engine": "native",
+            "reads": self.reads,
+            "bases": self.bases,
+            "bytes_examined": self.bytes_examined,
+            "length": {
+                "min": int(lengths.min()) if lengths.size else 0,
+                "max": int(lengths.max()) if lengths.size else 0,
+                "mean": round(self.bases / self.reads, 2) if self.reads else 0.0,
+            },
+            "n_percent": round(100 * n_bases / self.bases, 4) if self.bases else 0.0,
+            "gc_percent": round(float((self._gc * np.arange(101)).sum() / self.reads), 2) if self.reads else 0.0,
+            "per_position": per_position,
+            "length_distribution": [{"length": int(n), "reads": int(self._lengths[n])} for n in lengths],
+            "per_read_quality": [{"mean_quality": int(q), "reads": int(self._read_quality[q])} for q in read_quality],
+            "gc_distribution": [{"gc_percent": int(g), "reads": int(self._gc[g])} for g in gc],
+        }
+        report.update(self._duplication())
+        report["modules"] = module_status(report)
+        return report
+
+    def _duplication(self) -> dict:
+        counts = self._tracked_counts
+        tracked = max(self._tracked_reads, 1)
+        bucket = np.digitize(counts, DUPLICATION_LEVELS) - 1
+        reads_per_bucket = np.bincount(bucket, weights=counts, minlength=len(DUPLICATION_LEVELS))
+        labels = [str(level) if level < 10 else f">={level}" for level in DUPLICATION_LEVELS]
+        threshold = OVERREPRESENTED_FRACTION * self.reads
+        over = np.flatnonzero(counts > threshold) if self.reads else np.zeros(0, dtype=np.int64)
+        over = over[np.argsort(-counts[over], kind="stable")][:OVERREPRESENTED_LIMIT]
+        return {
+            "duplication": {
+                "prefix_bp": DUPLICATION_PREFIX_BP,
+                "tracked_sequences": int(counts.size),
+                "tracked_reads": int(self._tracked_reads),
+                "percent_remaining_if_deduplicated": round(100 * counts.size / tracked, 2) if counts.size else 100.0,
+                "levels": [{"level": label, "percent_of_reads": round(float(100 * n / tracked), 3)}
+                           for label, n in zip(labels, reads_per_bucket)],
+            },
+            "overrepresented": [
+                {"sequence": self._tracked_sequences[int(self._tracked_keys[i])], "count": int(counts[i]),
+                 "percent": round(float(100 * counts[i] / self.reads), 4)}
+                for i in over
+            ],
+        }
+
+
+def module_status(report) -> dict:
+    """pass/warn/fail per module, using FastQC's default limits."""
+    def grade(fail, warn):
+        return "fail" if fail else "warn" if warn else "pass"
+
+    positions = report["per_position"]
+    lowest_q1 = min((p["q1"] for p in positions), default=0)
+    lowest_median = min((p["median"] for p in positions), default=0)
+    worst_n = max((p["N_percent"] for p in positions), default=0)
+    content_skew = max((max(abs(p["A_percent"] - p["T_percent"]), abs(p["G_percent"] - p["C_percent"])) for p in positions), default=0)
+    modal_quality = max(report["per_read_quality"], key=lambda row: row["reads"], default={"mean_quality": 0})["mean_quality"]
+    lengths = report["length_distribution"]
+    remaining = report["duplication"]["percent_remaining_if_deduplicated"]
+    top_overrepresented = max((row["percent"] for row in report["overrepresented"]), default=0)
+    return {
+        "per_base_sequence_quality": grade(lowest_q1 < 5 or lowest_median < 20, lowest_q1 < 10 or lowest_median < 25),
+        "per_sequence_quality_scores": grade(modal_quality < 20, modal_quality < 27),
+        "per_base_sequence_content": grade(content_skew > 20, content_skew > 10),
+        "per_base_n_content": grade(worst_n > 20, worst_n > 5),
+        "sequence_length_distribution": grade(any(row["length"] == 0 for row in lengths), len(lengths) > 1),
+        "sequence_duplication_levels": grade(remaining < 50, remaining < 70),
+        "overrepresented_sequences": grade(top_overrepresented > 1, top_overrepresented > 0.1),
+    }
+
+
+REPORT_TABLES = ("per_position", "length_distribution", "per_read_quality", "gc_distribution", "overrepresented")
+
+
+def write_report(report, path) -> list:
+    """
+    Writes a report by file extension:
+    - .json: the whole report, compact
+    - .parquet: one file per table, named <stem>.<table>.parquet, plus
+      <stem>.summary.parquet with the scalar fields (requires pyarrow)
+    Returns the paths written.
+    """
+    stem, extension = os.path.splitext(path)
+    extension = extension.lower()
+    if extension == ".json":
+        with open(path, "w") as f:
+            json.dump(report, f, separators=(",", ":"))
+        return [path]
+    if extension == ".parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Parquet QC reports require pyarrow (pip install pyarrow)") from e
+        summary = {key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                   for key, value in report.items() if key not in REPORT_TABLES}
+        tables = {name: report[name] for name in REPORT_TABLES if report.get(name)}
+        tables["summary"] = [summary]
+        written = []
+        for name, rows in tables.items():
+            table_path = f"{stem}.{name}.parquet"
+            pq.write_table(pa.Table.from_pylist(rows), table_path)
+            written.append(table_path)
+        return written
+    raise ValueError(f"Unsupported QC report format '{extension}' (use .json or .parquet)")
@@ -1,16 +1,37 @@
 # app/tasks.py (cloud-safe reference handling + debug)
 
 import argparse
+import atexit
 import boto3
+import fcntl
+import hashlib
+import io
+import json
 import subprocess
 import os
+import queue
+import resource
+import shlex
+import shutil
+import signal
+import struct
+import sys
 import threading
 import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from functools import wraps
 import logging  # <-- ADDED FOR DEBUGGING
 # --- CHANGE START: new import for S3 error handling ---
 from botocore.exceptions import ClientError
 # --- CHANGE END ---
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+
+import fastq_stats
 
 # --- BOTO3 DEBUG LOGGING ---
 # This is the most important change. It will show us the raw HTTP requests.
@@ -29,16 +50,325 @@ if not BUCKET_NAME:
     print("FATAL: BUCKET_NAME environment variable is not set.")
     exit(1)
 
+# --- S3 transfer tuning (env-overridable) ---
+S3_CHUNK_SIZE = int(os.environ.get("S3_CHUNK_SIZE_MB", "64")) * 1024 * 1024
+S3_MAX_CONCURRENCY = int(os.environ.get("S3_MAX_CONCURRENCY", "16"))
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_CHUNK_SIZE,
+    multipart_chunksize=S3_CHUNK_SIZE,
+    max_concurrency=S3_MAX_CONCURRENCY,
+    use_threads=True
+)
+STREAM_CHUNK_SIZE = 1024 * 1024  # 1 MiB reads off pipes between stages
+
 # Initialize AWS clients with EXPLICIT region
-s3_client = boto3.client('s3', region_name=AWS_REGION)
+# One pooled S3 client shared by every transfer; the pool must cover all ranged GETs in flight.
+s3_client = boto3.client(
+    's3',
+    region_name=AWS_REGION,
+    config=Config(max_pool_connections=max(10, S3_MAX_CONCURRENCY * 2), retries={'max_attempts': 10, 'mode': 'adaptive'})
+)
 cloudwatch_client = boto3.client('cloudwatch', region_name=AWS_REGION)
 METRIC_NAMESPACE = "GeyserGenomics"
 
+# --- CHANGE START: asynchronous, batched metrics emitter ---
+METRICS_MODE = os.environ.get("METRICS_MODE", "api")  # api = PutMetricData, emf = Embedded Metric Format on stdout, off
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "10"))
+METRICS_BATCH_SIZE = 1000  # PutMetricData limit per request
+METRICS_MAX_ATTEMPTS = 5
+
+class MetricsBuffer:
+    """
+    Collects CloudWatch datapoints and ships them off the task's critical path.
+    - `api`: a daemon thread batches up to METRICS_BATCH_SIZE datapoints per
+      PutMetricData call, flushes every METRICS_FLUSH_INTERVAL seconds and at
+      exit, and retries with exponential backoff.
+    - `emf`: each datapoint is printed as a CloudWatch Embedded Metric Format
+      line; the awslogs driver turns it into a metric with no API call.
+    Nothing here ever raises into the caller.
+    """
+    def __init__(self, mode):
+        self.mode = mode
+        self._data = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        if mode == "api":
+            self._thread = threading.Thread(target=self._run, name="metrics-flusher", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def put(self, metric_name, value, unit, dimensions):
+        try:
+            if self.mode == "emf":
+                self._print_emf(metric_name, value, unit, dimensions)
+            elif self.mode == "api":
+                datum = {
+                    'MetricName': metric_name,
+                    'Dimensions': [{'Name': k, 'Value': str(v)} for k, v in dimensions.items()],
+                    'Timestamp': time.time(),
+                    'Value': value,
+                    'Unit': unit
+                }
+                with self._lock:
+                    self._data.append(datum)
+                    if len(self._data) >= METRICS_BATCH_SIZE:
+                        self._wake.set()
+        except Exception as e:
+            print(f"WARNING: could not record metric '{metric_name}': {e}")
+
+    def _print_emf(self, metric_name, value, unit, dimensions):
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRIC_NAMESPACE,
+                    "Dimensions": [list(dimensions.keys())],
+                    "Metrics": [{"Name": metric_name, "Unit": unit}]
+                }]
+            },
+            metric_name: value
+        }
+        record.update({k: str(v) for k, v in dimensions.items()})
+        print(json.dumps(record), flush=True)
+
+    def _send(self, batch):
+        for attempt in range(1, METRICS_MAX_ATTEMPTS + 1):
+            try:
+                cloudwatch_client.put_metric_data(Namespace=METRIC_NAMESPACE, MetricData=batch)
+                return
+            except Exception as e:
+                if attempt == METRICS_MAX_ATTEMPTS:
+                    print(f"WARNING: dropping {len(batch)} metric datapoint(s) after {attempt} attempts: {e}")
+                    return
+                time.sleep(min(2 ** attempt, 30) * 0.5)
+
+    def flush(self):
+        with self._lock:
+            pending, self._data = self._data, []
+        for i in range(0, len(pending), METRICS_BATCH_SIZE):
+            self._send(pending[i:i + METRICS_BATCH_SIZE])
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(METRICS_FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        """Final flush at exit; bounded so a CloudWatch outage cannot hang the job."""
+        self._stopped = True
+        self._wake.set()
+        self._thread.join(timeout=METRICS_FLUSH_INTERVAL)
+        self.flush()
+
+METRICS = MetricsBuffer(METRICS_MODE)
+
+def emit_metric(metric_name, value, unit, dimensions):
+    """Queue a single CloudWatch datapoint; never blocks on, or fails because of, CloudWatch."""
+    METRICS.put(metric_name, value, unit, dimensions)
+
+def _cpu_seconds() -> float:
+    """User + system CPU consumed by this process and its reaped children (bwa, samtools, ...)."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+# --- CHANGE END ---
+
+# --- CHANGE START: stage profiler (phases, bytes, child-process resources) ---
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "1"))
+PROFILE_MAX_SAMPLES = 3600  # timeline kept in the JSON artefact
+APP_VERSION = os.environ.get("APP_VERSION", "unknown")
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def _descendant_processes(root_pid: int) -> list:
+    """(pid, comm, cpu_seconds, rss_bytes) for every live descendant of `root_pid`, from /proc."""
+    stats = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                raw = f.read()
+        except OSError:
+            continue
+        # comm may contain spaces, so split around its parentheses.
+        comm = raw[raw.index("(") + 1:raw.rindex(")")]
+        fields = raw[raw.rindex(")") + 2:].split()
+        ppid = int(fields[1])
+        # utime + stime + cutime + cstime (the latter cover reaped grandchildren)
+        cpu = sum(int(x) for x in fields[11:15]) / _CLOCK_TICKS
+        rss = int(fields[21]) * _PAGE_SIZE
+        stats[int(entry)] = (ppid, comm, cpu, rss)
+
+    children = {}
+    for pid, (ppid, _, _, _) in stats.items():
+        children.setdefault(ppid, []).append(pid)
+    result, stack = [], list(children.get(root_pid, []))
+    while stack:
+        pid = stack.pop()
+        _, comm, cpu, rss = stats[pid]
+        result.append((pid, comm, cpu, rss))
+        stack.extend(children.get(pid, []))
+    return result
+
+class StageProfiler:
+    """
+    Per-task profile: sequential phases (download, reference-prep, tool,
+    upload, cleanup, ...) with wall time and S3 bytes, plus a background
+    sampler of CPU utilisation, RSS and /tmp disk use of the child tools
+    (bwa, samtools, bcftools, fastqc). `mark_phase` starts the next phase.
+    """
+    def __init__(self, task_name, srr_id):
+        self.task_name = task_name
+        self.srr_id = srr_id
+        self.start = time.time()
+        self.phases = []
+        self.samples = []
+        self.peak_rss = 0
+        self.peak_rss_by_tool = {}
+        self.disk_baseline = shutil.disk_usage("/tmp").used
+        self.peak_disk = 0
+        self.skipped = False  # set when a stage manifest short-circuits the task
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def mark_phase(self, name):
+        now = time.time()
+        with self._lock:
+            if self.phases and self.phases[-1]["end"] is None:
+                self.phases[-1]["end"] = now
+            self.phases.append({"name": name, "start": now, "end": None, "bytes_in": 0, "bytes_out": 0})
+
+    def add_bytes(self, direction, count):
+        with self._lock:
+            if not self.phases:
+                self.phases.append({"name": "setup", "start": self.start, "end": None, "bytes_in": 0, "bytes_out": 0})
+            self.phases[-1][f"bytes_{direction}"] += count
+
+    def _sample_loop(self):
+        last_time, last_cpu = time.time(), _cpu_seconds()
+        while not self._stop.wait(PROFILE_SAMPLE_INTERVAL):
+            try:
+                procs = _descendant_processes(os.getpid())
+                now = time.time()
+                cpu = _cpu_seconds() + sum(p[2] for p in procs)
+                utilisation = (cpu - last_cpu) / max(now - last_time, 1e-6) / available_cpus() * 100
+                last_time, last_cpu = now, cpu
+                rss = sum(p[3] for p in procs)
+                disk = shutil.disk_usage("/tmp").used - self.disk_baseline
+                with self._lock:
+                    self.peak_rss = max(self.peak_rss, rss)
+                    self.peak_disk = max(self.peak_disk, disk)
+                    for _, comm, _, tool_rss in procs:
+                        self.peak_rss_by_tool[comm] = max(self.peak_rss_by_tool.get(comm, 0), tool_rss)
+                    if len(self.samples) < PROFILE_MAX_SAMPLES:
+                        self.samples.append({"t": round(now - self.start, 2), "cpu_pct": round(utilisation, 1),
+                                             "rss": rss, "disk": disk, "tools": sorted({p[1] for p in procs})})
+            except Exception as e:
+                print(f"WARNING: profile sampler error: {e}")
+
+    def finish(self, status):
+        """Stops sampling, emits phase/resource metrics and uploads the JSON profile next to the sample's outputs."""
+        self._stop.set()
+        self._thread.join(timeout=PROFILE_SAMPLE_INTERVAL * 2)
+        if self.skipped:
+            # Keep the profile of the run that actually produced the outputs.
+            return None
+        end = time.time()
+        for phase in self.phases:
+            if phase["end"] is None:
+                phase["end"] = end
+        cpu_values = [sample["cpu_pct"] for sample in self.samples]
+        profile = {
+            "task": self.task_name,
+            "sample_id": self.srr_id,
+            "status": status,
+            "app_version": APP_VERSION,
+            "vcpus": available_cpus(),
+            "duration_seconds": round(end - self.start, 3),
+            "phases": [{
+                "name": phase["name"],
+                "offset_seconds": round(phase["start"] - self.start, 3),
+                "duration_seconds": round(phase["end"] - phase["start"], 3),
+                "bytes_in": phase["bytes_in"],
+                "bytes_out": phase["bytes_out"],
+            } for phase in self.phases],
+            "resources": {
+                "avg_cpu_pct": round(sum(cpu_values) / len(cpu_values), 1) if cpu_values else None,
+                "peak_cpu_pct": max(cpu_values) if cpu_values else None,
+                "peak_rss_bytes": self.peak_rss,
+                "peak_rss_bytes_by_tool": self.peak_rss_by_tool,
+                "peak_disk_bytes": self.peak_disk,
+            },
+            "samples": self.samples,
+        }
+
+        for phase in profile["phases"]:
+            dimensions = {'TaskName': self.task_name, 'Phase': phase["name"]}
+            emit_metric('PhaseDuration', phase["duration_seconds"], 'Seconds', dimensions)
+            emit_metric('PhaseBytes', phase["bytes_in"] + phase["bytes_out"], 'Bytes', dimensions)
+        dimensions = {'TaskName': self.task_name}
+        emit_metric('PeakRSS', self.peak_rss, 'Bytes', dimensions)
+        emit_metric('PeakDiskUsed', self.peak_disk, 'Bytes', dimensions)
+        if cpu_values:
+            emit_metric('AvgCpuUtilization', profile["resources"]["avg_cpu_pct"], 'Percent', dimensions)
+
+        key = f"profiles/{self.srr_id}/{self.task_name}.json"
+        try:
+            s3_client.put_object(Bucket=BUCKET_NAME, Key=key, Body=json.dumps(profile, indent=2).encode("utf-8"))
+            print(f"Wrote stage profile to s3://{BUCKET_NAME}/{key}")
+        except Exception as e:
+            print(f"WARNING: could not upload stage profile {key}: {e}")
+        return profile
+
+# Profiles are per task thread. Helper threads (download pools, stream stages)
+# have no profile of their own; work handed to them is bound to the task's
+# profiler explicitly with `bind_profiler` (StreamPipeline captures it when built).
+_profiler_state = threading.local()
+
+def current_profiler():
+    return getattr(_profiler_state, "profiler", None)
+
+def bind_profiler(func, profiler=None):
+    """
+    Wraps `func` to run under `profiler` (default: the calling thread's), so
+    phases and bytes from a helper thread are attributed to the task that
+    handed it the work rather than to whichever task happens to be running.
+    """
+    profiler = profiler or current_profiler()
+
+    @wraps(func)
+    def bound(*args, **kwargs):
+        previous = current_profiler()
+        _profiler_state.profiler = profiler
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _profiler_state.profiler = previous
+    return bound
+
+def profile_phase(name):
+    """Start the next phase of the running task's profile (no-op outside a task)."""
+    profiler = current_profiler()
+    if profiler:
+        profiler.mark_phase(name)
+
+def profile_bytes(direction, count):
+    """Attribute S3 bytes ('in' or 'out') to the current phase of the running task."""
+    profiler = current_profiler()
+    if profiler:
+        profiler.add_bytes(direction, count)
+# --- CHANGE END ---
+
 # --- Decorator for Timing and Metrics ---
 def time_task_and_emit_metric(task_name):
     """
     A decorator that times the execution of a function, prints the duration,
-    and emits a 'Duration' metric to AWS CloudWatch.
+    and queues 'Duration' and 'CpuSeconds' metrics for CloudWatch.
     """
     def decorator(func):
         @wraps(func)
@@ -46,207 +376,1682 @@ def time_task_and_emit_metric(task_name):
             srr_id = args[0] if args else "UnknownSample"
             print(f"--- Starting task '{task_name}' for sample '{srr_id}' ---")
             start_time = time.time()
+            start_cpu = _cpu_seconds()
+            profiler = _profiler_state.profiler = StageProfiler(task_name, srr_id)
             try:
                 result = func(*args, **kwargs)
+                profiler.finish("Success")
                 end_time = time.time()
                 duration_seconds = end_time - start_time
 
                 print(f"--- Task '{task_name}' for sample '{srr_id}' completed in {duration_seconds:.2f} seconds. ---")
 
-                print("--- ATTEMPTING TO SEND CLOUDWATCH METRIC ---")
-                cloudwatch_client.put_metric_data(
-                    Namespace=METRIC_NAMESPACE,
-                    MetricData=[
-                        {
-                            'MetricName': 'Duration',
-                            'Dimensions': [
-                                {'Name': 'TaskName', 'Value': task_name},
-                                {'Name': 'SampleId', 'Value': srr_id},
-                                {'Name': 'Status', 'Value': 'Success'}
-                            ],
-                            'Value': duration_seconds,
-                            'Unit': 'Seconds'
-                        },
-                    ]
-                )
-                print("--- BOTO3 CALL COMPLETED WITHOUT EXCEPTION ---")
+                dimensions = {'TaskName': task_name, 'SampleId': srr_id, 'Status': 'Success'}
+                emit_metric('Duration', duration_seconds, 'Seconds', dimensions)
+                emit_metric('CpuSeconds', _cpu_seconds() - start_cpu, 'Seconds', dimensions)
                 return result
             except Exception as e:
                 end_time = time.time()
                 duration_seconds = end_time - start_time
                 print(f"--- Task '{task_name}' for sample '{srr_id}' FAILED after {duration_seconds:.2f} seconds. Error: {e} ---")
+                profiler.finish("Failure")
 
-                print("--- ATTEMPTING TO SEND FAILURE METRIC TO CLOUDWATCH ---")
-                cloudwatch_client.put_metric_data(
-                    Namespace=METRIC_NAMESPACE,
-                    MetricData=[
-                        {
-                            'MetricName': 'Duration',
-                            'Dimensions': [
-                                {'Name': 'TaskName', 'Value': task_name},
-                                {'Name': 'SampleId', 'Value': srr_id},
-                                {'Name': 'Status', 'Value': 'Failure'}
-                            ],
-                            'Value': duration_seconds,
-                            'Unit': 'Seconds'
-                        },
-                        {
-                            'MetricName': 'FailureCount',
-                            'Dimensions': [
-                                {'Name': 'TaskName', 'Value': task_name},
-                                {'Name': 'SampleId', 'Value': srr_id}
-                            ],
-                            'Value': 1,
-                            'Unit': 'Count'
-                        }
-                    ]
-                )
-                print("--- BOTO3 FAILURE CALL COMPLETED WITHOUT EXCEPTION ---")
+                emit_metric('Duration', duration_seconds, 'Seconds',
+                            {'TaskName': task_name, 'SampleId': srr_id, 'Status': 'Failure'})
+                emit_metric('FailureCount', 1, 'Count', {'TaskName': task_name, 'SampleId': srr_id})
                 # Re-raise the exception to ensure the Batch job is marked as failed
                 raise
+            finally:
+                _profiler_state.profiler = None
 
         return wrapper
     return decorator
 
-# --- CHANGE START: helper to safely fetch reference + indexes from S3 ---
-def ensure_reference_local(reference_name: str) -> str:
+# --- CHANGE START: shared concurrent ranged downloader ---
+def _download_range(key, etag, fd, start, end, attempts=3):
     """
-    Ensure the target reference FASTA and its indexes exist locally under /tmp/reference/.
-    - Downloads specific keys from S3 (no bulk prefix iteration).
-    - Skips missing index keys (they will be created if needed).
-    - Generates bwa + faidx indexes if absent.
+    Fetches bytes [start, end] of `key` and writes them at the same offset of `fd`.
+    `IfMatch` pins every range to the object version `etag` names, so an overwrite
+    mid-download fails with PreconditionFailed instead of mixing two versions.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            body = s3_client.get_object(Bucket=BUCKET_NAME, Key=key, Range=f"bytes={start}-{end}", IfMatch=etag)['Body']
+            offset = start
+            for chunk in body.iter_chunks(chunk_size=1024 * 1024):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+            if offset != end + 1:
+                raise IOError(f"Short read on {key} range {start}-{end}: got {offset - start} bytes")
+            return
+        except Exception as e:
+            if attempt == attempts or (isinstance(e, ClientError) and e.response['Error']['Code'] in ("404", "NoSuchKey", "403", "412", "PreconditionFailed")):
+                raise
+            print(f"Retrying range {start}-{end} of {key} (attempt {attempt}) after error: {e}")
+            time.sleep(2 ** attempt)
 
-    Returns the local path to the FASTA file.
+def download_object(key: str, local_path: str) -> int:
     """
-    local_ref_dir = "/tmp/reference/"
-    os.makedirs(local_ref_dir, exist_ok=True)
+    Downloads s3://BUCKET_NAME/key to `local_path` using parallel byte-range GETs.
+    - Chunk size / concurrency come from S3_CHUNK_SIZE_MB / S3_MAX_CONCURRENCY.
+    - The local file is preallocated and each range is written in place (no temp parts).
+    - Raises ClientError (e.g. 404) exactly like `download_file` would, and
+      PreconditionFailed if the object is overwritten during the download.
 
-    # Keys we care about in S3
-    fasta_key = f"{REFERENCE_PREFIX}{reference_name}"
-    index_candidates = [
-        f"{fasta_key}.fai",               # samtools faidx
-        f"{fasta_key}.amb", f"{fasta_key}.ann", f"{fasta_key}.bwt",
-        f"{fasta_key}.pac", f"{fasta_key}.sa"   # bwa index set
-    ]
+    Returns the object size in bytes.
+    """
+    head = s3_client.head_object(Bucket=BUCKET_NAME, Key=key)
+    size, etag = head['ContentLength'], head['ETag']
+    start_time = time.time()
+    fd = os.open(local_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if size:
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except (AttributeError, OSError):
+                os.ftruncate(fd, size)
+        ranges = [(start, min(start + S3_CHUNK_SIZE, size) - 1) for start in range(0, size, S3_CHUNK_SIZE)]
+        with ThreadPoolExecutor(max_workers=max(1, min(S3_MAX_CONCURRENCY, len(ranges)))) as pool:
+            for future in [pool.submit(_download_range, key, etag, fd, start, end) for start, end in ranges]:
+                future.result()
+    except Exception:
+        os.close(fd)
+        os.remove(local_path)
+        raise
+    os.close(fd)
+
+    elapsed = time.time() - start_time
+    throughput = (size / 1_000_000) / elapsed if elapsed > 0 else 0.0
+    print(f"Downloaded s3://{BUCKET_NAME}/{key} ({size / 1_000_000:.1f} MB) in {elapsed:.2f}s ({throughput:.1f} MB/s)")
+    profile_bytes("in", size)
+    return size
 
-    # Local paths
-    local_ref_path = os.path.join(local_ref_dir, reference_name)
+def upload_object(local_path: str, key: str) -> int:
+    """Uploads a local file with the shared TransferConfig and records its size in the task profile."""
+    size = os.path.getsize(local_path)
+    s3_client.upload_file(local_path, BUCKET_NAME, key, Config=TRANSFER_CONFIG)
+    profile_bytes("out", size)
+    return size
+# --- CHANGE END ---
+
+# --- CHANGE START: skip-if-done stage manifests ---
+FORCE_RERUN = os.environ.get("FORCE_RERUN", "0") == "1"  # also set by --force
+_tool_version_cache = {}
 
-    # 1) Download the FASTA (required)
+def tool_version(tool: str) -> str:
+    """First version line reported by a pipeline tool (cached per process)."""
+    if tool not in _tool_version_cache:
+        # bwa has no --version flag; it prints "Version: ..." in its usage text.
+        command = [tool] if tool == "bwa" else [tool, "--version"]
+        try:
+            result = subprocess.run(command, capture_output=True, text=True)
+            lines = (result.stdout + result.stderr).splitlines()
+            version = next((l for l in lines if "version" in l.lower()), lines[0] if lines else "unknown")
+        except OSError:
+            version = "missing"
+        _tool_version_cache[tool] = version.strip()
+    return _tool_version_cache[tool]
+
+def _object_etag(key: str):
     try:
-        print(f"Downloading FASTA: s3://{BUCKET_NAME}/{fasta_key} -> {local_ref_path}")
-        s3_client.download_file(BUCKET_NAME, fasta_key, local_ref_path)
-    except ClientError as e:
-        print(f"ERROR: Required FASTA not found in S3 at {fasta_key}: {e}")
-        raise FileNotFoundError(f"Reference FASTA missing: s3://{BUCKET_NAME}/{fasta_key}") from e
-
-    # 2) Try to download known index files (optional)
-    for key in index_candidates:
-        local_path = os.path.join(local_ref_dir, os.path.basename(key))
+        return s3_client.head_object(Bucket=BUCKET_NAME, Key=key)['ETag'].strip('"')
+    except ClientError:
+        return None
+
+class StageManifest:
+    """
+    Small JSON record written next to a stage's primary output: input ETags,
+    reference FASTA ETag, tool versions and APP_VERSION, plus the ETags of the
+    outputs it produced. A stage whose manifest still matches its current
+    inputs - and whose outputs are untouched - can be skipped on re-runs.
+    """
+    def __init__(self, task_name, srr_id, primary_output_key, inputs, reference_name=None, tools=()):
+        self.task_name = task_name
+        self.srr_id = srr_id
+        self.key = f"{primary_output_key}.manifest.json"
+        self.inputs = list(inputs)
+        self.reference_key = f"{REFERENCE_PREFIX}{reference_name}" if reference_name else None
+        self.tools = list(tools)
+
+    def _fingerprint(self) -> dict:
+        return {
+            "task": self.task_name,
+            "srr_id": self.srr_id,
+            "app_version": APP_VERSION,
+            "tool_versions": {tool: tool_version(tool) for tool in self.tools},
+            "inputs": {key: _object_etag(key) for key in self.inputs},
+            "reference": {self.reference_key: _object_etag(self.reference_key)} if self.reference_key else {},
+        }
+
+    def is_current(self) -> bool:
+        """True if the stored manifest matches the current inputs and every recorded output is intact."""
+        if FORCE_RERUN:
+            print(f"--force set; re-running '{self.task_name}' for {self.srr_id}")
+            return False
         try:
-            print(f"Attempting index fetch: s3://{BUCKET_NAME}/{key}")
-            s3_client.download_file(BUCKET_NAME, key, local_path)
-        except ClientError as e:
-            # Most likely a 404; we’ll generate it later if needed.
-            print(f"Index not present (ok): s3://{BUCKET_NAME}/{key} -> {e}")
-
-    # 3) Generate any missing indexes
-    bwa_exts = [".amb", ".ann", ".bwt", ".pac", ".sa"]
-    if any(not os.path.exists(local_ref_path + ext) for ext in bwa_exts):
+            stored = json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=self.key)['Body'].read())
+        except ClientError:
+            return False
+        fingerprint = self._fingerprint()
+        if None in fingerprint["inputs"].values() or None in fingerprint["reference"].values():
+            return False
+        if any(stored.get(field) != value for field, value in fingerprint.items()):
+            print(f"Manifest s3://{BUCKET_NAME}/{self.key} is stale; re-running.")
+            return False
+        if any(_object_etag(key) != etag for key, etag in stored.get("outputs", {}).items()):
+            print(f"Outputs recorded in s3://{BUCKET_NAME}/{self.key} changed or are missing; re-running.")
+            return False
+        print(f"Skipping '{self.task_name}' for {self.srr_id}: outputs match manifest s3://{BUCKET_NAME}/{self.key}")
+        emit_metric('SkippedCount', 1, 'Count', {'TaskName': self.task_name})
+        if current_profiler():
+            current_profiler().skipped = True
+        return True
+
+    def write(self, output_keys):
+        manifest = self._fingerprint()
+        manifest["outputs"] = {key: _object_etag(key) for key in output_keys}
+        manifest["created_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=self.key, Body=json.dumps(manifest, indent=2).encode("utf-8"))
+        print(f"Wrote stage manifest to s3://{BUCKET_NAME}/{self.key}")
+# --- CHANGE END ---
+
+# --- CHANGE START: content-addressed, node-persistent reference cache ---
+# The Batch job definition mounts a shared EFS volume here (infrastructure/main.tf), so
+# each reference version is downloaded once for all jobs; the /tmp default is per-task.
+REFERENCE_CACHE_DIR = os.environ.get("REFERENCE_CACHE_DIR", "/tmp/reference_cache")
+REFERENCE_CACHE_MAX_BYTES = int(float(os.environ.get("REFERENCE_CACHE_MAX_GB", "50")) * 1024 ** 3)
+BWA_INDEX_EXTS = [".amb", ".ann", ".bwt", ".pac", ".sa"]
+# Index files each stage actually needs; bcftools only reads the FASTA + .fai.
+REFERENCE_PROFILES = {
+    "align": [".fai"] + BWA_INDEX_EXTS,
+    "variants": [".fai"],
+}
+CACHE_COMPLETE_MARKER = ".complete"  # JSON list of the extensions ("" = FASTA) fully present in the entry
+
+# Shared locks on the cache entries this process is using; held until exit so
+# another job's eviction pass can never delete a reference out from under us.
+_reference_locks = {}
+# (reference_name, profile) -> local FASTA path already prepared by this process.
+_reference_paths = {}
+_reference_guard = threading.Lock()
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _is_current(lock_file, path: str) -> bool:
+    """False once eviction has unlinked (or replaced) the lock file at `path`."""
+    try:
+        return os.fstat(lock_file.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+def _lock_file(path: str, mode: int):
+    """
+    Opens `path` and flocks it in `mode`. Eviction unlinks lock files, so a lock
+    won on a file that has meanwhile been unlinked is retried on the new one.
+    """
+    while True:
+        lock_file = open(path, "a")
+        fcntl.flock(lock_file, mode)
+        if _is_current(lock_file, path):
+            return lock_file
+        lock_file.close()
+
+def _ready_extensions(entry_dir: str) -> set:
+    """Extensions the entry's marker lists as complete; empty for a missing or half-built entry."""
+    try:
+        with open(os.path.join(entry_dir, CACHE_COMPLETE_MARKER)) as f:
+            return set(json.load(f))
+    except (OSError, ValueError, TypeError):
+        return set()
+
+def _write_ready_extensions(entry_dir: str, extensions: set):
+    marker = os.path.join(entry_dir, CACHE_COMPLETE_MARKER)
+    with open(marker + ".tmp", "w") as f:
+        json.dump(sorted(extensions), f)
+    os.replace(marker + ".tmp", marker)  # readers never see a partial marker
+
+def _evict_reference_cache(keep: str):
+    """
+    Size-bounded LRU eviction. Entries are ordered by the mtime of their
+    completion marker (touched on every use; unmarked leftovers of a crashed
+    build go first) and removed, together with their lock files, only under an
+    exclusive entry lock, so entries a running job holds shared are skipped.
+    Lock files whose entry no longer exists are removed as well.
+    """
+    entries = []
+    for name in os.listdir(REFERENCE_CACHE_DIR):
+        path = os.path.join(REFERENCE_CACHE_DIR, name)
+        if os.path.isdir(path):
+            marker = os.path.join(path, CACHE_COMPLETE_MARKER)
+            last_used = os.path.getmtime(marker) if os.path.exists(marker) else 0
+            entries.append((last_used, path, _dir_size(path)))
+        elif name.endswith(".lock") and not os.path.exists(path[:-len(".lock")]):
+            entries.append((0, path[:-len(".lock")], 0))  # orphaned lock files
+
+    total = sum(size for _, _, size in entries)
+    for last_used, entry_dir, size in sorted(entries):
+        if total <= REFERENCE_CACHE_MAX_BYTES and os.path.isdir(entry_dir):
+            continue
+        if entry_dir == keep:
+            continue
+        with open(entry_dir + ".lock", "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if size:
+                    print(f"Reference cache entry in use, not evicting: {entry_dir}")
+                continue
+            if not _is_current(lock_file, entry_dir + ".lock"):
+                continue  # another job evicted it first
+            if size:
+                print(f"Evicting reference cache entry {entry_dir} ({size / 1_000_000:.1f} MB)")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            for suffix in (".build", ".lock"):
+                try:
+                    os.remove(entry_dir + suffix)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+def _list_reference_objects(fasta_key: str) -> dict:
+    """
+    One paginated listing under the FASTA key resolves which reference objects
+    exist (FASTA and every index), instead of a failed GET per missing index.
+    """
+    objects = {}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=fasta_key):
+        for obj in page.get("Contents", []):
+            objects[obj["Key"]] = obj
+    return objects
+
+def _populate_reference_entry(fasta_key: str, local_ref_path: str, needed_exts: list, available: dict):
+    """
+    Brings a cache entry up to `needed_exts` ("" is the FASTA itself): fetches
+    what S3 has concurrently, builds whatever is still missing, and uploads
+    those builds back to S3 so no later job has to rebuild them.
+    """
+    to_fetch = [ext for ext in needed_exts if fasta_key + ext in available]
+    skipped = [ext for ext in needed_exts if ext not in to_fetch]
+    if skipped:
+        print(f"Index objects not in S3 (will build): {', '.join(skipped)}")
+    with ThreadPoolExecutor(max_workers=max(1, len(to_fetch))) as pool:
+        futures = [pool.submit(bind_profiler(download_object), fasta_key + ext, local_ref_path + ext) for ext in to_fetch]
+        for future in futures:
+            future.result()
+
+    generated = []
+    if any(ext in needed_exts and not os.path.exists(local_ref_path + ext) for ext in BWA_INDEX_EXTS):
         print("BWA indexes missing; running `bwa index` ...")
         subprocess.run(["bwa", "index", local_ref_path], check=True)
+        generated += BWA_INDEX_EXTS
 
-    if not os.path.exists(local_ref_path + ".fai"):
+    if ".fai" in needed_exts and not os.path.exists(local_ref_path + ".fai"):
         print("FASTA index missing; running `samtools faidx` ...")
         subprocess.run(["samtools", "faidx", local_ref_path], check=True)
+        generated.append(".fai")
+
+    for ext in generated:
+        key = fasta_key + ext
+        print(f"Uploading generated index to s3://{BUCKET_NAME}/{key}")
+        upload_object(local_ref_path + ext, key)
 
-    return local_ref_path
+def ensure_reference_local(reference_name: str, profile: str = "align") -> str:
+    """
+    Ensure the target reference FASTA and the indexes `profile` needs exist in the local reference cache.
+    - `profile` selects the index set: "align" (bwa + faidx) or "variants" (faidx only).
+    - Existing S3 objects are resolved with one listing and fetched concurrently.
+    - Cache entries are keyed by the FASTA's S3 ETag, so a changed reference gets a new entry.
+    - Jobs hold a shared lock on the entry for their lifetime, so any number of them
+      use one copy while eviction (which needs it exclusively) stays out. Filling
+      in missing files is serialised by a separate build lock, so concurrent misses
+      share one download/build and never wait for a running job to finish.
+    - Locally generated indexes are uploaded back to S3.
+    - The cache is kept under REFERENCE_CACHE_MAX_GB with LRU eviction.
+
+    Returns the local path to the FASTA file.
+    """
+    with _reference_guard:  # threads in batch mode share one lock fd per entry, so serialise here
+        memo_key = (reference_name, profile)
+        if memo_key in _reference_paths:
+            return _reference_paths[memo_key]
+
+        fasta_key = f"{REFERENCE_PREFIX}{reference_name}"
+        available = _list_reference_objects(fasta_key)
+        if fasta_key not in available:
+            print(f"ERROR: Required FASTA not found in S3 at {fasta_key}")
+            raise FileNotFoundError(f"Reference FASTA missing: s3://{BUCKET_NAME}/{fasta_key}")
+        etag = available[fasta_key]['ETag'].strip('"')
+
+        os.makedirs(REFERENCE_CACHE_DIR, exist_ok=True)
+        entry_dir = os.path.join(REFERENCE_CACHE_DIR, f"{reference_name}.{etag.replace('-', '_')}")
+        local_ref_path = os.path.join(entry_dir, reference_name)
+        needed = {""} | set(REFERENCE_PROFILES[profile])
+
+        newly_locked = entry_dir not in _reference_locks
+        if newly_locked:
+            _reference_locks[entry_dir] = _lock_file(entry_dir + ".lock", fcntl.LOCK_SH)
+        built = False
+        if needed <= _ready_extensions(entry_dir):
+            print(f"Reference cache hit ({profile}): {entry_dir}")
+            os.utime(os.path.join(entry_dir, CACHE_COMPLETE_MARKER))  # LRU touch
+        else:
+            with _lock_file(entry_dir + ".build", fcntl.LOCK_EX):
+                ready = _ready_extensions(entry_dir)  # another job may have built it while we waited
+                missing = sorted(needed - ready)
+                if missing:
+                    print(f"Reference cache miss ({profile}): populating {entry_dir}")
+                    os.makedirs(entry_dir, exist_ok=True)
+                    for ext in missing:  # leftovers of a crashed build are not trusted
+                        if os.path.exists(local_ref_path + ext):
+                            os.remove(local_ref_path + ext)
+                    _populate_reference_entry(fasta_key, local_ref_path, missing, available)
+                    _write_ready_extensions(entry_dir, ready | set(missing))
+                    built = True
+                else:
+                    print(f"Reference cache hit ({profile}) after waiting for another build: {entry_dir}")
+        if newly_locked or built:
+            _evict_reference_cache(keep=entry_dir)
+
+        _reference_paths[memo_key] = local_ref_path
+        return local_ref_path
+# --- CHANGE END ---
+
+# --- CHANGE START: pluggable decompression backends ---
+DECOMPRESS_BACKEND = os.environ.get("DECOMPRESS_BACKEND", "auto")  # auto|zlib|bgzf|pigz|igzip|bgzip|gunzip
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+
+# Caps available_cpus(); run_batch gives each concurrent sample process an equal share.
+TASK_CPUS = int(os.environ.get("TASK_CPUS", "0"))
+
+def available_cpus() -> int:
+    """Number of vCPUs this container may actually run on (Fargate reports the task's share), capped by TASK_CPUS."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return min(cpus, TASK_CPUS) if TASK_CPUS > 0 else cpus
+
+def is_bgzf(header: bytes) -> bool:
+    """True if `header` starts a BGZF block (gzip member with a 'BC' extra subfield)."""
+    if len(header) < 18 or not header.startswith(BGZF_MAGIC):
+        return False
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = header[12:12 + xlen]
+    pos = 0
+    while pos + 4 <= len(extra):
+        si1, si2, slen = extra[pos], extra[pos + 1], struct.unpack("<H", extra[pos + 2:pos + 4])[0]
+        if si1 == 66 and si2 == 67 and slen == 2:
+            return True
+        pos += 4 + slen
+    return False
+
+class _CountingReader:
+    """Wraps a readable binary stream and counts the bytes read through it."""
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self):
+        line = self.raw.readline()
+        self.bytes_read += len(line)
+        return line
+
+    def close(self):
+        self.raw.close()
+
+class Decompressor(ABC):
+    """
+    Common surface for every decompression backend:
+    - `stdout`: readable stream of decompressed bytes
+    - `feed(chunks)`: push compressed chunks in (blocking), then close the input
+    - `wait()`: raise if the backend failed, including on corrupt or truncated input
+    """
+    name = "base"
+
+    @abstractmethod
+    def feed(self, chunks):
+        """Writes every compressed chunk to the backend, then closes its input."""
+
+    @abstractmethod
+    def wait(self):
+        """Blocks until the backend has finished; raises if it failed."""
+
+class SubprocessDecompressor(Decompressor):
+    """Runs an external decompressor (gunzip, pigz, igzip, bgzip) over stdin/stdout."""
+    def __init__(self, name, command):
+        self.name = name
+        self.bytes_in = 0
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.stdout = _CountingReader(self.process.stdout)
+        # Drained as it is written; reading it only after exit can deadlock once the pipe fills.
+        self._stderr = _StderrTail(self.process.stderr, name)
+
+    def feed(self, chunks):
+        try:
+            for chunk in chunks:
+                self.process.stdin.write(chunk)
+                self.bytes_in += len(chunk)
+        finally:
+            self.process.stdin.close()
+
+    def wait(self):
+        return_code = self.process.wait()
+        if return_code != 0:
+            error_output = self._stderr.text()
+            print(f"{self.name} process failed with return code {return_code}. Error: {error_output}")
+            raise subprocess.CalledProcessError(return_code, self.process.args, stderr=error_output)
+
+class InProcessDecompressor(Decompressor):
+    """
+    Decodes in Python and exposes the result through an OS pipe, so callers can
+    treat it exactly like a subprocess' stdout.
+    """
+    def __init__(self):
+        read_fd, write_fd = os.pipe()
+        self.stdout = _CountingReader(os.fdopen(read_fd, "rb"))
+        self._sink = os.fdopen(write_fd, "wb")
+        self.bytes_in = 0
+        self.error = None
+
+    def _counted(self, chunks):
+        for chunk in chunks:
+            self.bytes_in += len(chunk)
+            yield chunk
+
+    def feed(self, chunks):
+        try:
+            self.decode(self._counted(chunks), self._sink)
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self._sink.close()
+
+    def wait(self):
+        if self.error:
+            raise self.error
+
+    @abstractmethod
+    def decode(self, chunks, sink):
+        """Decodes compressed `chunks` into `sink`; raises ValueError on corrupt or truncated input."""
+
+class ZlibDecompressor(InProcessDecompressor):
+    """
+    Streaming `zlib` gzip decoder; handles multi-member files. Like gunzip, it
+    rejects empty input, a member cut short and bytes after the last member
+    that do not start another one.
+    """
+    name = "zlib"
+
+    def decode(self, chunks, sink):
+        decoder = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        members = 0
+        in_member = False  # the current decoder has consumed input but not reached its member's end
+        try:
+            for chunk in chunks:
+                while chunk:
+                    sink.write(decoder.decompress(chunk))
+                    in_member = not decoder.eof
+                    if in_member:
+                        break
+                    members += 1
+                    chunk = decoder.unused_data
+                    decoder = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt gzip stream after {members} complete member(s): {e}") from e
+        if in_member:
+            raise ValueError(f"Truncated gzip stream: member {members + 1} has no end")
+        if members == 0:
+            raise ValueError("Empty gzip stream")
+
+class BgzfDecompressor(InProcessDecompressor):
+    """
+    Block-parallel BGZF decoder. Each BGZF block is an independent gzip member
+    with its compressed size in the header, so blocks are inflated on a thread
+    pool (zlib releases the GIL) and written back in order.
+    """
+    name = "bgzf"
+
+    def __init__(self, threads):
+        super().__init__()
+        self.threads = threads
+
+    @staticmethod
+    def _inflate(block):
+        xlen = struct.unpack("<H", block[10:12])[0]
+        crc, isize = struct.unpack("<II", block[-8:])
+        try:
+            data = zlib.decompress(block[12 + xlen:-8], -zlib.MAX_WBITS)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt BGZF block: {e}") from e
+        if len(data) != isize or zlib.crc32(data) != crc:
+            raise ValueError("BGZF block failed CRC/size check")
+        return data
+
+    def decode(self, chunks, sink):
+        pending = deque()
+        buffer = bytearray()
+        blocks = 0
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            for chunk in chunks:
+                buffer += chunk
+                while len(buffer) >= 18:
+                    if not buffer.startswith(BGZF_MAGIC):
+                        raise ValueError("Input is not valid BGZF")
+                    xlen = struct.unpack("<H", buffer[10:12])[0]
+                    bsize = None
+                    pos = 12
+                    while pos + 4 <= 12 + xlen:
+                        slen = struct.unpack("<H", buffer[pos + 2:pos + 4])[0]
+                        if buffer[pos:pos + 2] == b"BC":
+                            bsize = struct.unpack("<H", buffer[pos + 4:pos + 6])[0] + 1
+                        pos += 4 + slen
+                    if bsize is None:
+                        raise ValueError("BGZF block without BSIZE subfield")
+                    if len(buffer) < bsize:
+                        break
+                    pending.append(pool.submit(self._inflate, bytes(buffer[:bsize])))
+                    blocks += 1
+                    del buffer[:bsize]
+                    # Bound in-flight blocks so memory stays flat on multi-GB inputs.
+                    while len(pending) >= self.threads * 4:
+                        sink.write(pending.popleft().result())
+            if buffer:
+                raise ValueError("Truncated BGZF stream")
+            if blocks == 0:
+                raise ValueError("Empty BGZF stream")
+            while pending:
+                sink.write(pending.popleft().result())
+
+def open_decompressor(header: bytes, backend: str = DECOMPRESS_BACKEND) -> Decompressor:
+    """
+    Picks a decompression backend. With `auto`, BGZF input goes to `bgzip -@`
+    (or the in-process block-parallel decoder), plain gzip to igzip, then pigz,
+    then in-process zlib.
+    """
+    threads = available_cpus()
+    commands = {
+        "gunzip": ["gunzip", "-c"],
+        "pigz": ["pigz", "-dc", "-p", str(threads)],
+        "igzip": ["igzip", "-dc", "-T", str(threads)],
+        "bgzip": ["bgzip", "-dc", "-@", str(threads)],
+    }
+
+    if backend == "auto":
+        if is_bgzf(header):
+            candidates = ["bgzip", "bgzf"]
+        else:
+            candidates = ["igzip", "pigz", "zlib"]
+        backend = next(c for c in candidates if c not in commands or shutil.which(c))
+        print(f"Auto-selected decompression backend: {backend} ({threads} threads)")
+
+    if backend == "zlib":
+        return ZlibDecompressor()
+    if backend == "bgzf":
+        return BgzfDecompressor(threads)
+    if backend in commands:
+        return SubprocessDecompressor(backend, commands[backend])
+    raise ValueError(f"Unknown decompression backend '{backend}'")
+
+def report_decompression_throughput(srr_id, decompressor, elapsed_seconds):
+    """Prints and emits the MB/s the chosen backend achieved (measured on decompressed output)."""
+    mb_in = decompressor.bytes_in / 1_000_000
+    mb_out = decompressor.stdout.bytes_read / 1_000_000
+    throughput = mb_out / elapsed_seconds if elapsed_seconds > 0 else 0.0
+    print(
+        f"Decompression backend '{decompressor.name}': {mb_in:.1f} MB in -> {mb_out:.1f} MB out "
+        f"in {elapsed_seconds:.2f}s ({throughput:.1f} MB/s)"
+    )
+    emit_metric("DecompressThroughput", throughput, "Megabytes/Second",
+                {"Backend": decompressor.name, "SampleId": srr_id})
+# --- CHANGE END ---
+
+# --- CHANGE START: paired-end raw reads ---
+MATE_SUFFIXES = ("_1", "_2")
+
+def raw_read_keys(srr_id: str) -> list:
+    """
+    The raw FASTQ object(s) for a sample: `raw_reads/{srr_id}.fastq.gz`, or for
+    paired-end uploads `raw_reads/{srr_id}_1.fastq.gz` and `..._2.fastq.gz`.
+    """
+    single_key = f"raw_reads/{srr_id}.fastq.gz"
+    mate_keys = [f"raw_reads/{srr_id}{suffix}.fastq.gz" for suffix in MATE_SUFFIXES]
+    if _object_etag(single_key) is None and all(_object_etag(key) for key in mate_keys):
+        return mate_keys
+    return [single_key]
+# --- CHANGE END ---
+
+# --- CHANGE START: bounded, backpressured streaming pipeline ---
+STREAM_BUFFERS = int(os.environ.get("STREAM_BUFFERS", "8"))  # STREAM_CHUNK_SIZE buffers per pipe between stages
+STREAM_UPLOAD_CONCURRENCY = int(os.environ.get("STREAM_UPLOAD_CONCURRENCY", "4"))  # multipart parts in flight per S3 sink
+STREAM_MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+STREAM_POLL_SECONDS = 0.2  # how often blocked stages check for a failure elsewhere
+STREAM_ABORT_GRACE_SECONDS = 10
+STDERR_TAIL_LINES = 50
+
+class _StreamAborted(Exception):
+    """Raised inside a pipeline thread once another stage has failed."""
+
+class _StderrTail:
+    """
+    Drains a subprocess' stderr on its own thread, so a chatty tool can never
+    block on a full stderr pipe. Lines are echoed to the log with the stage
+    label and the last STDERR_TAIL_LINES are kept for error messages.
+    """
+    def __init__(self, stream, label, echo=True):
+        self.lines = deque(maxlen=STDERR_TAIL_LINES)
+        self._thread = threading.Thread(target=self._drain, args=(stream, label, echo), daemon=True)
+        self._thread.start()
+
+    def _drain(self, stream, label, echo):
+        for raw_line in iter(stream.readline, b""):
+            line = raw_line.decode("utf-8", errors="replace").rstrip()
+            self.lines.append(line)
+            if echo:
+                print(f"[{label}] {line}")
+        stream.close()
+
+    def text(self, timeout=5):
+        self._thread.join(timeout)
+        return "\n".join(self.lines)
+
+class _Channel:
+    """
+    A pipe between two pipeline stages built on a fixed pool of reusable
+    buffers. Producers `acquire()` a free buffer (blocking while all are in
+    flight, which is the backpressure), fill it and `push()` it; the single
+    consumer iterates `chunks()`, which hands each buffer back to the pool
+    once the consumer moves on. Every wait gives up with _StreamAborted as
+    soon as any stage of the pipeline has failed.
+    """
+    def __init__(self, pipeline, buffers, chunk_size):
+        self._pipeline = pipeline
+        self._free = queue.Queue()
+        for _ in range(buffers):
+            self._free.put(bytearray(chunk_size))
+        self._filled = queue.Queue()
+
+    def _wait(self, q):
+        while True:
+            if self._pipeline.failed.is_set():
+                raise _StreamAborted()
+            try:
+                return q.get(timeout=STREAM_POLL_SECONDS)
+            except queue.Empty:
+                if self._pipeline.failed.is_set():
+                    raise _StreamAborted()
+
+    def acquire(self) -> bytearray:
+        return self._wait(self._free)
+
+    def push(self, buffer, length):
+        self._filled.put((buffer, length))
+
+    def release(self, buffer):
+        self._free.put(buffer)
+
+    def close(self):
+        """Marks end of stream. Only called by a producer that finished cleanly."""
+        self._filled.put(None)
+
+    def chunks(self):
+        """Yields a memoryview per filled buffer until end of stream."""
+        while True:
+            item = self._wait(self._filled)
+            if item is None:
+                return
+            buffer, length = item
+            try:
+                yield memoryview(buffer)[:length]
+            finally:
+                self.release(buffer)
+
+class _ChannelWriter:
+    """File-like writer that packs arbitrary writes into a channel's pool buffers."""
+    def __init__(self, channel):
+        self.channel = channel
+        self.buffer = None
+        self.length = 0
+        self.bytes_written = 0
+
+    def write(self, data):
+        view = memoryview(data).cast("B")
+        self.bytes_written += len(view)
+        while view:
+            if self.buffer is None:
+                self.buffer = self.channel.acquire()
+                self.length = 0
+            n = min(len(self.buffer) - self.length, len(view))
+            self.buffer[self.length:self.length + n] = view[:n]
+            self.length += n
+            view = view[n:]
+            if self.length == len(self.buffer):
+                self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer is not None and self.length:
+            self.channel.push(self.buffer, self.length)
+            self.buffer = None
+
+    def close(self):
+        self.flush()
+        if self.buffer is not None:
+            self.channel.release(self.buffer)
+            self.buffer = None
+        self.channel.close()
+
+class _ChannelReader(io.RawIOBase):
+    """Raw reader over a channel; wrap in io.BufferedReader for C-speed readline()."""
+    def __init__(self, channel):
+        self._chunks = channel.chunks()
+        self._view = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self._view:
+            self._view = next(self._chunks, None)
+            if self._view is None:
+                self._view = memoryview(b"")
+                return 0
+        n = min(len(b), len(self._view))
+        b[:n] = self._view[:n]
+        self._view = self._view[n:]
+        return n
+
+def _write_all(stream, view):
+    """Writes a whole buffer to an unbuffered pipe, which may accept it in pieces."""
+    while view:
+        view = view[stream.write(view):]
+
+class _StageCounter:
+    def __init__(self, label):
+        self.label = label
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+class StreamPipeline:
+    """
+    Chains S3 readers, subprocess stages and S3 multipart writers as one
+    streaming graph, e.g.
+
+        pipeline = StreamPipeline("align SRR...")
+        reads = pipeline.s3_source("decompressed/SRR....fastq")
+        bam = pipeline.process("bwa mem | samtools sort", "set -o pipefail; bwa mem ... | samtools sort ...", reads)
+        pipeline.s3_sink(bam, "alignments/SRR....bam")
+        pipeline.run()
+
+    - Memory is bounded: every pipe between stages is a pool of STREAM_BUFFERS
+      x STREAM_CHUNK_SIZE buffers, and every S3 sink holds at most
+      STREAM_UPLOAD_CONCURRENCY + 1 parts. A slow stage blocks the ones
+      upstream of it instead of letting data pile up.
+    - The first exception in any stage (including a non-zero exit, reported
+      with the tool's stderr tail) stops every other stage, kills the
+      subprocesses and aborts the multipart uploads, then is re-raised by
+      `run()`. Uploads are only completed once every stage has succeeded, so
+      a failed stream never leaves a truncated object in S3.
+    - Subprocess stderr is drained concurrently, and bytes in/out are counted
+      per stage (returned by `run()` and added to the task profile).
+    """
+    def __init__(self, name, buffers=STREAM_BUFFERS, chunk_size=STREAM_CHUNK_SIZE):
+        self.name = name
+        self.buffers = buffers
+        self.chunk_size = chunk_size
+        self.failed = threading.Event()
+        self.errors = []
+        self.stages = []
+        self.decompressors = []
+        self.elapsed_seconds = 0.0
+        self._start_time = time.time()
+        self.profiler = current_profiler()  # stage threads report S3 bytes to the task that built the pipeline
+        self._lock = threading.Lock()
+        self._threads = []
+        self._processes = []
+        self._on_abort = []
+        self._commits = []
+
+    def _channel(self) -> _Channel:
+        return _Channel(self, self.buffers, self.chunk_size)
+
+    def _stage(self, label) -> _StageCounter:
+        stage = _StageCounter(label)
+        self.stages.append(stage)
+        return stage
+
+    def _spawn(self, stage, target, *args):
+        def run_stage():
+            try:
+                target(*args)
+            except _StreamAborted:
+                pass
+            except Exception as e:
+                self.fail(stage.label, e)
+        thread = threading.Thread(target=bind_profiler(run_stage, self.profiler), name=f"{self.name}: {stage.label}", daemon=True)
+        with self._lock:
+            self._threads.append(thread)
+        thread.start()
+
+    def fail(self, label, error):
+        """Records the first failure and tears down every stage."""
+        with self._lock:
+            if self.failed.is_set():
+                return
+            print(f"Stream '{self.name}' failed in stage '{label}': {error}")
+            self.errors.append(error)
+            self.failed.set()
+        for process in self._processes:
+            try:
+                # Stages run in their own process group, so this also kills every tool in a shell pipeline.
+                os.killpg(process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                process.kill()
+        for callback in self._on_abort:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    # --- sources ---
+    def s3_source(self, key, byte_range=None) -> _Channel:
+        """Streams s3://BUCKET_NAME/key (optionally only bytes [start, end]) into a channel."""
+        stage = self._stage(f"s3://{key}" if byte_range is None else f"s3://{key} bytes {byte_range[0]}-{byte_range[1]}")
+        output = self._channel()
+
+        def read():
+            request = {"Bucket": BUCKET_NAME, "Key": key}
+            if byte_range is not None:
+                request["Range"] = f"bytes={byte_range[0]}-{byte_range[1]}"
+            body = s3_client.get_object(**request)['Body']
+            writer = _ChannelWriter(output)
+            for chunk in body.iter_chunks(chunk_size=self.chunk_size):
+                writer.write(chunk)
+                stage.bytes_out += len(chunk)
+            writer.close()
+            profile_bytes("in", stage.bytes_out)
+
+        self._spawn(stage, read)
+        return output
+
+    # --- transforms ---
+    def decompress(self, channel, backend=DECOMPRESS_BACKEND) -> _Channel:
+        """Decompresses a gzip/BGZF channel with `open_decompressor`, sniffing the first chunk."""
+        stage = self._stage("decompress")
+        output = self._channel()
+
+        def counted(first, chunks):
+            for chunk in chain([first], chunks):
+                stage.bytes_in += len(chunk)
+                yield chunk
+
+        def drain(decompressor):
+            writer = _ChannelWriter(output)
+            while True:
+                data = decompressor.stdout.read(self.chunk_size)
+                if not data:
+                    break
+                writer.write(data)
+            decompressor.wait()
+            stage.bytes_out = writer.bytes_written
+            writer.close()
+
+        def feed():
+            chunks = channel.chunks()
+            first = next(chunks, memoryview(b""))
+            decompressor = open_decompressor(bytes(first[:64 * 1024]), backend)
+            stage.label = f"decompress ({decompressor.name})"
+            self.decompressors.append(decompressor)
+            if isinstance(decompressor, SubprocessDecompressor):
+                self._register_process(decompressor.process)
+            else:
+                # Unblocks an in-process decoder stuck writing to its output pipe.
+                self._on_abort.append(decompressor.stdout.close)
+            self._spawn(stage, drain, decompressor)
+            try:
+                decompressor.feed(counted(first, chunks))
+            except BrokenPipeError:
+                decompressor.wait()  # raises with the decompressor's own error, if it has one
+                raise
+
+        self._spawn(stage, feed)
+        return output
+
+    def _register_process(self, process):
+        with self._lock:
+            self._processes.append(process)
+            aborted = self.failed.is_set()
+        if aborted:
+            process.kill()
+
+    def process(self, label, command, channel=None, capture_stdout=True):
+        """
+        Runs `command` (a shell string run under bash, or an argv list) with the
+        channel on stdin. Returns a channel of its stdout, or None when
+        `capture_stdout` is False (the tool writes its own output files).
+        Shell pipelines should start with `set -o pipefail`.
+        """
+        stage = self._stage(label)
+        shell = isinstance(command, str)
+        process = subprocess.Popen(
+            command, shell=shell, executable="/bin/bash" if shell else None,
+            stdin=subprocess.PIPE if channel is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE if capture_stdout else None, stderr=subprocess.PIPE,
+            bufsize=0, start_new_session=True
+        )
+        self._register_process(process)
+        stderr = _StderrTail(process.stderr, label)
+        output = self._channel() if capture_stdout else None
+
+        def check_exit():
+            return_code = process.wait()
+            if return_code != 0:
+                raise subprocess.CalledProcessError(return_code, label, stderr=stderr.text())
+
+        def write_stdin():
+            try:
+                for chunk in channel.chunks():
+                    _write_all(process.stdin, chunk)
+                    stage.bytes_in += len(chunk)
+            except BrokenPipeError:
+                check_exit()
+                raise RuntimeError(f"'{label}' exited before reading all of its input")
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        def read_stdout():
+            while True:
+                buffer = output.acquire()
+                n = process.stdout.readinto(buffer)
+                if not n:
+                    output.release(buffer)
+                    break
+                output.push(buffer, n)
+                stage.bytes_out += n
+            check_exit()
+            output.close()
+
+        if channel is not None:
+            self._spawn(stage, write_stdin)
+        self._spawn(stage, read_stdout if capture_stdout else check_exit)
+        return output
+
+    def interleave(self, channels) -> _Channel:
+        """
+        Merges mate FASTQ channels into one interleaved FASTQ (read 1/1, 1/2,
+        2/1, ...); `bwa mem -p` pairs adjacent reads with the same name.
+        """
+        stage = self._stage("interleave")
+        output = self._channel()
+
+        def merge():
+            readers = [io.BufferedReader(_ChannelReader(channel), self.chunk_size) for channel in channels]
+            writer = _ChannelWriter(output)
+            while True:
+                records = [b"".join(reader.readline() for _ in range(4)) for reader in readers]
+                if not any(records):
+                    break
+                if not all(records):
+                    raise ValueError("Paired FASTQ mates have different numbers of reads")
+                for record in records:
+                    writer.write(record)
+            stage.bytes_in = stage.bytes_out = writer.bytes_written
+            writer.close()
+
+        self._spawn(stage, merge)
+        return output
+
+    def tee(self, channel, count) -> list:
+        """Copies a channel into `count` channels; the slowest consumer sets the pace."""
+        stage = self._stage("tee")
+        outputs = [self._channel() for _ in range(count)]
+
+        def copy():
+            writers = [_ChannelWriter(output) for output in outputs]
+            for chunk in channel.chunks():
+                for writer in writers:
+                    writer.write(chunk)
+                stage.bytes_in += len(chunk)
+            stage.bytes_out = stage.bytes_in * count
+            for writer in writers:
+                writer.close()
+
+        self._spawn(stage, copy)
+        return outputs
+
+    # --- sinks ---
+    def file_sink(self, channel, path):
+        """Writes a channel to a local file (removed again if the pipeline fails)."""
+        stage = self._stage(path)
+
+        def write():
+            with open(path, "wb") as f:
+                for chunk in channel.chunks():
+                    f.write(chunk)
+                    stage.bytes_in += len(chunk)
+
+        self._on_abort.append(lambda: os.path.exists(path) and os.remove(path))
+        self._spawn(stage, write)
+
+    def consume(self, channel, label, callback):
+        """
+        Calls `callback(chunk)` for every chunk of a channel on its own thread,
+        e.g. to compute statistics as data streams past. A chunk is a view of a
+        pooled buffer, valid only during the call.
+        """
+        stage = self._stage(label)
+
+        def read():
+            for chunk in channel.chunks():
+                callback(chunk)
+                stage.bytes_in += len(chunk)
+
+        self._spawn(stage, read)
+
+    def s3_sink(self, channel, key):
+        """
+        Multipart-uploads a channel to s3://BUCKET_NAME/key. Parts are uploaded
+        while the stream runs, but the upload is only completed by `run()`
+        after every stage succeeded; on failure it is aborted. Streams shorter
+        than one part become a single PutObject at commit time.
+        """
+        stage = self._stage(f"s3://{key}")
+        part_size = max(S3_CHUNK_SIZE, STREAM_MIN_PART_SIZE)
+        in_flight = threading.Semaphore(STREAM_UPLOAD_CONCURRENCY)
+        pool = ThreadPoolExecutor(max_workers=STREAM_UPLOAD_CONCURRENCY)
+        state = {"upload_id": None, "futures": [], "tail": b""}
+
+        def upload_part(number, data):
+            try:
+                response = s3_client.upload_part(Bucket=BUCKET_NAME, Key=key, UploadId=state["upload_id"],
+                                                 PartNumber=number, Body=data)
+                return {"PartNumber": number, "ETag": response["ETag"]}
+            finally:
+                in_flight.release()
+
+        def submit(data):
+            while not in_flight.acquire(timeout=STREAM_POLL_SECONDS):
+                if self.failed.is_set():
+                    raise _StreamAborted()
+            if state["upload_id"] is None:
+                state["upload_id"] = s3_client.create_multipart_upload(Bucket=BUCKET_NAME, Key=key)["UploadId"]
+            state["futures"].append(pool.submit(upload_part, len(state["futures"]) + 1, bytes(data)))
+
+        def write():
+            part = bytearray()
+            for chunk in channel.chunks():
+                part += chunk
+                stage.bytes_in += len(chunk)
+                if len(part) >= part_size:
+                    submit(part)
+                    part = bytearray()
+            if state["upload_id"] is None:
+                state["tail"] = bytes(part)
+            elif part:
+                submit(part)
+            for future in state["futures"]:
+                future.result()
+
+        def commit():
+            pool.shutdown()
+            if state["upload_id"] is None:
+                s3_client.put_object(Bucket=BUCKET_NAME, Key=key, Body=state["tail"])
+            else:
+                s3_client.complete_multipart_upload(
+                    Bucket=BUCKET_NAME, Key=key, UploadId=state["upload_id"],
+                    MultipartUpload={"Parts": [future.result() for future in state["futures"]]}
+                )
+            profile_bytes("out", stage.bytes_in)
+            print(f"Uploaded stream to s3://{BUCKET_NAME}/{key} ({stage.bytes_in / 1_000_000:.1f} MB)")
+
+        def abort():
+            pool.shutdown(cancel_futures=True)
+            if state["upload_id"] is not None:
+                s3_client.abort_multipart_upload(Bucket=BUCKET_NAME, Key=key, UploadId=state["upload_id"])
+                print(f"Aborted multipart upload to s3://{BUCKET_NAME}/{key}")
+
+        self._commits.append((commit, abort))
+        self._spawn(stage, write)
+
+    def run(self) -> dict:
+        """
+        Waits for every stage, then completes the S3 uploads. Raises the first
+        stage failure after aborting uploads. Returns {stage: {bytes_in, bytes_out}}.
+        """
+        joined = 0
+        while not self.failed.is_set():
+            with self._lock:
+                if joined == len(self._threads):
+                    break
+                thread = self._threads[joined]
+            thread.join(STREAM_POLL_SECONDS)
+            if not thread.is_alive():
+                joined += 1
+
+        if self.failed.is_set():
+            deadline = time.time() + STREAM_ABORT_GRACE_SECONDS
+            for thread in list(self._threads):
+                thread.join(max(0.0, deadline - time.time()))
+            for _, abort in self._commits:
+                try:
+                    abort()
+                except Exception as e:
+                    print(f"Error aborting upload for stream '{self.name}': {e}")
+            raise self.errors[0]
+
+        for index, (commit, _) in enumerate(self._commits):
+            try:
+                commit()
+            except Exception:
+                for _, abort in self._commits[index:]:
+                    try:
+                        abort()
+                    except Exception as e:
+                        print(f"Error aborting upload for stream '{self.name}': {e}")
+                raise
+        self.elapsed_seconds = time.time() - self._start_time
+
+        counters = {}
+        for stage in self.stages:
+            counters[stage.label] = {"bytes_in": stage.bytes_in, "bytes_out": stage.bytes_out}
+            print(f"Stream '{self.name}' stage '{stage.label}': "
+                  f"{stage.bytes_in / 1_000_000:.1f} MB in, {stage.bytes_out / 1_000_000:.1f} MB out")
+        return counters
 # --- CHANGE END ---
 
 # --- Bioinformatics Tasks (now decorated) ---
 
+DECOMPRESS_INLINE_QC = os.environ.get("DECOMPRESS_INLINE_QC", "0") == "1"  # also --inline-qc true
+
 @time_task_and_emit_metric("Decompress")
-def decompress_task(srr_id):
+def decompress_task(srr_id, inline_qc=DECOMPRESS_INLINE_QC):
     """
-    Downloads a compressed FASTQ from S3, decompresses it in-memory,
-    and streams the uncompressed output back up to S3.
+    Downloads a compressed FASTQ from S3, decompresses it with the fastest
+    available backend, and streams the uncompressed output back up to S3.
+    Paired-end mates are decompressed side by side and interleaved into one FASTQ.
+
+    With `inline_qc`, the decompressed stream is also teed into the native QC
+    engine on a side thread and its report (see `qc_task`) is published when
+    decompression finishes, so the separate QC job can be skipped.
     """
-    input_key = f"raw_reads/{srr_id}.fastq.gz"
+    input_keys = raw_read_keys(srr_id)
     output_key = f"decompressed/{srr_id}.fastq"
+    manifest = StageManifest("Decompress", srr_id, output_key, inputs=input_keys)
+    qc_manifest = StageManifest("QualityControl", srr_id, native_qc_key(srr_id), inputs=[output_key]) if inline_qc else None
+    if manifest.is_current():
+        if qc_manifest and not qc_manifest.is_current():
+            # Decompressed by an earlier run without inline QC: one streaming read of the existing FASTQ.
+            profile_phase("qc")
+            qc_manifest.write(publish_qc_report(srr_id, collect_fastq_stats(output_key)))
+        return
 
-    print(f"Starting decompression stream for s3://{BUCKET_NAME}/{input_key}")
-    s3_object = s3_client.get_object(Bucket=BUCKET_NAME, Key=input_key)
-    streaming_body = s3_object['Body']
-    gunzip_process = subprocess.Popen(["gunzip"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    profile_phase("stream")
+    pipeline = StreamPipeline(f"decompress {srr_id}")
+    for input_key in input_keys:
+        print(f"Starting decompression stream for s3://{BUCKET_NAME}/{input_key}")
+    mates = [pipeline.decompress(pipeline.s3_source(input_key)) for input_key in input_keys]
+    reads = pipeline.interleave(mates) if len(mates) > 1 else mates[0]
+    stats = None
+    if inline_qc:
+        stats = fastq_stats.FastqStats()
+        reads, qc_reads = pipeline.tee(reads, 2)
+        pipeline.consume(qc_reads, "inline qc", stats.update)
+    pipeline.s3_sink(reads, output_key)
+    pipeline.run()
+    print(f"Successfully decompressed and uploaded to s3://{BUCKET_NAME}/{output_key}")
+    for decompressor in pipeline.decompressors:
+        report_decompression_throughput(srr_id, decompressor, pipeline.elapsed_seconds)
+    manifest.write([output_key])
 
-    def upload_stream():
-        try:
-            s3_client.upload_fileobj(gunzip_process.stdout, BUCKET_NAME, output_key)
-            print(f"Successfully decompressed and uploaded to s3://{BUCKET_NAME}/{output_key}")
-        except Exception as e:
-            print(f"Error during S3 upload: {e}")
+    if stats:
+        profile_phase("qc-report")
+        stats.end_segment(discard_partial=False)
+        report = stats.report()
+        report["sampling"] = None
+        qc_manifest.write(publish_qc_report(srr_id, report))
 
-    upload_thread = threading.Thread(target=upload_stream)
-    upload_thread.start()
+# --- CHANGE START: coordinate-sorted, indexed alignment output ---
+ALIGN_OUTPUT_FORMAT = os.environ.get("ALIGN_OUTPUT_FORMAT", "bam").lower()  # bam|cram
+SORT_MEMORY_PER_THREAD = os.environ.get("SORT_MEMORY_PER_THREAD", "512M")
+BAI_MAX_CONTIG_BP = 2 ** 29 - 1  # contigs longer than this need a CSI index
 
-    try:
-        for chunk in streaming_body.iter_chunks():
-            gunzip_process.stdin.write(chunk)
-        gunzip_process.stdin.close()
-    except Exception as e:
-        print(f"Error writing to gunzip process: {e}")
-
-    upload_thread.join()
-    return_code = gunzip_process.wait()
-    if return_code != 0:
-        error_output = gunzip_process.stderr.read().decode('utf-8')
-        print(f"Gunzip process failed with return code {return_code}. Error: {error_output}")
-        raise subprocess.CalledProcessError(return_code, gunzip_process.args, stderr=error_output)
+def alignment_key(srr_id: str) -> str:
+    """S3 key of a sample's sorted alignment (BAM or CRAM, per ALIGN_OUTPUT_FORMAT)."""
+    return f"alignments/{srr_id}.{ALIGN_OUTPUT_FORMAT}"
+
+def sort_command(local_ref_path: str, output_path: str, threads: int, temp_prefix: str = None) -> str:
+    """
+    `samtools sort` reading alignments on stdin and writing coordinate-sorted
+    BAM/CRAM; `temp_prefix` places its spill files (default: next to the output).
+    """
+    output_format = "CRAM" if ALIGN_OUTPUT_FORMAT == "cram" else "BAM"
+    temp_option = f"-T {temp_prefix} " if temp_prefix else ""
+    return (
+        f"samtools sort -@ {threads} -m {SORT_MEMORY_PER_THREAD} -O {output_format} "
+        f"--reference {local_ref_path} {temp_option}-o {output_path} -"
+    )
+
+def alignment_index_ext(path: str, local_ref_path: str) -> str:
+    """.crai for CRAM, .bai for BAM unless a contig is too long for BAI, then .csi."""
+    if path.endswith(".cram"):
+        return ".crai"
+    with open(local_ref_path + ".fai") as fai:
+        needs_csi = any(int(line.split("\t")[1]) > BAI_MAX_CONTIG_BP for line in fai)
+    return ".csi" if needs_csi else ".bai"
+
+def index_command(path: str, index_path: str) -> list:
+    """`samtools index` writing `index_path`; `path` may be "-" to index a stream on stdin."""
+    csi = ["-c"] if index_path.endswith(".csi") else []
+    return ["samtools", "index", *csi, "-@", str(available_cpus()), path, index_path]
+
+def index_alignment(path: str, local_ref_path: str) -> str:
+    """Indexes a sorted BAM/CRAM and returns the index path (see `alignment_index_ext`)."""
+    index_path = path + alignment_index_ext(path, local_ref_path)
+    subprocess.run(index_command(path, index_path), check=True)
+    return index_path
+
+ALIGNMENT_INDEX_EXTS = ("bai", "csi", "crai")
+
+def _alignment_index_keys(key: str) -> list:
+    listing = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=key + ".")
+    return [obj["Key"] for obj in listing.get("Contents", []) if obj["Key"].rsplit(".", 1)[-1] in ALIGNMENT_INDEX_EXTS]
+
+def find_alignment_index_key(key: str):
+    """Returns the S3 key of an existing .bai/.csi/.crai for `key`, or None."""
+    keys = _alignment_index_keys(key)
+    return keys[0] if keys else None
+
+def remove_stale_alignment_indexes(key: str, keep: str = None):
+    """
+    Deletes every index object of `key` except `keep`. Called once a new
+    alignment is uploaded: `variants` downloads whatever index sits next to the
+    BAM and would otherwise run region queries against an earlier run's offsets.
+    """
+    for index_key in _alignment_index_keys(key):
+        if index_key != keep:
+            print(f"Removing stale alignment index s3://{BUCKET_NAME}/{index_key}")
+            s3_client.delete_object(Bucket=BUCKET_NAME, Key=index_key)
+# --- CHANGE END ---
+
+# --- CHANGE START: zero-disk streaming alignment ---
+ALIGN_STREAMING = os.environ.get("ALIGN_STREAMING", "0") == "1"
+
+def align_stream(srr_id, local_ref_path):
+    """
+    Streams the FASTQ from S3 into `bwa mem` stdin while alignment runs, and
+    streams the sorted BAM/CRAM from `samtools sort` into an S3 multipart
+    upload. Download, compute and upload overlap; nothing but the reference,
+    samtools sort's spill files (bounded by SORT_MEMORY_PER_THREAD) and the
+    index is written to local disk. The sorted stream is also teed into
+    `samtools index`, so the index is uploaded alongside the alignment and
+    `variants` never has to rebuild it. Returns the index's S3 key.
+    """
+    fastq_key = f"decompressed/{srr_id}.fastq"
+    output_bam_key = alignment_key(srr_id)
+    local_index_path = f"/tmp/{os.path.basename(output_bam_key)}{alignment_index_ext(output_bam_key, local_ref_path)}"
+    index_key = f"alignments/{os.path.basename(local_index_path)}"
+    threads = available_cpus()
+
+    print(f"Streaming s3://{BUCKET_NAME}/{fastq_key} through BWA-MEM ({threads} threads) to s3://{BUCKET_NAME}/{output_bam_key}")
+    profile_phase("stream")
+    pipeline = StreamPipeline(f"align {srr_id}")
+    alignments = pipeline.process(
+        "bwa mem | samtools sort",
+        f"set -o pipefail; bwa mem -p -t {threads} {local_ref_path} - | "
+        f"{sort_command(local_ref_path, '-', threads, temp_prefix=f'/tmp/{srr_id}.sort')}",
+        pipeline.s3_source(fastq_key)
+    )
+    upload_copy, index_copy = pipeline.tee(alignments, 2)
+    pipeline.s3_sink(upload_copy, output_bam_key)
+    pipeline.process("samtools index", index_command("-", local_index_path), index_copy, capture_stdout=False)
+    pipeline.run()
+    print(f"Uploading {local_index_path} to s3://{BUCKET_NAME}/{index_key}")
+    upload_object(local_index_path, index_key)
+    remove_stale_alignment_indexes(output_bam_key, keep=index_key)
+    os.remove(local_index_path)
+    print(f"Streaming alignment complete: s3://{BUCKET_NAME}/{output_bam_key}")
+    return index_key
+
+def align_manifest(srr_id, reference_name) -> StageManifest:
+    """Manifest shared by every path that produces a sample's final alignment."""
+    return StageManifest("Align", srr_id, alignment_key(srr_id), inputs=[f"decompressed/{srr_id}.fastq"],
+                         reference_name=reference_name, tools=["bwa", "samtools"])
+# --- CHANGE END ---
 
 @time_task_and_emit_metric("Align")
 def align_task(srr_id, reference_name):
     """
-    Downloads the FASTQ file and a specified reference genome, aligns them with BWA,
-    and uploads the resulting BAM file to S3.
+    Downloads the FASTQ file and a specified reference genome, aligns them with
+    multithreaded BWA, and uploads the coordinate-sorted BAM/CRAM plus its index to S3.
+
+    Inside an AWS Batch array job (AWS_BATCH_JOB_ARRAY_INDEX set) only this
+    child's shard from `align_plan` is aligned; `align_merge` combines them.
+    With ALIGN_STREAMING=1 the FASTQ and BAM are streamed instead of staged in /tmp.
     """
     fastq_key = f"decompressed/{srr_id}.fastq"
-    output_bam_key = f"alignments/{srr_id}.bam"
+    output_bam_key = alignment_key(srr_id)
     local_fastq_path = f"/tmp/{srr_id}.fastq"
-    local_bam_path = f"/tmp/{srr_id}.bam"
+    local_bam_path = f"/tmp/{os.path.basename(output_bam_key)}"
+
+    array_index = os.environ.get("AWS_BATCH_JOB_ARRAY_INDEX")
+    if array_index is not None:
+        profile_phase("reference-prep")
+        local_ref_path = ensure_reference_local(reference_name, profile="align")
+        align_chunk(srr_id, local_ref_path, int(array_index))
+        return
+    manifest = align_manifest(srr_id, reference_name)
+    if manifest.is_current():
+        return
+    if ALIGN_STREAMING:
+        profile_phase("reference-prep")
+        local_ref_path = ensure_reference_local(reference_name, profile="align")
+        index_key = align_stream(srr_id, local_ref_path)
+        manifest.write([output_bam_key, index_key])
+        return
 
+    profile_phase("download")
     print(f"Downloading FASTQ file: {fastq_key}")
-    s3_client.download_file(BUCKET_NAME, fastq_key, local_fastq_path)
+    download_object(fastq_key, local_fastq_path)
 
+    profile_phase("reference-prep")
     # --- CHANGE START: selective, safe reference fetching ---
-    local_ref_path = ensure_reference_local(reference_name)
+    local_ref_path = ensure_reference_local(reference_name, profile="align")
     # --- CHANGE END ---
 
-    print(f"Running BWA-MEM alignment for {srr_id}...")
+    profile_phase("tool")
+    threads = available_cpus()
+    print(f"Running BWA-MEM alignment for {srr_id} with {threads} threads...")
     alignment_command = (
-        f"bwa mem {local_ref_path} {local_fastq_path} | "
-        f"samtools view -S -b > {local_bam_path}"
+        f"set -o pipefail; bwa mem -p -t {threads} {local_ref_path} {local_fastq_path} | "
+        f"{sort_command(local_ref_path, local_bam_path, threads)}"
     )
-    subprocess.run(alignment_command, shell=True, check=True)
+    subprocess.run(alignment_command, shell=True, check=True, executable="/bin/bash")
+    local_index_path = index_alignment(local_bam_path, local_ref_path)
     print("Alignment complete.")
-    print(f"Uploading BAM file to s3://{BUCKET_NAME}/{output_bam_key}")
-    s3_client.upload_file(local_bam_path, BUCKET_NAME, output_bam_key)
+    profile_phase("upload")
+    for local_path in [local_bam_path, local_index_path]:
+        key = f"alignments/{os.path.basename(local_path)}"
+        print(f"Uploading {local_path} to s3://{BUCKET_NAME}/{key}")
+        upload_object(local_path, key)
+    print("Upload complete.")
+    remove_stale_alignment_indexes(output_bam_key, keep=f"alignments/{os.path.basename(local_index_path)}")
+    manifest.write([output_bam_key, f"alignments/{os.path.basename(local_index_path)}"])
+    profile_phase("cleanup")
+    print("Cleaning up temporary local files...")
+    subprocess.run(["rm", "-rf", local_fastq_path, local_bam_path, local_index_path], check=True)
+
+# --- CHANGE START: chunked FASTQ sharding for Batch array alignment ---
+ALIGN_CHUNK_BYTES = int(os.environ.get("ALIGN_CHUNK_MB", "1024")) * 1024 * 1024
+ALIGN_MAX_SHARDS = int(os.environ.get("ALIGN_MAX_SHARDS", "100"))
+FASTQ_BOUNDARY_WINDOW = 1024 * 1024  # bytes fetched to locate a record start
+
+def _fastq_read_name(header: bytes) -> bytes:
+    """Read name as `bwa mem -p` compares it: the first word of the header, without a /1 or /2 mate suffix."""
+    words = header[1:].split(None, 1)
+    name = words[0] if words else b""
+    return name[:-2] if name.endswith((b"/1", b"/2")) else name
+
+def _find_fastq_record_start(key: str, offset: int, size: int, paired: bool = False) -> int:
+    """
+    Returns the absolute offset (> 0) of the first FASTQ record starting at or
+    after `offset`, using one small ranged GET. A candidate '@' only counts if the
+    line two below starts with '+', sequence and quality lengths match, and
+    the following line is another header (or EOF) - a quality line that
+    happens to start with '@' fails these checks.
+
+    With `paired` (interleaved input for `bwa mem -p`), a record whose successor
+    has a different read name is skipped: it is a single read or the second mate
+    of a pair, so the offset returned always starts a pair (or a single read)
+    and never separates two mates.
+    """
+    start = offset - 1  # include the preceding byte so a record starting exactly at `offset` is seen
+    end = min(offset + FASTQ_BOUNDARY_WINDOW, size) - 1
+    data = s3_client.get_object(Bucket=BUCKET_NAME, Key=key, Range=f"bytes={start}-{end}")['Body'].read()
+    at_eof = end == size - 1
+
+    pos = data.find(b"\n@")
+    while pos != -1:
+        lines = data[pos + 1:].split(b"\n", 5)
+        if len(lines) >= 5:
+            next_ok = lines[4].startswith(b"@") or (at_eof and lines[4] == b"" and len(lines) == 5)
+            if lines[2].startswith(b"+") and len(lines[1]) == len(lines[3]) and next_ok:
+                record_start = start + pos + 1
+                if paired and _fastq_read_name(lines[0]) != _fastq_read_name(lines[4]):
+                    # Mates are adjacent, so the next record cannot be this one's second mate.
+                    return record_start + sum(len(line) + 1 for line in lines[:4])
+                return record_start
+        pos = data.find(b"\n@", pos + 1)
+    if at_eof:
+        return size
+    raise ValueError(f"No FASTQ record boundary found in s3://{BUCKET_NAME}/{key} near byte {offset}")
+
+def plan_fastq_chunks(key: str) -> list:
+    """
+    Splits an uncompressed FASTQ in S3 into byte ranges that start on a mate
+    pair (interleaved paired-end input) or a record. The shard count is chosen
+    from the object size (ALIGN_CHUNK_MB per shard, capped at ALIGN_MAX_SHARDS).
+    """
+    size = s3_client.head_object(Bucket=BUCKET_NAME, Key=key)['ContentLength']
+    shards = max(1, min(ALIGN_MAX_SHARDS, -(-size // ALIGN_CHUNK_BYTES)))
+    step = size // shards
+    boundaries = [0] + [_find_fastq_record_start(key, i * step, size, paired=True) for i in range(1, shards)] + [size]
+    boundaries = sorted(set(boundaries))
+    return [[boundaries[i], boundaries[i + 1] - 1] for i in range(len(boundaries) - 1)]
+
+@time_task_and_emit_metric("PlanAlign")
+def align_plan_task(srr_id, reference_name):
+    """
+    Writes alignments/chunks/{srr_id}/plan.json with the record-aligned byte
+    ranges each array child aligns; Step Functions sizes the array job from it.
+    If the alignment is already up to date the plan has a single shard, which
+    routes to the plain `align` job where it is skipped.
+    """
+    fastq_key = f"decompressed/{srr_id}.fastq"
+    plan_key = f"alignments/chunks/{srr_id}/plan.json"
+    if align_manifest(srr_id, reference_name).is_current():
+        ranges = [[0, -1]]
+    else:
+        ranges = plan_fastq_chunks(fastq_key)
+    plan = {"srr_id": srr_id, "fastq_key": fastq_key, "shards": len(ranges), "ranges": ranges}
+    print(f"Planned {len(ranges)} alignment shard(s) for {fastq_key}")
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=plan_key, Body=json.dumps(plan).encode("utf-8"))
+    print(f"Wrote alignment plan to s3://{BUCKET_NAME}/{plan_key}")
+
+def align_chunk(srr_id, local_ref_path, shard_index):
+    """
+    Array-child alignment: streams this shard's byte range of the FASTQ from S3
+    straight into `bwa mem`, sorts the chunk, and uploads the chunk BAM.
+    """
+    plan_key = f"alignments/chunks/{srr_id}/plan.json"
+    plan = json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=plan_key)['Body'].read())
+    start, end = plan["ranges"][shard_index]
+    chunk_bam_path = f"/tmp/{srr_id}.{shard_index:05d}.bam"
+    chunk_bam_key = f"alignments/chunks/{srr_id}/{shard_index:05d}.bam"
+    threads = available_cpus()
+
+    profile_phase("stream")
+    print(f"Aligning shard {shard_index + 1}/{plan['shards']} of {plan['fastq_key']} (bytes {start}-{end})")
+    pipeline = StreamPipeline(f"align {srr_id} shard {shard_index}")
+    pipeline.process(
+        "bwa mem | samtools sort",
+        f"set -o pipefail; bwa mem -p -t {threads} {local_ref_path} - | "
+        f"samtools sort -@ {threads} -m {SORT_MEMORY_PER_THREAD} -o {chunk_bam_path} -",
+        pipeline.s3_source(plan["fastq_key"], byte_range=(start, end)), capture_stdout=False
+    )
+    pipeline.run()
+
+    profile_phase("upload")
+    print(f"Uploading chunk BAM to s3://{BUCKET_NAME}/{chunk_bam_key}")
+    upload_object(chunk_bam_path, chunk_bam_key)
+    subprocess.run(["rm", "-rf", chunk_bam_path], check=True)
+
+@time_task_and_emit_metric("MergeAlignments")
+def align_merge_task(srr_id, reference_name):
+    """
+    Merges the coordinate-sorted chunk BAMs from an array alignment into the
+    sample's sorted BAM/CRAM with `samtools merge`, and indexes it.
+    """
+    prefix = f"alignments/chunks/{srr_id}/"
+    output_bam_key = alignment_key(srr_id)
+    local_bam_path = f"/tmp/{os.path.basename(output_bam_key)}"
+    chunk_dir = f"/tmp/{srr_id}_chunks/"
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    # Take the chunk list from the plan so stale chunks from an earlier run are ignored.
+    plan = json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=f"{prefix}plan.json")['Body'].read())
+    keys = [f"{prefix}{i:05d}.bam" for i in range(plan["shards"])]
+
+    profile_phase("download")
+    chunk_paths = [chunk_dir + os.path.basename(key) for key in keys]
+    with ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY) as pool:
+        for future in [pool.submit(bind_profiler(download_object), key, path) for key, path in zip(keys, chunk_paths)]:
+            future.result()
+
+    profile_phase("reference-prep")
+    local_ref_path = ensure_reference_local(reference_name, profile="variants")
+    profile_phase("tool")
+    print(f"Merging {len(chunk_paths)} chunk BAMs for {srr_id}...")
+    subprocess.run(
+        ["samtools", "merge", "-@", str(available_cpus()), "-O", ALIGN_OUTPUT_FORMAT.upper(),
+         "--reference", local_ref_path, "-f", local_bam_path] + chunk_paths,
+        check=True
+    )
+    local_index_path = index_alignment(local_bam_path, local_ref_path)
+    profile_phase("upload")
+    for local_path in [local_bam_path, local_index_path]:
+        key = f"alignments/{os.path.basename(local_path)}"
+        print(f"Uploading {local_path} to s3://{BUCKET_NAME}/{key}")
+        upload_object(local_path, key)
     print("Upload complete.")
+    remove_stale_alignment_indexes(output_bam_key, keep=f"alignments/{os.path.basename(local_index_path)}")
+    align_manifest(srr_id, reference_name).write([output_bam_key, f"alignments/{os.path.basename(local_index_path)}"])
+    profile_phase("cleanup")
     print("Cleaning up temporary local files...")
-    subprocess.run(["rm", "-rf", local_fastq_path, os.path.dirname(local_ref_path), local_bam_path], check=True)
+    subprocess.run(["rm", "-rf", local_bam_path, local_index_path, chunk_dir], check=True)
+# --- CHANGE END ---
+
+# --- CHANGE START: native streaming QC engine ---
+QC_ENGINE = os.environ.get("QC_ENGINE", "fastqc")  # fastqc (full HTML/ZIP report) | native (streaming NumPy stats)
+QC_SAMPLE_MB = float(os.environ.get("QC_SAMPLE_MB", "0"))  # native: 0 = read every byte, else ~this many MB spread over the file
+QC_SAMPLE_WINDOWS = int(os.environ.get("QC_SAMPLE_WINDOWS", "16"))
+QC_REPORT_FORMAT = os.environ.get("QC_REPORT_FORMAT", "json").lower()  # json | parquet (parquet tables are written alongside the JSON)
+
+def native_qc_key(srr_id: str) -> str:
+    return f"qc_reports/{srr_id}_qc.json"
+
+def collect_fastq_stats(key: str, sample_mb: float = 0) -> dict:
+    """
+    Computes FASTQ statistics over s3://BUCKET_NAME/key in one streaming pass,
+    with no local copy. With `sample_mb`, only about that many MB are read,
+    as QC_SAMPLE_WINDOWS record-aligned byte ranges spread evenly over the
+    object; the report then carries a `sampling` block with the fraction read
+    and an extrapolated read count.
+    """
+    size = s3_client.head_object(Bucket=BUCKET_NAME, Key=key)['ContentLength']
+    stats = fastq_stats.FastqStats()
+    budget = int(sample_mb * 1_000_000)
+    if not budget or budget >= size:
+        pipeline = StreamPipeline(f"qc {key}")
+        pipeline.consume(pipeline.s3_source(key), "fastq stats", stats.update)
+        pipeline.run()
+        stats.end_segment(discard_partial=False)
+        report = stats.report()
+        report["sampling"] = None
+        return report
+
+    windows = max(1, min(QC_SAMPLE_WINDOWS, budget // STREAM_CHUNK_SIZE))
+    step = size // windows
+    for i in range(windows):
+        start = _find_fastq_record_start(key, i * step, size) if i else 0
+        if start >= size:
+            break
+        pipeline = StreamPipeline(f"qc {key} window {i + 1}/{windows}")
+        pipeline.consume(pipeline.s3_source(key, byte_range=(start, min(start + budget // windows, size) - 1)),
+                         "fastq stats", stats.update)
+        pipeline.run()
+        stats.end_segment(discard_partial=True)
+    report = stats.report()
+    fraction = stats.bytes_examined / size
+    report["sampling"] = {"object_bytes": size, "windows": windows, "fraction": round(fraction, 4),
+                          "estimated_total_reads": round(stats.reads / fraction) if fraction else 0}
+    return report
+
+def publish_qc_report(srr_id: str, report: dict, report_format: str = QC_REPORT_FORMAT) -> list:
+    """Writes a native QC report (JSON, plus Parquet tables if asked) to qc_reports/ and returns the S3 keys."""
+    local_qc_dir = f"/tmp/qc_results/{srr_id}/"
+    os.makedirs(local_qc_dir, exist_ok=True)
+    local_paths = fastq_stats.write_report(report, f"{local_qc_dir}{srr_id}_qc.json")
+    if report_format == "parquet":
+        local_paths += fastq_stats.write_report(report, f"{local_qc_dir}{srr_id}_qc.parquet")
+    elif report_format != "json":
+        raise ValueError(f"Unknown QC report format '{report_format}' (expected json or parquet)")
+    keys = []
+    for local_path in local_paths:
+        key = f"qc_reports/{os.path.basename(local_path)}"
+        print(f"Uploading QC report to s3://{BUCKET_NAME}/{key}")
+        upload_object(local_path, key)
+        keys.append(key)
+    failing = [name for name, status in report["modules"].items() if status != "pass"]
+    print(f"QC: {report['reads']} reads, {report['bases']} bases, GC {report['gc_percent']}%, "
+          f"modules not passing: {', '.join(failing) or 'none'}")
+    subprocess.run(["rm", "-rf", local_qc_dir], check=True)
+    return keys
+# --- CHANGE END ---
 
 @time_task_and_emit_metric("QualityControl")
-def qc_task(srr_id):
+def qc_task(srr_id, engine=QC_ENGINE, sample_mb=QC_SAMPLE_MB, report_format=QC_REPORT_FORMAT):
     """
     Downloads the decompressed FASTQ from S3, runs FastQC on it locally,
     and uploads the resulting reports back to S3.
+
+    With engine="native" the FASTQ is instead streamed from S3 through
+    `fastq_stats` (optionally sampled, see `collect_fastq_stats`) and a
+    compact JSON/Parquet report is uploaded; FastQC stays the default
+    full-fidelity engine.
     """
     input_key = f"decompressed/{srr_id}.fastq"
+    if engine == "native":
+        manifest = StageManifest("QualityControl", srr_id, native_qc_key(srr_id), inputs=[input_key])
+        if manifest.is_current():
+            return
+        profile_phase("stream")
+        print(f"Computing native QC statistics for s3://{BUCKET_NAME}/{input_key}"
+              + (f" (sampling ~{sample_mb:g} MB)" if sample_mb else ""))
+        report = collect_fastq_stats(input_key, sample_mb)
+        profile_phase("upload")
+        manifest.write(publish_qc_report(srr_id, report, report_format))
+        return
+    if engine != "fastqc":
+        raise ValueError(f"Unknown QC engine '{engine}' (expected fastqc or native)")
     local_fastq = f"/tmp/{srr_id}.fastq"
-    local_qc_dir = "/tmp/qc_results/"
+    local_qc_dir = f"/tmp/qc_results/{srr_id}/"
+    manifest = StageManifest("QualityControl", srr_id, f"qc_reports/{srr_id}_fastqc.zip",
+                             inputs=[input_key], tools=["fastqc"])
+    if manifest.is_current():
+        return
 
+    profile_phase("download")
     print(f"Downloading s3://{BUCKET_NAME}/{input_key} to {local_fastq}")
-    s3_client.download_file(BUCKET_NAME, input_key, local_fastq)
+    download_object(input_key, local_fastq)
     print("Download complete.")
+    profile_phase("tool")
     os.makedirs(local_qc_dir, exist_ok=True)
     print(f"Running FastQC on {local_fastq}...")
     fastqc_command = ["fastqc", local_fastq, "-o", local_qc_dir]
@@ -256,70 +2061,480 @@ def qc_task(srr_id):
     output_zip_local = f"{local_qc_dir}{srr_id}_fastqc.zip"
     output_html_s3_key = f"qc_reports/{srr_id}_fastqc.html"
     output_zip_s3_key = f"qc_reports/{srr_id}_fastqc.zip"
+    profile_phase("upload")
     print(f"Uploading HTML report to s3://{BUCKET_NAME}/{output_html_s3_key}")
-    s3_client.upload_file(output_html_local, BUCKET_NAME, output_html_s3_key)
+    upload_object(output_html_local, output_html_s3_key)
     print(f"Uploading ZIP archive to s3://{BUCKET_NAME}/{output_zip_s3_key}")
-    s3_client.upload_file(output_zip_local, BUCKET_NAME, output_zip_s3_key)
+    upload_object(output_zip_local, output_zip_s3_key)
     print("Report uploads complete.")
+    manifest.write([output_html_s3_key, output_zip_s3_key])
+    profile_phase("cleanup")
     print("Cleaning up temporary files...")
     subprocess.run(["rm", "-rf", local_fastq, local_qc_dir], check=True)
 
+# --- CHANGE START: region-sharded scatter/gather variant calling ---
+VARIANT_SHARDS = int(os.environ.get("VARIANT_SHARDS", "1"))  # 1 = unsharded, 0 = auto (4 per vCPU)
+MIN_REGION_BP = 1_000_000  # don't split contigs finer than this
+
+def plan_variant_regions(fai_path: str, shards: int) -> list:
+    """
+    Splits the reference (from its .fai) into ~`shards` equal-sized regions in
+    reference order. Regions never span contigs, so each one maps to a single
+    `bcftools mpileup -r` and the concatenated output stays sorted. Contig names
+    are braced (`{chr1}:1-1000`) so names containing ':' (e.g. HLA contigs) parse.
+    """
+    contigs = []
+    with open(fai_path) as fai:
+        for line in fai:
+            name, length = line.split("\t")[:2]
+            contigs.append((name, int(length)))
+    target = max(MIN_REGION_BP, sum(length for _, length in contigs) // max(shards, 1) + 1)
+
+    regions = []
+    for name, length in contigs:
+        for start in range(1, length + 1, target):
+            regions.append(f"{{{name}}}:{start}-{min(start + target - 1, length)}")
+    return regions
+
+def ensure_sorted_indexed_bam(bam_path: str, local_ref_path: str) -> str:
+    """
+    Coordinate-sorts (if needed) and indexes a BAM/CRAM so it supports region
+    queries. Alignments from `align` already arrive sorted with their index.
+    """
+    threads = available_cpus()
+    header = subprocess.run(["samtools", "view", "-H", bam_path], check=True, capture_output=True, text=True).stdout
+    if "SO:coordinate" not in header:
+        print(f"Alignment is not coordinate-sorted; sorting with {threads} threads ...")
+        sorted_path = bam_path + ".sorted"
+        subprocess.run(["samtools", "sort", "-@", str(threads), "--reference", local_ref_path,
+                        "-O", bam_path.rsplit(".", 1)[-1].upper(), "-o", sorted_path, bam_path], check=True)
+        os.replace(sorted_path, bam_path)
+        for ext in (".bai", ".csi", ".crai"):
+            if os.path.exists(bam_path + ext):
+                os.remove(bam_path + ext)
+    if not any(os.path.exists(bam_path + ext) for ext in (".bai", ".csi", ".crai")):
+        index_alignment(bam_path, local_ref_path)
+    return bam_path
+
+def variant_call_command(local_ref_path: str, alignments: list, output: str = "-", region: str = None,
+                         read_groups: str = None, annotations: str = None) -> str:
+    """
+    The `bcftools mpileup | bcftools call` shell pipeline every calling path
+    runs, writing a bgzipped VCF to `output` ("-" = stdout). Built in one place
+    so unsharded, region-sharded and streamed runs emit the same header and
+    records; `--no-version` keeps per-run command lines (which name the region
+    and local paths) out of the header.
+    """
+    mpileup = ["bcftools", "mpileup", "--no-version"]
+    if annotations:
+        mpileup += ["-a", annotations]
+    if read_groups:
+        mpileup += ["--read-groups", read_groups]
+    mpileup += ["-f", local_ref_path]
+    if region:
+        mpileup += ["-r", region]
+    call = ["bcftools", "call", "--no-version", "-mv", "-O", "z", "-o", output]
+    return f"set -o pipefail; {shlex.join(mpileup + list(alignments))} | {shlex.join(call)}"
+
+def call_region(local_ref_path: str, bam_paths: list, region: str, output_path: str, read_groups: str = None,
+                annotations: str = None):
+    """
+    Runs `variant_call_command` over one region into a bgzipped VCF.
+    Several BAMs give one multi-sample pileup; `read_groups` maps each file to its sample name.
+    """
+    command = variant_call_command(local_ref_path, bam_paths, output_path, region, read_groups, annotations)
+    subprocess.run(command, shell=True, check=True, executable="/bin/bash")
+    return output_path
+
+def gather_vcfs(shard_paths: list, output_path: str):
+    """
+    Concatenates per-region VCFs (already in reference order) and indexes the
+    result: tabix (.tbi) for .vcf.gz, CSI for .bcf. Returns the index path.
+    """
+    if output_path.endswith(".bcf"):
+        subprocess.run(["bcftools", "concat", "--no-version", "-O", "b", "-o", output_path] + shard_paths, check=True)
+        subprocess.run(["bcftools", "index", output_path], check=True)
+        return output_path + ".csi"
+    subprocess.run(["bcftools", "concat", "--no-version", "-O", "z", "-o", output_path] + shard_paths, check=True)
+    subprocess.run(["bcftools", "index", "-t", output_path], check=True)
+    return output_path + ".tbi"
+
 @time_task_and_emit_metric("CallVariants")
-def variants_task(srr_id, reference_name):
+def variants_task(srr_id, reference_name, shards=VARIANT_SHARDS):
     """
     Downloads the BAM file and a specified reference genome, calls variants with bcftools,
     and uploads the resulting VCF file to S3.
+
+    With shards != 1 the reference is split into regions from its .fai and each
+    region is called on a worker pool, then concatenated in order.
     """
-    bam_key = f"alignments/{srr_id}.bam"
+    bam_key = alignment_key(srr_id)
     output_vcf_key = f"variants/{srr_id}.vcf.gz"
-    local_bam_path = f"/tmp/{srr_id}.bam"
+    local_bam_path = f"/tmp/{os.path.basename(bam_key)}"
+    local_vcf_path = f"/tmp/{srr_id}.vcf.gz"
+
+    manifest = StageManifest("CallVariants", srr_id, output_vcf_key, inputs=[bam_key],
+                             reference_name=reference_name, tools=["bcftools", "samtools"])
+    if manifest.is_current():
+        return
 
-    print(f"Downloading BAM file: {bam_key}")
-    s3_client.download_file(BUCKET_NAME, bam_key, local_bam_path)
+    profile_phase("download")
+    print(f"Downloading alignment file: {bam_key}")
+    download_object(bam_key, local_bam_path)
+    index_key = find_alignment_index_key(bam_key)
+    if index_key:
+        download_object(index_key, f"/tmp/{os.path.basename(index_key)}")
 
+    profile_phase("reference-prep")
     # --- CHANGE START: selective, safe reference fetching ---
-    local_ref_path = ensure_reference_local(reference_name)
+    local_ref_path = ensure_reference_local(reference_name, profile="variants")
     # --- CHANGE END ---
 
-    print(f"Calling variants for {srr_id}...")
-    variant_calling_command = (
-        f"bcftools mpileup -f {local_ref_path} {local_bam_path} | "
-        f"bcftools call -mv -o - -O z > /tmp/{srr_id}.vcf.gz"
-    )
-    subprocess.run(variant_calling_command, shell=True, check=True)
+    if shards == 1:
+        # The compressed VCF streams straight from bcftools into a multipart upload.
+        profile_phase("stream")
+        print(f"Calling variants for {srr_id} and streaming the VCF to s3://{BUCKET_NAME}/{output_vcf_key}...")
+        pipeline = StreamPipeline(f"call variants {srr_id}")
+        calls = pipeline.process("bcftools mpileup | bcftools call",
+                                 variant_call_command(local_ref_path, [local_bam_path]))
+        pipeline.s3_sink(calls, output_vcf_key)
+        pipeline.run()
+        print("Variant calling complete.")
+        manifest.write([output_vcf_key])
+        profile_phase("cleanup")
+        print("Cleaning up temporary local files...")
+        subprocess.run(["rm", "-rf", local_bam_path, local_bam_path + ".bai", local_bam_path + ".csi", local_bam_path + ".crai"], check=True)
+        return
+
+    profile_phase("tool")
+    if shards == 0:
+        shards = available_cpus() * 4
+    ensure_sorted_indexed_bam(local_bam_path, local_ref_path)
+    regions = plan_variant_regions(local_ref_path + ".fai", shards)
+    shard_dir = f"/tmp/{srr_id}_shards/"
+    os.makedirs(shard_dir, exist_ok=True)
+    print(f"Calling variants for {srr_id} over {len(regions)} regions on {available_cpus()} workers...")
+
+    with ThreadPoolExecutor(max_workers=available_cpus()) as pool:
+        futures = [
+            pool.submit(call_region, local_ref_path, [local_bam_path], region, f"{shard_dir}{i:05d}.vcf.gz")
+            for i, region in enumerate(regions)
+        ]
+        shard_paths = [future.result() for future in futures]
     print("Variant calling complete.")
+
+    gather_vcfs(shard_paths, local_vcf_path)
+    profile_phase("upload")
+    for local_path, key in [(local_vcf_path, output_vcf_key), (local_vcf_path + ".tbi", output_vcf_key + ".tbi")]:
+        print(f"Uploading {local_path} to s3://{BUCKET_NAME}/{key}")
+        upload_object(local_path, key)
+    manifest.write([output_vcf_key, output_vcf_key + ".tbi"])
+    print("Upload complete.")
+    profile_phase("cleanup")
+    print("Cleaning up temporary local files...")
+    subprocess.run(["rm", "-rf", local_bam_path, local_bam_path + ".bai", local_bam_path + ".csi", local_bam_path + ".crai",
+                    local_vcf_path, local_vcf_path + ".tbi", shard_dir], check=True)
+# --- CHANGE END ---
+
+# --- CHANGE START: joint (multi-sample) calling for cohorts ---
+JOINT_OUTPUT_FORMAT = os.environ.get("JOINT_OUTPUT_FORMAT", "vcf").lower()  # vcf (bgzipped) | bcf
+# Per-sample depth and allele depth for comparing genotypes within a family;
+# single-sample calling keeps its existing output.
+JOINT_ANNOTATIONS = "FORMAT/AD,FORMAT/DP"
+
+def cohort_id_for(sample_ids: list) -> str:
+    """Deterministic cohort name for a set of samples (order-independent)."""
+    digest = hashlib.sha1(",".join(sorted(sample_ids)).encode("utf-8")).hexdigest()[:12]
+    return f"cohort-{digest}"
+
+@time_task_and_emit_metric("JointCallVariants")
+def joint_variants_task(cohort_id, reference_name, sample_ids, shards=VARIANT_SHARDS):
+    """
+    Joint-calls a cohort (e.g. a trio): one multi-sample `bcftools mpileup` over
+    every sample's indexed alignment, sharded by region across a worker pool,
+    written as a single indexed multi-sample VCF/BCF under variants/cohorts/.
+    """
+    extension = "bcf" if JOINT_OUTPUT_FORMAT == "bcf" else "vcf.gz"
+    output_key = f"variants/cohorts/{cohort_id}.{extension}"
+    work_dir = f"/tmp/{cohort_id}/"
+    local_output_path = f"{work_dir}{cohort_id}.{extension}"
+    bam_keys = [alignment_key(srr_id) for srr_id in sample_ids]
+
+    manifest = StageManifest("JointCallVariants", cohort_id, output_key, inputs=bam_keys,
+                             reference_name=reference_name, tools=["bcftools", "samtools"])
+    if manifest.is_current():
+        return
+
+    profile_phase("download")
+    os.makedirs(f"{work_dir}shards/", exist_ok=True)
+    local_bam_paths = [f"{work_dir}{os.path.basename(key)}" for key in bam_keys]
+    transfers = list(zip(bam_keys, local_bam_paths))
+    for key in bam_keys:
+        index_key = find_alignment_index_key(key)
+        if index_key:
+            transfers.append((index_key, f"{work_dir}{os.path.basename(index_key)}"))
+    print(f"Downloading {len(bam_keys)} alignments for cohort {cohort_id}: {', '.join(sample_ids)}")
+    with ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY) as pool:
+        for future in [pool.submit(bind_profiler(download_object), key, path) for key, path in transfers]:
+            future.result()
+
+    profile_phase("reference-prep")
+    local_ref_path = ensure_reference_local(reference_name, profile="variants")
+
+    profile_phase("tool")
+    for path in local_bam_paths:
+        ensure_sorted_indexed_bam(path, local_ref_path)
+    # Name samples by ID regardless of the read groups (or lack of them) in each BAM.
+    read_groups = f"{work_dir}read_groups.txt"
+    with open(read_groups, "w") as f:
+        for srr_id, path in zip(sample_ids, local_bam_paths):
+            f.write(f"*\t{path}\t{srr_id}\n")
+
+    if shards == 0:
+        shards = available_cpus() * 4
+    regions = plan_variant_regions(local_ref_path + ".fai", shards)
+    print(f"Joint-calling {len(sample_ids)} samples over {len(regions)} regions on {available_cpus()} workers...")
+    with ThreadPoolExecutor(max_workers=available_cpus()) as pool:
+        futures = [
+            pool.submit(call_region, local_ref_path, local_bam_paths, region, f"{work_dir}shards/{i:05d}.vcf.gz",
+                        read_groups, JOINT_ANNOTATIONS)
+            for i, region in enumerate(regions)
+        ]
+        shard_paths = [future.result() for future in futures]
+    local_index_path = gather_vcfs(shard_paths, local_output_path)
+    print("Joint variant calling complete.")
+
+    profile_phase("upload")
+    output_keys = [output_key, f"{output_key}.{local_index_path.rsplit('.', 1)[-1]}"]
+    for local_path, key in zip([local_output_path, local_index_path], output_keys):
+        print(f"Uploading {local_path} to s3://{BUCKET_NAME}/{key}")
+        upload_object(local_path, key)
+    print("Upload complete.")
+    manifest.write(output_keys)
+    profile_phase("cleanup")
+    print("Cleaning up temporary local files...")
+    subprocess.run(["rm", "-rf", work_dir], check=True)
+# --- CHANGE END ---
+
+# --- CHANGE START: fused streaming pipeline (decompress -> QC -> align -> call) ---
+@time_task_and_emit_metric("Pipeline")
+def pipeline_task(srr_id, reference_name):
+    """
+    Runs decompress, QC, alignment and variant calling as one fused stream.
+    The raw .fastq.gz is read from S3 once (paired-end mates side by side, then
+    interleaved as in `decompress_task`); decompressed reads are teed into FastQC
+    and `bwa mem`, and the sorted BAM is teed to local disk and `bcftools`.
+    No intermediate FASTQ is written to S3; only the QC reports, BAM (+ index)
+    and VCF are uploaded.
+    """
+    input_keys = raw_read_keys(srr_id)
+    output_bam_key = alignment_key(srr_id)
+    output_vcf_key = f"variants/{srr_id}.vcf.gz"
+    local_bam_path = f"/tmp/{os.path.basename(output_bam_key)}"
     local_vcf_path = f"/tmp/{srr_id}.vcf.gz"
-    print(f"Uploading VCF file to s3://{BUCKET_NAME}/{output_vcf_key}")
-    s3_client.upload_file(local_vcf_path, BUCKET_NAME, output_vcf_key)
+    local_qc_dir = f"/tmp/qc_results/{srr_id}/"
+    os.makedirs(local_qc_dir, exist_ok=True)
+    manifest = StageManifest("Pipeline", srr_id, output_vcf_key, inputs=input_keys, reference_name=reference_name,
+                             tools=["fastqc", "bwa", "samtools", "bcftools"])
+    if manifest.is_current():
+        return
+
+    profile_phase("reference-prep")
+    local_ref_path = ensure_reference_local(reference_name, profile="align")
+
+    profile_phase("stream")
+    pipeline = StreamPipeline(f"pipeline {srr_id}")
+    for input_key in input_keys:
+        print(f"Starting fused pipeline stream for s3://{BUCKET_NAME}/{input_key}")
+    mates = [pipeline.decompress(pipeline.s3_source(input_key)) for input_key in input_keys]
+    reads = pipeline.interleave(mates) if len(mates) > 1 else mates[0]
+    qc_reads, align_reads = pipeline.tee(reads, 2)
+    # FastQC accepts `stdin:<name>` and names its reports after <name>.
+    pipeline.process("fastqc", ["fastqc", f"stdin:{srr_id}", "-o", local_qc_dir], qc_reads, capture_stdout=False)
+    cpus = available_cpus()
+    alignments = pipeline.process(
+        "bwa mem | samtools sort",
+        f"set -o pipefail; bwa mem -p -t {cpus} {local_ref_path} - | {sort_command(local_ref_path, '-', cpus)}",
+        align_reads
+    )
+    bam_copy, call_input = pipeline.tee(alignments, 2)
+    pipeline.file_sink(bam_copy, local_bam_path)
+    pipeline.process(
+        "bcftools mpileup | bcftools call",
+        variant_call_command(local_ref_path, ["-"], local_vcf_path),
+        call_input, capture_stdout=False
+    )
+    pipeline.run()
+    local_index_path = index_alignment(local_bam_path, local_ref_path)
+    print("Fused pipeline complete.")
+
+    profile_phase("upload")
+    uploads = [
+        (f"{local_qc_dir}{srr_id}_fastqc.html", f"qc_reports/{srr_id}_fastqc.html"),
+        (f"{local_qc_dir}{srr_id}_fastqc.zip", f"qc_reports/{srr_id}_fastqc.zip"),
+        (local_bam_path, output_bam_key),
+        (local_index_path, f"alignments/{os.path.basename(local_index_path)}"),
+        (local_vcf_path, output_vcf_key),
+    ]
+    for local_path, key in uploads:
+        print(f"Uploading {local_path} to s3://{BUCKET_NAME}/{key}")
+        upload_object(local_path, key)
     print("Upload complete.")
+    remove_stale_alignment_indexes(output_bam_key, keep=f"alignments/{os.path.basename(local_index_path)}")
+    manifest.write([key for _, key in uploads])
+    profile_phase("cleanup")
     print("Cleaning up temporary local files...")
-    subprocess.run(["rm", "-rf", local_bam_path, os.path.dirname(local_ref_path), local_vcf_path], check=True)
+    subprocess.run(["rm", "-rf", local_bam_path, local_index_path, local_vcf_path, local_qc_dir], check=True)
+# --- CHANGE END ---
+
+# --- CHANGE START: multi-sample batch mode ---
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "2"))
+BWA_SHM = os.environ.get("BWA_SHM", "0") == "1"  # needs a /dev/shm large enough for the index
+
+def load_sample_ids(srr_arg: str) -> list:
+    """
+    Resolves the CLI sample argument: a single ID, a comma-separated list, or
+    `@<s3-key>` naming a manifest in the bucket (JSON list, or one ID per line).
+    """
+    if srr_arg.startswith("@"):
+        body = s3_client.get_object(Bucket=BUCKET_NAME, Key=srr_arg[1:])['Body'].read().decode("utf-8")
+        try:
+            ids = json.loads(body)
+        except ValueError:
+            ids = body.splitlines()
+    else:
+        ids = srr_arg.split(",")
+    ids = [i.strip() for i in ids if i.strip() and not i.strip().startswith("#")]
+    # Keep first occurrence order; duplicates would race on the same /tmp paths.
+    return list(dict.fromkeys(ids))
+
+def _warm_page_cache(local_ref_path: str):
+    """Reads the reference and its indexes once so every sample's tool load hits the page cache."""
+    for path in [local_ref_path] + [local_ref_path + ext for ext in REFERENCE_PROFILES["align"]]:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                while f.read(STREAM_CHUNK_SIZE * 16):
+                    pass
+
+def run_batch(task_name, sample_ids, sample_command, reference_name=None, profile=None, workers=BATCH_WORKERS):
+    """
+    Runs one task over many samples inside a single job with a bounded worker
+    pool. The reference is prepared once up front (and optionally pinned in
+    shared memory with `bwa shm`) so every sample hits the local cache and
+    per-sample setup is just the sample's own data.
+
+    Each sample runs as its own `tasks.py` process (`sample_command(srr_id)`
+    gives its argv), so its decorator metrics and stage profile cover only its
+    own tools, and with TASK_CPUS set to an equal share of the vCPUs the
+    concurrent samples' bwa/samtools/bcftools threads add up to the cores we
+    have. A failure is recorded and reported without stopping the other samples.
+
+    Returns {srr_id: None on success, or the exception}.
+    """
+    bwa_shm_loaded = False
+    if reference_name and profile:
+        local_ref_path = ensure_reference_local(reference_name, profile=profile)
+        _warm_page_cache(local_ref_path)
+        if BWA_SHM and profile == "align":
+            print(f"Loading BWA index into shared memory: {local_ref_path}")
+            subprocess.run(["bwa", "shm", local_ref_path], check=True)
+            bwa_shm_loaded = True
+
+    workers = max(1, min(workers, len(sample_ids)))
+    cpus_per_sample = max(1, available_cpus() // workers)
+    env = dict(os.environ, TASK_CPUS=str(cpus_per_sample))
+    print(f"Batch '{task_name}': {len(sample_ids)} sample(s) on {workers} worker(s), {cpus_per_sample} vCPU(s) each")
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(subprocess.run, sample_command(srr_id), check=True, env=env): srr_id
+                       for srr_id in sample_ids}
+            for future, srr_id in futures.items():
+                try:
+                    future.result()
+                    results[srr_id] = None
+                except Exception as e:
+                    results[srr_id] = e
+    finally:
+        if bwa_shm_loaded:
+            subprocess.run(["bwa", "shm", "-d"], check=False)
+
+    failed = {srr_id: e for srr_id, e in results.items() if e is not None}
+    print(f"\nBatch '{task_name}' summary: {len(results) - len(failed)} succeeded, {len(failed)} failed")
+    for srr_id, e in results.items():
+        print(f"  {srr_id:<20} {'FAILED: ' + str(e) if e is not None else 'ok'}")
+    emit_metric('BatchSamples', len(results), 'Count', {'TaskName': task_name})
+    emit_metric('BatchFailures', len(failed), 'Count', {'TaskName': task_name})
+    return results
+# --- CHANGE END ---
 
 # --- Main execution block ---
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Runs a bioinformatics pipeline task.")
-    parser.add_argument("task_name", help="The name of the task to run: decompress, qc, align, variants")
-    parser.add_argument("srr_id", help="The sample ID to process, e.g., SRR062634")
-    parser.add_argument("reference_name", nargs="?", default=None, help="The reference genome filename. Required for align and variants.")
+    parser.add_argument("task_name", help="The name of the task to run: decompress, qc, align_plan, align, align_merge, variants, pipeline")
+    parser.add_argument("srr_id", help="The sample ID to process, e.g., SRR062634. Several samples: SRR1,SRR2 or @<s3-key> of a manifest listing them.")
+    parser.add_argument("reference_name", nargs="?", default=None, help="The reference genome filename. Required for align_plan, align, align_merge, variants and pipeline.")
+    parser.add_argument("--force", action="store_true", help="Re-run even if a stage manifest shows the outputs are up to date.")
+    parser.add_argument("--shards", type=int, default=VARIANT_SHARDS, help="variants: number of regions to call in parallel (1 = unsharded, 0 = auto).")
+    parser.add_argument("--joint", action="store_true", help="variants: joint-call all given samples into one multi-sample VCF/BCF instead of one VCF each.")
+    parser.add_argument("--cohort-id", default=None, help="variants --joint: name of the cohort output (default derived from the sample IDs).")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Samples processed concurrently when several sample IDs are given.")
+    parser.add_argument("--qc-engine", choices=["fastqc", "native"], default=QC_ENGINE, help="qc: FastQC (full HTML/ZIP report) or native streaming statistics (JSON/Parquet).")
+    parser.add_argument("--qc-sample-mb", type=float, default=QC_SAMPLE_MB, help="qc --qc-engine=native: read only ~this many MB spread across the file (0 = whole file).")
+    parser.add_argument("--inline-qc", choices=["true", "false"], default="true" if DECOMPRESS_INLINE_QC else "false", help="decompress: also compute the native QC report from the decompressed stream, so the qc task can be skipped.")
+    parser.add_argument("--qc-format", choices=["json", "parquet"], default=QC_REPORT_FORMAT, help="qc --qc-engine=native: report format (parquet tables are written alongside the JSON).")
     args = parser.parse_args()
+    if args.force:
+        FORCE_RERUN = True
 
     task_map = {
         "decompress": decompress_task,
         "qc": qc_task,
+        "align_plan": align_plan_task,
         "align": align_task,
-        "variants": variants_task
+        "align_merge": align_merge_task,
+        "variants": variants_task,
+        "pipeline": pipeline_task
     }
+    reference_profiles = {"align": "align", "pipeline": "align", "variants": "variants", "align_merge": "variants"}
 
-    if args.task_name in task_map:
-        if args.task_name in ["align", "variants"]:
-            if not args.reference_name:
-                print(f"Error: '{args.task_name}' task requires a reference_name argument.")
-                exit(1)
-            task_map[args.task_name](args.srr_id, args.reference_name)
-        else:
-            task_map[args.task_name](args.srr_id)
-    else:
+    if args.task_name not in task_map:
         print(f"Error: Unknown task '{args.task_name}'")
         exit(1)
 
-    print(f"\nTask '{args.task_name}' driver script completed successfully for sample '{args.srr_id}'.")
+    task_args = ()
+    task_kwargs = {}
+    if args.task_name in ["align_plan", "align", "align_merge", "variants", "pipeline"]:
+        if not args.reference_name:
+            print(f"Error: '{args.task_name}' task requires a reference_name argument.")
+            exit(1)
+        task_args = (args.reference_name,)
+    if args.task_name == "variants":
+        task_kwargs["shards"] = args.shards
+    if args.task_name == "decompress":
+        task_kwargs["inline_qc"] = args.inline_qc == "true"
+    if args.task_name == "qc":
+        task_kwargs.update(engine=args.qc_engine, sample_mb=args.qc_sample_mb, report_format=args.qc_format)
+
+    sample_ids = load_sample_ids(args.srr_id)
+    if args.joint:
+        if args.task_name != "variants":
+            print("Error: --joint is only supported for the 'variants' task.")
+            exit(1)
+        joint_variants_task(args.cohort_id or cohort_id_for(sample_ids), args.reference_name, sample_ids, **task_kwargs)
+    elif len(sample_ids) == 1:
+        task_map[args.task_name](sample_ids[0], *task_args, **task_kwargs)
+    else:
+        def sample_command(srr_id):
+            """The single-sample equivalent of this invocation."""
+            command = [sys.executable, os.path.abspath(__file__), args.task_name, srr_id, *task_args,
+                       "--shards", str(args.shards), "--inline-qc", args.inline_qc, "--qc-engine", args.qc_engine,
+                       "--qc-sample-mb", str(args.qc_sample_mb), "--qc-format", args.qc_format]
+            return command + (["--force"] if args.force else [])
+
+        results = run_batch(args.task_name, sample_ids, sample_command, reference_name=args.reference_name,
+                            profile=reference_profiles.get(args.task_name), workers=args.workers)
+        if any(e is not None for e in results.values()):
+            exit(1)
+
+    print(f"\nTask '{args.task_name}' driver script completed successfully for sample(s) '{', '.join(sample_ids)}'.")
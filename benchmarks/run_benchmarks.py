@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the pipeline stages in app/tasks.py, run locally.
+
+- S3 and CloudWatch are a moto server started in-process (or any S3-compatible
+  endpoint such as MinIO via --endpoint-url), so tasks.py runs unmodified with
+  AWS_ENDPOINT_URL pointed at it.
+- A synthetic reference and FASTQ inputs at each --sizes value are generated
+  once and reused from --workdir.
+- Each stage runs as its own `python app/tasks.py` process (with --force so
+  manifests never skip work). Records per stage: wall time, input throughput,
+  peak RSS (the larger of the process tree's rusage and the stage profiler's
+  sampled peak), peak scratch disk, and the profiler's phase breakdown.
+- Results are appended as JSON lines to --output; a summary table is printed.
+
+Stages whose tools are not installed (bwa, samtools, bcftools, fastqc) are
+skipped, as are stages after a failure for the same input.
+
+Example:
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/run_benchmarks.py --sizes 50MB,200MB --stages decompress,qc,align,variants
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+
+from synthetic_data import parse_size, read_reference, write_fastq, write_reference
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TASKS_PY = os.path.join(REPO_ROOT, "app", "tasks.py")
+BUCKET = "geyser-benchmark"
+REGION = "eu-west-2"
+REFERENCE_NAME = "benchmark_ref.fa"
+
+# CLI task name -> (profiler task name, tools it needs, S3 key of its main input)
+STAGES = {
+    "decompress": ("Decompress", [], lambda srr: f"raw_reads/{srr}.fastq.gz"),
+    "qc": ("QualityControl", ["fastqc"], lambda srr: f"decompressed/{srr}.fastq"),
+    "align": ("Align", ["bwa", "samtools"], lambda srr: f"decompressed/{srr}.fastq"),
+    "variants": ("CallVariants", ["bcftools", "samtools"], lambda srr: f"alignments/{srr}.bam"),
+}
+NEEDS_REFERENCE = {"align", "variants"}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_moto_server():
+    """Starts a moto server (S3 + CloudWatch + the rest) on a free local port; returns (server, url)."""
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError as e:
+        raise SystemExit("moto[server] is required for the local S3 stand-in: pip install -r benchmarks/requirements.txt") from e
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def object_size(s3, key):
+    try:
+        return s3.head_object(Bucket=BUCKET, Key=key)["ContentLength"]
+    except ClientError:
+        return None
+
+
+def run_stage(task, srr_id, env, log_path):
+    """Runs one tasks.py stage; returns (exit code, wall seconds, peak RSS bytes of the process tree)."""
+    command = [sys.executable, TASKS_PY, task, srr_id]
+    if task in NEEDS_REFERENCE:
+        command.append(REFERENCE_NAME)
+    command.append("--force")
+    with open(log_path, "w") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=os.path.dirname(TASKS_PY), env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 reports the child's own rusage; ru_maxrss covers it and the descendants it waited for.
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, wall, usage.ru_maxrss * 1024
+
+
+def prepare_inputs(args, s3):
+    """Generates (or reuses) the reference and FASTQ inputs and uploads them; returns [(srr_id, target_bytes)]."""
+    os.makedirs(args.workdir, exist_ok=True)
+    reference_path = os.path.join(args.workdir, f"ref_{args.contigs}x{args.contig_length}_{args.seed}.fa")
+    if not os.path.exists(reference_path):
+        print(f"Generating reference: {args.contigs} contig(s) x {args.contig_length} bp")
+        write_reference(reference_path, args.contigs, parse_size(args.contig_length), args.seed)
+    s3.upload_file(reference_path, BUCKET, f"reference/{REFERENCE_NAME}")
+    reference = read_reference(reference_path)
+
+    samples = []
+    for size in args.sizes.split(","):
+        target = parse_size(size)
+        srr_id = f"bench_{size.strip().lower()}"
+        fastq_path = os.path.join(args.workdir, f"{srr_id}_{args.read_length}bp_{args.compress}_{args.seed}.fastq.gz")
+        if not os.path.exists(fastq_path):
+            print(f"Generating {size} of {args.read_length} bp reads ({args.compress})")
+            write_fastq(fastq_path, reference, target, args.read_length, args.error_rate, args.seed + 1, args.compress)
+        s3.upload_file(fastq_path, BUCKET, f"raw_reads/{srr_id}.fastq.gz")
+        samples.append((srr_id, target))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tasks.py stages against a local S3 stand-in.")
+    parser.add_argument("--sizes", default="50MB", help="Comma-separated uncompressed FASTQ sizes, e.g. 50MB,500MB,2GB")
+    parser.add_argument("--stages", default="decompress,qc,align,variants", help=f"Comma-separated, from: {', '.join(STAGES)}")
+    parser.add_argument("--contigs", type=int, default=2, help="Reference contigs")
+    parser.add_argument("--contig-length", default="2Mb", help="Length of each reference contig")
+    parser.add_argument("--read-length", type=int, default=150)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--compress", choices=["gzip", "bgzf"], default="gzip", help="Raw read compression")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage and size")
+    parser.add_argument("--cold-reference", action="store_true", help="Clear the local reference cache before every stage")
+    parser.add_argument("--workdir", default=os.path.join(REPO_ROOT, "benchmarks", ".work"), help="Generated inputs and logs")
+    parser.add_argument("--output", default=os.path.join(REPO_ROOT, "benchmarks", "results", "results.jsonl"))
+    parser.add_argument("--endpoint-url", default=None, help="Use an existing S3-compatible endpoint (e.g. MinIO) instead of moto")
+    parser.add_argument("--stage-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra environment for tasks.py, e.g. DECOMPRESS_BACKEND=zlib or QC_ENGINE=native (repeatable)")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"Unknown stage(s): {', '.join(unknown)}")
+
+    server = None
+    endpoint = args.endpoint_url
+    if not endpoint:
+        server, endpoint = start_moto_server()
+        print(f"Started moto server at {endpoint}")
+    credentials = {"AWS_ACCESS_KEY_ID": os.environ.get("AWS_ACCESS_KEY_ID", "benchmark"),
+                   "AWS_SECRET_ACCESS_KEY": os.environ.get("AWS_SECRET_ACCESS_KEY", "benchmark")}
+    s3 = boto3.client("s3", endpoint_url=endpoint, region_name=REGION,
+                      aws_access_key_id=credentials["AWS_ACCESS_KEY_ID"],
+                      aws_secret_access_key=credentials["AWS_SECRET_ACCESS_KEY"])
+    try:
+        s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": REGION})
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("BucketAlreadyOwnedByYou", "BucketAlreadyExists"):
+            raise
+
+    reference_cache = os.path.join(args.workdir, "reference_cache")
+    env = dict(os.environ, **credentials,
+               AWS_ENDPOINT_URL=endpoint, AWS_REGION=REGION, AWS_DEFAULT_REGION=REGION,
+               BUCKET_NAME=BUCKET, REFERENCE_CACHE_DIR=reference_cache,
+               METRICS_MODE="api", APP_VERSION=f"benchmark-{git_commit()}")
+    for item in args.stage_env:
+        name, _, value = item.partition("=")
+        env[name] = value
+
+    run_info = {"timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"), "git_commit": git_commit(),
+                "host": {"cpus": os.cpu_count(), "platform": platform.platform(), "python": platform.python_version()},
+                "endpoint": "moto" if server else endpoint, "stage_env": args.stage_env}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    results = []
+    try:
+        samples = prepare_inputs(args, s3)
+        for srr_id, target in samples:
+            failed = False
+            for stage in stages:
+                task_name, tools, input_key = STAGES[stage]
+                if stage == "qc" and env.get("QC_ENGINE") == "native":
+                    tools = []
+                missing = [tool for tool in tools if not shutil.which(tool)]
+                if missing or failed:
+                    reason = f"missing tools: {', '.join(missing)}" if missing else "an earlier stage failed"
+                    print(f"Skipping {stage} for {srr_id} ({reason})")
+                    continue
+                for attempt in range(args.repeat):
+                    if args.cold_reference:
+                        shutil.rmtree(reference_cache, ignore_errors=True)
+                    log_path = os.path.join(args.workdir, f"{srr_id}.{stage}.{attempt}.log")
+                    print(f"Running {stage} on {srr_id} (run {attempt + 1}/{args.repeat})...", flush=True)
+                    code, wall, rusage_peak = run_stage(stage, srr_id, env, log_path)
+                    input_bytes = object_size(s3, input_key(srr_id))
+                    try:
+                        profile = json.loads(s3.get_object(Bucket=BUCKET, Key=f"profiles/{srr_id}/{task_name}.json")["Body"].read())
+                    except ClientError:
+                        profile = {}
+                    resources = profile.get("resources", {})
+                    result = dict(run_info, **{
+                        "sample_id": srr_id, "fastq_target_bytes": target, "stage": stage, "run": attempt + 1,
+                        "status": "SUCCEEDED" if code == 0 else "FAILED", "exit_code": code,
+                        "wall_seconds": round(wall, 3), "input_bytes": input_bytes,
+                        "throughput_mb_s": round(input_bytes / 1e6 / wall, 2) if input_bytes and wall else None,
+                        "peak_rss_bytes": max(rusage_peak, resources.get("peak_rss_bytes") or 0),
+                        "peak_disk_bytes": resources.get("peak_disk_bytes"),
+                        "avg_cpu_pct": resources.get("avg_cpu_pct"),
+                        "phases": profile.get("phases", []), "log": log_path,
+                    })
+                    results.append(result)
+                    with open(args.output, "a") as f:
+                        f.write(json.dumps(result) + "\n")
+                    if code != 0:
+                        print(f"  FAILED (exit {code}); see {log_path}")
+                        failed = True
+                        break
+    finally:
+        if server:
+            server.stop()
+
+    print(f"\n{'Sample':<16} {'Stage':<11} {'Status':<9} {'Wall':>9} {'Input MB':>9} {'MB/s':>8} {'Peak RSS MB':>11} {'Peak disk MB':>12}")
+    for r in results:
+        mb = lambda value: f"{value / 1e6:.1f}" if value is not None else "---"
+        print(f"{r['sample_id']:<16} {r['stage']:<11} {r['status']:<9} {r['wall_seconds']:>8.2f}s {mb(r['input_bytes']):>9} "
+              f"{r['throughput_mb_s'] if r['throughput_mb_s'] is not None else '---':>8} "
+              f"{mb(r['peak_rss_bytes']):>11} {mb(r['peak_disk_bytes']):>12}")
+    print(f"\nAppended {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Synthetic inputs for the benchmark suite: a random multi-contig reference
+FASTA and gzipped FASTQ reads sampled from it (random strand, substitution
+errors), at a configurable size.
+
+Usable on its own:
+    python benchmarks/synthetic_data.py reference ref.fa --contigs 2 --contig-length 5Mb
+    python benchmarks/synthetic_data.py reads ref.fa reads.fastq.gz --size 200MB
+"""
+
+import argparse
+import gzip
+import random
+import re
+import shutil
+import subprocess
+
+BASES = b"ACGT"
+# Maps every byte value onto A/C/G/T, so random bytes become a random sequence in one C-level pass.
+_TO_BASES = bytes.maketrans(bytes(range(256)), bytes(BASES[i % 4] for i in range(256)))
+_COMPLEMENT = bytes.maketrans(b"ACGTN", b"TGCAN")
+FASTA_LINE_WIDTH = 60
+
+
+def parse_size(value: str) -> int:
+    """'500', '64KB', '200MB', '1.5GB', '5Mb' (base pairs use the same suffixes) -> int."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([kKmMgG]?)[bB]?\s*", value)
+    if not match:
+        raise ValueError(f"Unrecognised size '{value}'")
+    scale = {"": 1, "k": 10 ** 3, "m": 10 ** 6, "g": 10 ** 9}[match.group(2).lower()]
+    return int(float(match.group(1)) * scale)
+
+
+def random_sequence(length: int, rng: random.Random) -> bytes:
+    return rng.randbytes(length).translate(_TO_BASES)
+
+
+def write_reference(path: str, contigs: int = 1, contig_length: int = 1_000_000, seed: int = 1) -> dict:
+    """Writes a random FASTA with contigs chr1..chrN and returns {name: sequence}."""
+    rng = random.Random(seed)
+    sequences = {}
+    with open(path, "wb") as f:
+        for i in range(1, contigs + 1):
+            name = f"chr{i}"
+            sequence = random_sequence(contig_length, rng)
+            sequences[name] = sequence
+            f.write(f">{name}\n".encode())
+            for start in range(0, contig_length, FASTA_LINE_WIDTH):
+                f.write(sequence[start:start + FASTA_LINE_WIDTH] + b"\n")
+    return sequences
+
+
+def read_reference(path: str) -> dict:
+    """{name: sequence} from a FASTA file."""
+    sequences, name, chunks = {}, None, []
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b">"):
+                if name:
+                    sequences[name] = b"".join(chunks)
+                name, chunks = line[1:].split()[0].decode(), []
+            else:
+                chunks.append(line.strip().upper())
+    if name:
+        sequences[name] = b"".join(chunks)
+    return sequences
+
+
+def write_fastq(path: str, reference: dict, target_bytes: int, read_length: int = 150,
+                error_rate: float = 0.01, seed: int = 2, compress: str = "gzip") -> int:
+    """
+    Writes reads sampled uniformly from `reference` until the uncompressed FASTQ
+    reaches `target_bytes`. Half the reads are reverse-complemented and each
+    base is substituted with probability `error_rate`. `compress` is "gzip"
+    (level 1), "bgzf" (needs `bgzip` on PATH) or "none". Returns the read count.
+    """
+    rng = random.Random(seed)
+    contigs = [(name, seq) for name, seq in reference.items() if len(seq) >= read_length]
+    if not contigs:
+        raise ValueError(f"No reference contig is at least {read_length} bp long")
+    weights = [len(seq) for _, seq in contigs]
+    quality = b"I" * read_length
+    errors_per_read = read_length * error_rate
+
+    if compress == "gzip":
+        out = gzip.open(path, "wb", compresslevel=1)
+    elif compress == "bgzf":
+        if not shutil.which("bgzip"):
+            raise RuntimeError("bgzf output needs `bgzip` (htslib/tabix) on PATH")
+        out_file = open(path, "wb")
+        bgzip = subprocess.Popen(["bgzip", "-c"], stdin=subprocess.PIPE, stdout=out_file)
+        out = bgzip.stdin
+    elif compress == "none":
+        out = open(path, "wb")
+    else:
+        raise ValueError(f"Unknown compression '{compress}'")
+
+    written = 0
+    reads = 0
+    batch = []
+    try:
+        while written < target_bytes:
+            name, sequence = rng.choices(contigs, weights)[0]
+            start = rng.randrange(len(sequence) - read_length + 1)
+            read = bytearray(sequence[start:start + read_length])
+            n_errors = int(errors_per_read) + (rng.random() < errors_per_read % 1)
+            for position in rng.sample(range(read_length), n_errors):
+                read[position] = BASES[(BASES.index(read[position]) + rng.randrange(1, 4)) % 4]
+            if rng.random() < 0.5:
+                read = bytes(read).translate(_COMPLEMENT)[::-1]
+            record = b"@synthetic.%d %s:%d\n%s\n+\n%s\n" % (reads, name.encode(), start + 1, bytes(read), quality)
+            batch.append(record)
+            written += len(record)
+            reads += 1
+            if len(batch) >= 10000:
+                out.write(b"".join(batch))
+                batch.clear()
+        out.write(b"".join(batch))
+    finally:
+        out.close()
+        if compress == "bgzf":
+            bgzip.wait()
+            out_file.close()
+    return reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark inputs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ref = sub.add_parser("reference", help="Write a random reference FASTA")
+    ref.add_argument("output")
+    ref.add_argument("--contigs", type=int, default=1)
+    ref.add_argument("--contig-length", default="1Mb")
+    ref.add_argument("--seed", type=int, default=1)
+    reads = sub.add_parser("reads", help="Write FASTQ reads sampled from a reference")
+    reads.add_argument("reference")
+    reads.add_argument("output")
+    reads.add_argument("--size", default="100MB", help="Uncompressed FASTQ size")
+    reads.add_argument("--read-length", type=int, default=150)
+    reads.add_argument("--error-rate", type=float, default=0.01)
+    reads.add_argument("--compress", choices=["gzip", "bgzf", "none"], default="gzip")
+    reads.add_argument("--seed", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.command == "reference":
+        write_reference(args.output, args.contigs, parse_size(args.contig_length), args.seed)
+        print(f"Wrote {args.output}")
+    else:
+        count = write_fastq(args.output, read_reference(args.reference), parse_size(args.size),
+                            args.read_length, args.error_rate, args.seed, args.compress)
+        print(f"Wrote {count} reads to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -39,3 +39,26 @@ resource "aws_iam_role_policy_attachment" "task_role_cloudwatch_metrics_access"
   # This references the policy we created earlier in iam_batch.tf
   policy_arn = aws_iam_policy.geyser_batch_metrics_policy.arn
 }
+
+# 3. Mount and write the shared reference cache (EFS, through its access point)
+resource "aws_iam_policy" "geyser_reference_cache_policy" {
+  name        = "${var.project_name}-reference-cache-efs-policy"
+  description = "Allows Batch jobs to mount the shared reference cache file system"
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect    = "Allow",
+        Action    = ["elasticfilesystem:ClientMount", "elasticfilesystem:ClientWrite"],
+        Resource  = aws_efs_file_system.reference_cache.arn,
+        Condition = { StringEquals = { "elasticfilesystem:AccessPointArn" = aws_efs_access_point.reference_cache.arn } }
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "task_role_reference_cache_access" {
+  role       = aws_iam_role.geyser_batch_task_role.name
+  policy_arn = aws_iam_policy.geyser_reference_cache_policy.arn
+}
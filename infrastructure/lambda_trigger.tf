@@ -50,7 +50,30 @@ resource "aws_iam_policy" "geyser_geyser_sfn_trigger_policy" {
       {
         Action   = "states:StartExecution",
         Effect   = "Allow",
-        Resource = aws_sfn_state_machine.geyser_pipeline_state_machine.id
+        Resource = [aws_sfn_state_machine.geyser_pipeline_state_machine.id, aws_sfn_state_machine.geyser_cohort_state_machine.id]
+      },
+      {
+        Action   = ["s3:GetObject", "s3:GetObjectTagging"],
+        Effect   = "Allow",
+        Resource = ["${aws_s3_bucket.data_lake.arn}/raw_reads/*", "${aws_s3_bucket.data_lake.arn}/${var.reference_routing_key}"]
+      },
+      {
+        # Without ListBucket, S3 answers GETs for missing keys with 403 instead of 404,
+        # so an absent sidecar or routing table would look like a permissions failure.
+        Action    = "s3:ListBucket",
+        Effect    = "Allow",
+        Resource  = aws_s3_bucket.data_lake.arn,
+        Condition = { StringLike = { "s3:prefix" = ["raw_reads/*", var.reference_routing_key] } }
+      },
+      {
+        Action   = "dynamodb:UpdateItem",
+        Effect   = "Allow",
+        Resource = aws_dynamodb_table.sample_pairing_index.arn
+      },
+      {
+        Action   = ["sqs:ReceiveMessage", "sqs:DeleteMessage", "sqs:GetQueueAttributes"],
+        Effect   = "Allow",
+        Resource = aws_sqs_queue.upload_batch_queue.arn
       }
     ]
   })
@@ -72,11 +95,18 @@ resource "aws_lambda_function" "geyser_sfn_trigger" {
 
   handler = "index.handler"
   runtime = "python3.11"
-  timeout = 30
+  # Leaves room for throttling backoff while starting a large batch of executions.
+  timeout = 60
 
   environment {
     variables = {
-      STATE_MACHINE_ARN = aws_sfn_state_machine.geyser_pipeline_state_machine.id
+      STATE_MACHINE_ARN        = aws_sfn_state_machine.geyser_pipeline_state_machine.id
+      COHORT_STATE_MACHINE_ARN = aws_sfn_state_machine.geyser_cohort_state_machine.id
+      BATCH_MODE               = var.trigger_batch_mode
+      MAX_START_CONCURRENCY    = "5"
+      PAIRING_TABLE            = aws_dynamodb_table.sample_pairing_index.name
+      ROUTING_TABLE_KEY        = var.reference_routing_key
+      DEFAULT_REFERENCE_GENOME = var.default_reference_genome
     }
   }
 
@@ -85,21 +115,60 @@ resource "aws_lambda_function" "geyser_sfn_trigger" {
   }
 }
 
+# --- Paired-end pairing index ---
+# One item per paired sample, recording which mates (_1/_2) have been uploaded;
+# the pipeline starts only once every mate is present. Stale items expire via TTL.
+resource "aws_dynamodb_table" "sample_pairing_index" {
+  name         = "${var.project_name}-sample-pairing-${var.environment}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "sample_id"
+
+  attribute {
+    name = "sample_id"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  tags = {
+    Project = var.project_name
+  }
+}
+
+
 # --- S3 Bucket Notification Trigger ---
 # This resource configures the S3 bucket to invoke our Lambda on object creation.
 resource "aws_s3_bucket_notification" "data_lake_upload_trigger" {
   bucket = aws_s3_bucket.data_lake.id
 
-  lambda_function {
-    lambda_function_arn = aws_lambda_function.geyser_sfn_trigger.arn
-    events              = ["s3:ObjectCreated:*"]
+  # In 'single' mode S3 invokes the Lambda directly, one upload at a time.
+  dynamic "lambda_function" {
+    for_each = var.trigger_batch_mode == "single" ? [1] : []
+    content {
+      lambda_function_arn = aws_lambda_function.geyser_sfn_trigger.arn
+      events              = ["s3:ObjectCreated:*"]
 
-    # CORRECTED: Filter prefix now matches the application code's expectation.
-    filter_prefix = "raw_reads/"
-    filter_suffix = ".gz"
+      # CORRECTED: Filter prefix now matches the application code's expectation.
+      filter_prefix = "raw_reads/"
+      filter_suffix = ".gz"
+    }
+  }
+
+  # In 'cohort' mode uploads are buffered in SQS and delivered to the Lambda in batches.
+  dynamic "queue" {
+    for_each = var.trigger_batch_mode == "cohort" ? [1] : []
+    content {
+      queue_arn     = aws_sqs_queue.upload_batch_queue.arn
+      events        = ["s3:ObjectCreated:*"]
+      filter_prefix = "raw_reads/"
+      filter_suffix = ".gz"
+    }
   }
 
-  depends_on = [aws_lambda_permission.allow_s3_to_invoke_lambda]
+  depends_on = [aws_lambda_permission.allow_s3_to_invoke_lambda, aws_sqs_queue_policy.upload_batch_queue_policy]
 }
 
 
@@ -112,3 +181,66 @@ resource "aws_lambda_permission" "allow_s3_to_invoke_lambda" {
   principal     = "s3.amazonaws.com"
   source_arn    = aws_s3_bucket.data_lake.arn
 }
+
+
+# --- SQS batching queue (cohort mode) ---
+# Uploads wait here for up to one batching window, then reach the Lambda together
+# so a bulk upload becomes one cohort execution rather than hundreds of starts.
+resource "aws_sqs_queue" "upload_batch_dlq" {
+  name                      = "${var.project_name}-upload-batch-dlq-${var.environment}"
+  message_retention_seconds = 1209600
+
+  tags = {
+    Project = var.project_name
+  }
+}
+
+resource "aws_sqs_queue" "upload_batch_queue" {
+  name = "${var.project_name}-upload-batch-${var.environment}"
+
+  # AWS recommends at least six times the function timeout plus the batching window.
+  visibility_timeout_seconds = 6 * aws_lambda_function.geyser_sfn_trigger.timeout + var.trigger_batch_window_seconds
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.upload_batch_dlq.arn
+    maxReceiveCount     = 5
+  })
+
+  tags = {
+    Project = var.project_name
+  }
+}
+
+resource "aws_sqs_queue_policy" "upload_batch_queue_policy" {
+  queue_url = aws_sqs_queue.upload_batch_queue.id
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect    = "Allow",
+        Principal = { Service = "s3.amazonaws.com" },
+        Action    = "sqs:SendMessage",
+        Resource  = aws_sqs_queue.upload_batch_queue.arn,
+        Condition = { ArnEquals = { "aws:SourceArn" = aws_s3_bucket.data_lake.arn } }
+      }
+    ]
+  })
+}
+
+resource "aws_lambda_event_source_mapping" "upload_batch_trigger" {
+  count = var.trigger_batch_mode == "cohort" ? 1 : 0
+
+  event_source_arn                   = aws_sqs_queue.upload_batch_queue.arn
+  function_name                      = aws_lambda_function.geyser_sfn_trigger.arn
+  batch_size                         = var.trigger_batch_size
+  maximum_batching_window_in_seconds = var.trigger_batch_window_seconds
+
+  # Only messages for samples whose execution failed to start are redelivered.
+  function_response_types = ["ReportBatchItemFailures"]
+
+  # The lowest allowed concurrency keeps cohorts large and StartExecution calls unthrottled.
+  scaling_config {
+    maximum_concurrency = 2
+  }
+}
@@ -69,6 +69,69 @@ resource "aws_s3_bucket" "data_lake" {
   tags   = { Name = "${var.project_name}-DataLake" }
 }
 
+# Parts of multipart uploads that were never completed or aborted (e.g. a job killed
+# mid-stream) are billed until removed, so S3 cleans them up after a week.
+resource "aws_s3_bucket_lifecycle_configuration" "data_lake" {
+  bucket = aws_s3_bucket.data_lake.id
+
+  rule {
+    id     = "abort-incomplete-multipart-uploads"
+    status = "Enabled"
+    filter {}
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 7
+    }
+  }
+}
+
+# Shared reference cache. Fargate tasks have only ephemeral storage, so without
+# this every job would download the full reference and its indexes again; on EFS
+# each reference version is fetched once and reused by every later job.
+resource "aws_efs_file_system" "reference_cache" {
+  creation_token   = "${var.project_name}-reference-cache"
+  encrypted        = true
+  performance_mode = "generalPurpose"
+  throughput_mode  = "elastic"
+  tags             = { Name = "${var.project_name}-ReferenceCache" }
+}
+
+resource "aws_security_group" "reference_cache" {
+  name        = "${var.project_name}-reference-cache"
+  description = "NFS from Batch jobs to the reference cache file system"
+  vpc_id      = aws_vpc.main.id
+  ingress {
+    from_port       = 2049
+    to_port         = 2049
+    protocol        = "tcp"
+    security_groups = [aws_vpc.main.default_security_group_id]
+  }
+  tags = { Name = "${var.project_name}-reference-cache-sg" }
+}
+
+resource "aws_efs_mount_target" "reference_cache" {
+  file_system_id  = aws_efs_file_system.reference_cache.id
+  subnet_id       = aws_subnet.private.id
+  security_groups = [aws_security_group.reference_cache.id]
+}
+
+resource "aws_efs_access_point" "reference_cache" {
+  file_system_id = aws_efs_file_system.reference_cache.id
+  posix_user {
+    uid = 0
+    gid = 0
+  }
+  root_directory {
+    path = "/reference_cache"
+    creation_info {
+      owner_uid   = 0
+      owner_gid   = 0
+      permissions = "0755"
+    }
+  }
+  tags = { Name = "${var.project_name}-reference-cache-ap" }
+}
+
 resource "aws_ecr_repository" "geyser_app" {
   name         = "${var.project_name}-app"
   force_delete = true # Note: In production, consider removing this for safety.
@@ -111,11 +174,25 @@ resource "aws_iam_policy" "geyser_s3_access_policy" {
   name = "${var.project_name}S3AccessPolicy"
   policy = jsonencode({
     Version = "2012-10-17",
-    Statement = [{
-      Action   = ["s3:GetObject", "s3:PutObject", "s3:ListBucket"],
-      Effect   = "Allow",
-      Resource = [aws_s3_bucket.data_lake.arn, "${aws_s3_bucket.data_lake.arn}/*"]
-    }]
+    Statement = [
+      {
+        Action   = ["s3:GetObject", "s3:PutObject", "s3:ListBucket"],
+        Effect   = "Allow",
+        Resource = [aws_s3_bucket.data_lake.arn, "${aws_s3_bucket.data_lake.arn}/*"]
+      },
+      {
+        # Streamed uploads are multipart; a failed stage aborts its upload rather than leaving parts behind.
+        Action   = ["s3:AbortMultipartUpload", "s3:ListMultipartUploadParts"],
+        Effect   = "Allow",
+        Resource = ["${aws_s3_bucket.data_lake.arn}/*"]
+      },
+      {
+        # A re-aligned BAM must not keep an earlier run's .bai/.csi/.crai next to it.
+        Action   = ["s3:DeleteObject"],
+        Effect   = "Allow",
+        Resource = ["${aws_s3_bucket.data_lake.arn}/alignments/*"]
+      }
+    ]
   })
 }
 
@@ -171,11 +248,28 @@ resource "aws_batch_job_definition" "geyser_app_job_def" {
       { type = "VCPU", value = "2" },
       { type = "MEMORY", value = "4096" }
     ]
+    volumes = [{
+      name = "reference-cache"
+      efsVolumeConfiguration = {
+        fileSystemId      = aws_efs_file_system.reference_cache.id
+        transitEncryption = "ENABLED"
+        authorizationConfig = {
+          accessPointId = aws_efs_access_point.reference_cache.id
+          iam           = "ENABLED"
+        }
+      }
+    }]
+    mountPoints = [{ sourceVolume = "reference-cache", containerPath = "/mnt/reference_cache", readOnly = false }]
     environment = [
       { name = "BUCKET_NAME", value = aws_s3_bucket.data_lake.bucket },
-      { name = "APP_VERSION", value = var.image_version }
+      { name = "APP_VERSION", value = var.image_version },
+      { name = "QC_ENGINE", value = var.qc_engine },
+      { name = "QC_SAMPLE_MB", value = tostring(var.qc_sample_mb) },
+      { name = "REFERENCE_CACHE_DIR", value = "/mnt/reference_cache" },
+      { name = "REFERENCE_CACHE_MAX_GB", value = tostring(var.reference_cache_max_gb) }
     ]
   })
-  tags = { Name = "${var.project_name}-AppJobDef" }
+  tags       = { Name = "${var.project_name}-AppJobDef" }
+  depends_on = [aws_efs_mount_target.reference_cache]
 }
 
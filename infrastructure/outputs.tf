@@ -38,4 +38,13 @@ output "geyser_github_ecr_role_arn" {
 output "geyser_github_terraform_role_arn" {
   description = "The ARN of the IAM role for the Terraform CI/CD workflow."
   value       = aws_iam_role.geyser_github_terraform_role.arn
-}
\ No newline at end of file
+}
+output "geyser_cohort_state_machine_arn" {
+  description = "The ARN of the Step Functions state machine that runs a batch of samples as one cohort."
+  value       = aws_sfn_state_machine.geyser_cohort_state_machine.id
+}
+
+output "upload_batch_queue_url" {
+  description = "The URL of the SQS queue buffering raw_reads/ uploads in cohort trigger mode."
+  value       = aws_sqs_queue.upload_batch_queue.id
+}
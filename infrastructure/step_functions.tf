@@ -26,6 +26,7 @@ resource "aws_iam_policy" "geyser_sfn_execution_policy" {
       {
         Sid = "CloudWatchLogsPermissions", Effect = "Allow", Action = ["logs:CreateLogDelivery", "logs:GetLogDelivery", "logs:UpdateLogDelivery", "logs:DeleteLogDelivery", "logs:ListLogDeliveries", "logs:PutResourcePolicy", "logs:DescribeResourcePolicies", "logs:DescribeLogGroups"], Resource = "*"
       },
+      { Sid = "AlignPlanReadPermissions", Effect = "Allow", Action = "s3:GetObject", Resource = "${aws_s3_bucket.data_lake.arn}/alignments/chunks/*" },
       { Sid = "SNSPublishPermissions", Effect = "Allow", Action = "sns:Publish", Resource = aws_sns_topic.geyser_pipeline_status_topic.arn },
       { Sid = "EventsPermissions", Effect = "Allow", Action = ["events:PutRule", "events:DeleteRule", "events:PutTargets", "events:RemoveTargets"], Resource = "*" }
     ]
@@ -48,17 +49,34 @@ resource "aws_sfn_state_machine" "geyser_pipeline_state_machine" {
   role_arn = aws_iam_role.geyser_sfn_execution_role.arn
   definition = jsonencode({
     Comment = "Geyser Genomics Pipeline orchestrated by AWS Step Functions"
-    StartAt = "Prepare_Decompress_Command"
+    StartAt = "Load_Default_Resources"
     States = {
+      # Executions started without a routed resource profile (e.g. by hand) get the job definition's size.
+      Load_Default_Resources = {
+        Type       = "Pass",
+        Result     = { "resources" = { "vcpu" = "2", "memory" = "4096", "shards" = 1 }, "inline_qc" = var.inline_qc },
+        ResultPath = "$.defaults", Next = "Apply_Default_Resources"
+      },
+      Apply_Default_Resources = {
+        Type       = "Pass",
+        Parameters = { "merged.$" = "States.JsonMerge($.defaults, $, false)" },
+        OutputPath = "$.merged", Next = "Prepare_Decompress_Command"
+      },
       Prepare_Decompress_Command = {
         Type       = "Pass",
-        Parameters = { "JobName.$" = "States.Format('DecompressSRA-{}-{}', $.srr_id, $$.Execution.Name)", "ContainerOverrides" = { "Command.$" = "States.Array('python', 'tasks.py', 'decompress', $.srr_id)" } },
+        Parameters = { "JobName.$" = "States.Format('DecompressSRA-{}-{}', $.srr_id, $$.Execution.Name)", "ContainerOverrides" = { "Command.$" = "States.Array('python', 'tasks.py', 'decompress', $.srr_id, '--inline-qc', States.Format('{}', $.inline_qc))" } },
         ResultPath = "$.batch_params", Next = "Decompress_SRA"
       },
       Decompress_SRA = {
         Type       = "Task", Resource = "arn:aws:states:::batch:submitJob.sync",
         Parameters = { "JobName.$" = "$.batch_params.JobName", "JobDefinition" = aws_batch_job_definition.geyser_app_job_def.name, "JobQueue" = aws_batch_job_queue.geyser_queue.name, "ContainerOverrides.$" = "$.batch_params.ContainerOverrides", "Timeout" = { "AttemptDurationSeconds" = 3600 } },
-        ResultPath = "$.batch_output", Catch = [{ ErrorEquals = ["States.ALL"], Next = "Notify_Failure", ResultPath = "$.error" }], Next = "Prepare_QC_Command"
+        ResultPath = "$.batch_output", Catch = [{ ErrorEquals = ["States.ALL"], Next = "Notify_Failure", ResultPath = "$.error" }], Next = "Choose_QC_Mode"
+      },
+      # With inline QC the decompress job already published the QC report, so the QC job is skipped.
+      Choose_QC_Mode = {
+        Type    = "Choice",
+        Choices = [{ Variable = "$.inline_qc", BooleanEquals = true, Next = "Prepare_Align_Plan_Command" }],
+        Default = "Prepare_QC_Command"
       },
       Prepare_QC_Command = {
         Type       = "Pass",
@@ -68,11 +86,54 @@ resource "aws_sfn_state_machine" "geyser_pipeline_state_machine" {
       Quality_Control = {
         Type       = "Task", Resource = "arn:aws:states:::batch:submitJob.sync",
         Parameters = { "JobName.$" = "$.batch_params.JobName", "JobDefinition" = aws_batch_job_definition.geyser_app_job_def.name, "JobQueue" = aws_batch_job_queue.geyser_queue.name, "ContainerOverrides.$" = "$.batch_params.ContainerOverrides", "Timeout" = { "AttemptDurationSeconds" = 1800 } },
-        ResultPath = "$.batch_output", Catch = [{ ErrorEquals = ["States.ALL"], Next = "Notify_Failure", ResultPath = "$.error" }], Next = "Prepare_Align_Command"
+        ResultPath = "$.batch_output", Catch = [{ ErrorEquals = ["States.ALL"], Next = "Notify_Failure", ResultPath = "$.error" }], Next = "Prepare_Align_Plan_Command"
+      },
+      Prepare_Align_Plan_Command = {
+        Type       = "Pass",
+        Parameters = { "JobName.$" = "States.Format('PlanAlign-{}-{}', $.srr_id, $$.Execution.Name)", "ContainerOverrides" = { "Command.$" = "States.Array('python', 'tasks.py', 'align_plan', $.srr_id, $.reference_name)" } },
+        ResultPath = "$.batch_params", Next = "Plan_Align"
+      },
+      Plan_Align = {
+        Type       = "Task", Resource = "arn:aws:states:::batch:submitJob.sync",
+        Parameters = { "JobName.$" = "$.batch_params.JobName", "JobDefinition" = aws_batch_job_definition.geyser_app_job_def.name, "JobQueue" = aws_batch_job_queue.geyser_queue.name, "ContainerOverrides.$" = "$.batch_params.ContainerOverrides", "Timeout" = { "AttemptDurationSeconds" = 600 } },
+        ResultPath = "$.batch_output", Catch = [{ ErrorEquals = ["States.ALL"], Next = "Notify_Failure", ResultPath = "$.error" }], Next = "Read_Align_Plan"
+      },
+      # The plan's shard count (chosen from the FASTQ size) sizes the alignment array job.
+      Read_Align_Plan = {
+        Type       = "Task", Resource = "arn:aws:states:::aws-sdk:s3:getObject",
+        Parameters = { "Bucket" = aws_s3_bucket.data_lake.bucket, "Key.$" = "States.Format('alignments/chunks/{}/plan.json', $.srr_id)" },
+        ResultSelector = { "plan.$" = "States.StringToJson($.Body)" },
+        ResultPath = "$.align_plan", Catch = [{ ErrorEquals = ["States.ALL"], Next = "Notify_Failure", ResultPath = "$.error" }], Next = "Choose_Align_Mode"
+      },
+      # Batch array jobs need at least 2 children, so single-shard samples take the plain path.
+      Choose_Align_Mode = {
+        Type    = "Choice",
+        Choices = [{ Variable = "$.align_plan.plan.shards", NumericGreaterThan = 1, Next = "Prepare_Align_Array_Command" }],
+        Default = "Prepare_Align_Command"
+      },
+      Prepare_Align_Array_Command = {
+        Type       = "Pass",
+        Parameters = { "JobName.$" = "States.Format('AlignGenomeArray-{}-{}', $.srr_id, $$.Execution.Name)", "ContainerOverrides" = { "Command.$" = "States.Array('python', 'tasks.py', 'align', $.srr_id, $.reference_name)", "ResourceRequirements" = [{ "Type" = "VCPU", "Value.$" = "$.resources.vcpu" }, { "Type" = "MEMORY", "Value.$" = "$.resources.memory" }] } },
+        ResultPath = "$.batch_params", Next = "Align_Genome_Array"
+      },
+      Align_Genome_Array = {
+        Type       = "Task", Resource = "arn:aws:states:::batch:submitJob.sync",
+        Parameters = { "JobName.$" = "$.batch_params.JobName", "JobDefinition" = aws_batch_job_definition.geyser_app_job_def.name, "JobQueue" = aws_batch_job_queue.geyser_queue.name, "ContainerOverrides.$" = "$.batch_params.ContainerOverrides", "ArrayProperties" = { "Size.$" = "$.align_plan.plan.shards" }, "Timeout" = { "AttemptDurationSeconds" = 14400 } },
+        ResultPath = "$.batch_output", Catch = [{ ErrorEquals = ["States.ALL"], Next = "Notify_Failure", ResultPath = "$.error" }], Next = "Prepare_Merge_Command"
+      },
+      Prepare_Merge_Command = {
+        Type       = "Pass",
+        Parameters = { "JobName.$" = "States.Format('MergeAlignments-{}-{}', $.srr_id, $$.Execution.Name)", "ContainerOverrides" = { "Command.$" = "States.Array('python', 'tasks.py', 'align_merge', $.srr_id, $.reference_name)", "ResourceRequirements" = [{ "Type" = "VCPU", "Value.$" = "$.resources.vcpu" }, { "Type" = "MEMORY", "Value.$" = "$.resources.memory" }] } },
+        ResultPath = "$.batch_params", Next = "Merge_Alignments"
+      },
+      Merge_Alignments = {
+        Type       = "Task", Resource = "arn:aws:states:::batch:submitJob.sync",
+        Parameters = { "JobName.$" = "$.batch_params.JobName", "JobDefinition" = aws_batch_job_definition.geyser_app_job_def.name, "JobQueue" = aws_batch_job_queue.geyser_queue.name, "ContainerOverrides.$" = "$.batch_params.ContainerOverrides", "Timeout" = { "AttemptDurationSeconds" = 3600 } },
+        ResultPath = "$.batch_output", Catch = [{ ErrorEquals = ["States.ALL"], Next = "Notify_Failure", ResultPath = "$.error" }], Next = "Prepare_Variants_Command"
       },
       Prepare_Align_Command = {
         Type       = "Pass",
-        Parameters = { "JobName.$" = "States.Format('AlignGenome-{}-{}', $.srr_id, $$.Execution.Name)", "ContainerOverrides" = { "Command.$" = "States.Array('python', 'tasks.py', 'align', $.srr_id, $.reference_name)" } },
+        Parameters = { "JobName.$" = "States.Format('AlignGenome-{}-{}', $.srr_id, $$.Execution.Name)", "ContainerOverrides" = { "Command.$" = "States.Array('python', 'tasks.py', 'align', $.srr_id, $.reference_name)", "ResourceRequirements" = [{ "Type" = "VCPU", "Value.$" = "$.resources.vcpu" }, { "Type" = "MEMORY", "Value.$" = "$.resources.memory" }] } },
         ResultPath = "$.batch_params", Next = "Align_Genome"
       },
       Align_Genome = {
@@ -82,7 +143,7 @@ resource "aws_sfn_state_machine" "geyser_pipeline_state_machine" {
       },
       Prepare_Variants_Command = {
         Type       = "Pass",
-        Parameters = { "JobName.$" = "States.Format('CallVariants-{}-{}', $.srr_id, $$.Execution.Name)", "ContainerOverrides" = { "Command.$" = "States.Array('python', 'tasks.py', 'variants', $.srr_id, $.reference_name)" } },
+        Parameters = { "JobName.$" = "States.Format('CallVariants-{}-{}', $.srr_id, $$.Execution.Name)", "ContainerOverrides" = { "Command.$" = "States.Array('python', 'tasks.py', 'variants', $.srr_id, $.reference_name, '--shards', States.Format('{}', $.resources.shards))", "ResourceRequirements" = [{ "Type" = "VCPU", "Value.$" = "$.resources.vcpu" }, { "Type" = "MEMORY", "Value.$" = "$.resources.memory" }] } },
         ResultPath = "$.batch_params", Next = "Call_Variants"
       },
       Call_Variants = {
@@ -105,3 +166,99 @@ resource "aws_sfn_state_machine" "geyser_pipeline_state_machine" {
   tags       = { Name = "${var.project_name}-pipeline-sfn", Environment = var.environment, ManagedBy = "Terraform" }
   depends_on = [aws_iam_role_policy_attachment.step_functions_policy_attach, ]
 }
+
+
+# --- Cohort state machine ---
+# Started by the trigger Lambda in cohort mode: runs the per-sample pipeline for
+# every sample in a batch (bounded by cohort_max_concurrency), then joint-calls them.
+resource "aws_iam_role" "geyser_cohort_sfn_execution_role" {
+  name = "${var.project_name}-cohort-sfn-execution-role-${var.environment}"
+  assume_role_policy = jsonencode({
+    Version   = "2012-10-17",
+    Statement = [{ Action = "sts:AssumeRole", Effect = "Allow", Principal = { Service = "states.amazonaws.com" } }]
+  })
+  tags = { Name = "${var.project_name}-cohort-sfn-execution-role", Environment = var.environment, ManagedBy = "Terraform" }
+}
+
+resource "aws_iam_policy" "geyser_cohort_sfn_execution_policy" {
+  name        = "${var.project_name}-cohort-sfn-execution-policy-${var.environment}"
+  description = "IAM policy for the cohort state machine to run per-sample pipeline executions and the joint-calling Batch job."
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      { Sid = "StartPipelinePermissions", Effect = "Allow", Action = "states:StartExecution", Resource = aws_sfn_state_machine.geyser_pipeline_state_machine.id },
+      {
+        Sid = "TrackPipelinePermissions", Effect = "Allow", Action = ["states:DescribeExecution", "states:StopExecution"],
+        Resource = "arn:aws:states:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:execution:${aws_sfn_state_machine.geyser_pipeline_state_machine.name}:*"
+      },
+      {
+        Sid = "AWSBatchPermissions", Effect = "Allow", Action = ["batch:SubmitJob", "batch:DescribeJobs", "batch:TerminateJob"],
+        Resource = [
+          aws_batch_job_queue.geyser_queue.arn,
+          "arn:aws:batch:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:job-definition/${aws_batch_job_definition.geyser_app_job_def.name}",
+          "arn:aws:batch:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:job-definition/${aws_batch_job_definition.geyser_app_job_def.name}:*"
+        ]
+      },
+      {
+        Sid = "CloudWatchLogsPermissions", Effect = "Allow", Action = ["logs:CreateLogDelivery", "logs:GetLogDelivery", "logs:UpdateLogDelivery", "logs:DeleteLogDelivery", "logs:ListLogDeliveries", "logs:PutResourcePolicy", "logs:DescribeResourcePolicies", "logs:DescribeLogGroups"], Resource = "*"
+      },
+      { Sid = "SNSPublishPermissions", Effect = "Allow", Action = "sns:Publish", Resource = aws_sns_topic.geyser_pipeline_status_topic.arn },
+      { Sid = "EventsPermissions", Effect = "Allow", Action = ["events:PutRule", "events:DeleteRule", "events:PutTargets", "events:RemoveTargets", "events:DescribeRule"], Resource = "*" }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "cohort_step_functions_policy_attach" {
+  role       = aws_iam_role.geyser_cohort_sfn_execution_role.name
+  policy_arn = aws_iam_policy.geyser_cohort_sfn_execution_policy.arn
+}
+
+resource "aws_sfn_state_machine" "geyser_cohort_state_machine" {
+  name     = "${var.project_name}-cohort-sfn-${var.environment}"
+  role_arn = aws_iam_role.geyser_cohort_sfn_execution_role.arn
+  definition = jsonencode({
+    Comment = "Geyser Genomics cohort: per-sample pipelines followed by joint variant calling"
+    StartAt = "Run_Sample_Pipelines"
+    States = {
+      Run_Sample_Pipelines = {
+        Type           = "Map",
+        ItemsPath      = "$.samples",
+        MaxConcurrency = var.cohort_max_concurrency,
+        Iterator = {
+          StartAt = "Run_Sample_Pipeline"
+          States = {
+            Run_Sample_Pipeline = {
+              Type       = "Task", Resource = "arn:aws:states:::states:startExecution.sync:2",
+              Parameters = { "StateMachineArn" = aws_sfn_state_machine.geyser_pipeline_state_machine.id, "Input.$" = "$" },
+              Retry = [{ ErrorEquals = ["StepFunctions.ExecutionLimitExceededException", "StepFunctions.SdkClientException", "StepFunctions.AWSStepFunctionsException"], IntervalSeconds = 2, BackoffRate = 2.0, MaxAttempts = 6, JitterStrategy = "FULL" }],
+              End = true
+            }
+          }
+        },
+        ResultPath = null, Catch = [{ ErrorEquals = ["States.ALL"], Next = "Notify_Failure", ResultPath = "$.error" }], Next = "Prepare_Joint_Variants_Command"
+      },
+      Prepare_Joint_Variants_Command = {
+        Type       = "Pass",
+        Parameters = { "JobName.$" = "States.Format('JointCallVariants-{}-{}', $.cohort_id, $$.Execution.Name)", "ContainerOverrides" = { "Command.$" = "States.Array('python', 'tasks.py', 'variants', $.srr_ids, $.reference_name, '--joint', '--cohort-id', $.cohort_id)" } },
+        ResultPath = "$.batch_params", Next = "Joint_Call_Variants"
+      },
+      Joint_Call_Variants = {
+        Type       = "Task", Resource = "arn:aws:states:::batch:submitJob.sync",
+        Parameters = { "JobName.$" = "$.batch_params.JobName", "JobDefinition" = aws_batch_job_definition.geyser_app_job_def.name, "JobQueue" = aws_batch_job_queue.geyser_queue.name, "ContainerOverrides.$" = "$.batch_params.ContainerOverrides", "Timeout" = { "AttemptDurationSeconds" = 14400 } },
+        ResultPath = "$.batch_output", Catch = [{ ErrorEquals = ["States.ALL"], Next = "Notify_Failure", ResultPath = "$.error" }], End = true
+      },
+      Notify_Failure = {
+        Type       = "Task", Resource = "arn:aws:states:::sns:publish",
+        Parameters = { "TopicArn" = aws_sns_topic.geyser_pipeline_status_topic.arn, "Message" = { "PipelineName" = "Geyser Genomics Cohort", "ExecutionId" = "$$.Execution.Id", "Status" = "FAILED", "ErrorDetails.$" = "$.error", "Input.$" = "$$", "StartTime" = "$$.Execution.StartTime" }, "MessageAttributes" = { "Status" = { "DataType" = "String", "StringValue" = "FAILED" }, "Pipeline" = { "DataType" = "String", "StringValue" = "Geyser Genomics" } } },
+        ResultPath = null, End = true
+      }
+    }
+  })
+  logging_configuration {
+    log_destination        = "${aws_cloudwatch_log_group.geyser_sfn_log_group.arn}:*"
+    include_execution_data = true
+    level                  = "ALL"
+  }
+  tags       = { Name = "${var.project_name}-cohort-sfn", Environment = var.environment, ManagedBy = "Terraform" }
+  depends_on = [aws_iam_role_policy_attachment.cohort_step_functions_policy_attach, ]
+}
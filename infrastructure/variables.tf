@@ -16,4 +16,74 @@ variable "image_version" {
   description = "A unique identifier for the application version, e.g., a git commit SHA."
   type        = string
   default     = "latest" # A sensible default for local runs
-}
\ No newline at end of file
+}
+
+variable "trigger_batch_mode" {
+  description = "How S3 uploads start pipelines: 'single' invokes the trigger Lambda per upload; 'cohort' buffers uploads in SQS and starts one cohort execution per batching window."
+  type        = string
+  default     = "single"
+
+  validation {
+    condition     = contains(["single", "cohort"], var.trigger_batch_mode)
+    error_message = "trigger_batch_mode must be 'single' or 'cohort'."
+  }
+}
+
+variable "trigger_batch_window_seconds" {
+  description = "Cohort mode: how long SQS gathers uploads before invoking the trigger Lambda (max 300)."
+  type        = number
+  default     = 120
+}
+
+variable "trigger_batch_size" {
+  description = "Cohort mode: maximum number of upload notifications delivered to one Lambda invocation."
+  type        = number
+  default     = 100
+}
+
+variable "cohort_max_concurrency" {
+  description = "Maximum number of per-sample pipeline executions a cohort execution runs at once."
+  type        = number
+  default     = 10
+}
+
+variable "reference_routing_key" {
+  description = "S3 key (in the data lake bucket) of the JSON table routing uploads to a reference genome and resource profile."
+  type        = string
+  default     = "config/reference_routing.json"
+}
+
+variable "default_reference_genome" {
+  description = "Reference genome used when the routing table is absent or no route matches a sample."
+  type        = string
+  default     = "chr20.fa"
+}
+
+variable "qc_engine" {
+  description = "QC engine for the QualityControl stage: fastqc (full HTML/ZIP report) or native (streaming NumPy statistics, JSON report)."
+  type        = string
+  default     = "fastqc"
+
+  validation {
+    condition     = contains(["fastqc", "native"], var.qc_engine)
+    error_message = "qc_engine must be 'fastqc' or 'native'."
+  }
+}
+
+variable "qc_sample_mb" {
+  description = "For the native QC engine, read only about this many MB spread across each FASTQ (0 reads every byte)."
+  type        = number
+  default     = 0
+}
+
+variable "inline_qc" {
+  description = "Compute the native QC report inside the decompress job and skip the separate QualityControl job. Executions can override it with an 'inline_qc' input field."
+  type        = bool
+  default     = false
+}
+
+variable "reference_cache_max_gb" {
+  description = "Size cap of the shared EFS reference cache; least recently used reference versions are evicted above it."
+  type        = number
+  default     = 50
+}
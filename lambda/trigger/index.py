@@ -1,11 +1,17 @@
 # lambda/trigger/index.py
 
+import hashlib
 import json
 import logging
 import os
+import random
+import re
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+from botocore.exceptions import ClientError
 
 # Configure logging
 logger = logging.getLogger()
@@ -13,38 +19,232 @@ logger.setLevel(logging.INFO)
 
 # Initialize AWS clients
 sfn_client = boto3.client("stepfunctions")
+s3_client = boto3.client("s3")
 
 # Fetch environment variables
 STATE_MACHINE_ARN = os.environ.get("STATE_MACHINE_ARN")
 if not STATE_MACHINE_ARN:
     raise ValueError("STATE_MACHINE_ARN environment variable not set.")
 
-# This can be configured as an env var as well for more flexibility
-DEFAULT_REFERENCE_GENOME = "chr20.fa"
+# "single" starts one pipeline execution per sample. "cohort" (used with the
+# SQS-buffered event source, which delivers a time window of uploads at once)
+# starts one cohort execution covering every sample in the batch.
+BATCH_MODE = os.environ.get("BATCH_MODE", "single").lower()
+COHORT_STATE_MACHINE_ARN = os.environ.get("COHORT_STATE_MACHINE_ARN")
+if BATCH_MODE == "cohort" and not COHORT_STATE_MACHINE_ARN:
+    raise ValueError("COHORT_STATE_MACHINE_ARN environment variable must be set when BATCH_MODE is 'cohort'.")
 
+# Caps concurrent StartExecution calls so a bulk upload does not trip the API's throttling.
+MAX_START_CONCURRENCY = int(os.environ.get("MAX_START_CONCURRENCY", "5"))
+START_MAX_ATTEMPTS = int(os.environ.get("START_MAX_ATTEMPTS", "8"))
+THROTTLING_ERRORS = {"ThrottlingException", "TooManyRequestsException", "RequestLimitExceeded"}
 
-def handler(event, context):
+# Fallback reference when no routing table is configured or nothing matches.
+DEFAULT_REFERENCE_GENOME = os.environ.get("DEFAULT_REFERENCE_GENOME", "chr20.fa")
+
+# Reference routing table (JSON) in the upload bucket, e.g. config/reference_routing.json:
+#   {
+#     "default":  {"reference_name": "chr20.fa", "profile": "standard"},
+#     "profiles": {"standard": {"vcpu": 2, "memory": 4096, "shards": 1},
+#                  "wgs":      {"vcpu": 8, "memory": 32768, "shards": 64}},
+#     "routes":   [{"prefix": "raw_reads/wgs/", "reference_name": "GRCh38.fa", "profile": "wgs"},
+#                  {"tags": {"organism": "mouse"}, "reference_name": "GRCm39.fa"}]
+#   }
+# Per-sample overrides, highest precedence first: a sidecar `<sample>.metadata.json`
+# next to the upload, then `reference_name` / `resource_profile` object tags, then
+# the first matching route, then the default.
+ROUTING_TABLE_KEY = os.environ.get("ROUTING_TABLE_KEY")
+ROUTING_CACHE_SECONDS = int(os.environ.get("ROUTING_CACHE_SECONDS", "300"))
+DEFAULT_RESOURCE_PROFILE = {"vcpu": 2, "memory": 4096, "shards": 1}
+
+# Paired-end uploads arrive as `<sample>_1.fastq.gz` and `<sample>_2.fastq.gz`.
+MATE_PATTERN = re.compile(r"^(?P<sample>.+)_(?P<mate>[12])$")
+EXPECTED_MATES = ("1", "2")
+PAIRING_TABLE = os.environ.get("PAIRING_TABLE")
+PAIRING_TTL_SECONDS = int(os.environ.get("PAIRING_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+class DynamoPairingIndex:
     """
-    Lambda handler triggered by an S3 object creation event.
+    Records which mates of a paired-end sample have arrived, one DynamoDB item
+    per sample (`sample_id` hash key, one `mate_<n>` attribute per mate).
+    Items expire via the table's TTL on `expires_at`.
+    """
+
+    def __init__(self, table_name):
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def record_mate(self, sample_id, mate, object_key, etag):
+        """Stores one mate and returns every mate seen so far as {mate: {"key", "etag"}}."""
+        response = self.table.update_item(
+            Key={"sample_id": sample_id},
+            UpdateExpression="SET #mate = :mate, expires_at = :expires_at",
+            ExpressionAttributeNames={"#mate": f"mate_{mate}"},
+            ExpressionAttributeValues={
+                ":mate": {"key": object_key, "etag": etag},
+                ":expires_at": int(time.time()) + PAIRING_TTL_SECONDS,
+            },
+            ReturnValues="ALL_NEW",
+        )
+        item = response["Attributes"]
+        return {name[len("mate_"):]: value for name, value in item.items() if name.startswith("mate_")}
+
 
-    This function parses the S3 event to extract the sample ID (srr_id),
-    constructs the specific input payload required by the TerraFlow Step Function,
-    and starts a new execution.
+class LocalPairingIndex:
+    """In-memory stand-in for DynamoPairingIndex, for tests and local runs (state lives only as long as the container)."""
+
+    def __init__(self):
+        self.items = {}
+
+    def record_mate(self, sample_id, mate, object_key, etag):
+        mates = self.items.setdefault(sample_id, {})
+        mates[mate] = {"key": object_key, "etag": etag}
+        return dict(mates)
+
+
+if PAIRING_TABLE:
+    pairing_index = DynamoPairingIndex(PAIRING_TABLE)
+else:
+    logger.warning("PAIRING_TABLE not set; pairing paired-end mates in memory only.")
+    pairing_index = LocalPairingIndex()
+
+
+# Module-level, so the table survives across warm invocations of the same container.
+_routing_cache = {"table": None, "etag": None, "checked_at": 0.0}
+
+
+def _is_absent(error):
     """
-    logger.info("## EVENT RECEIVED")
-    logger.info(json.dumps(event))
+    True if a GET failed because the object does not exist. The trigger role
+    has s3:ListBucket on these keys, so a missing one is a 404; AccessDenied is
+    a real permission or KMS failure and must not be mistaken for "no object".
+    """
+    return error.response["Error"]["Code"] in ("NoSuchKey", "NotFound", "404")
+
+
+def load_routing_table(bucket_name):
+    """
+    Returns the routing table, re-checking S3 at most every ROUTING_CACHE_SECONDS
+    (a conditional GET, so an unchanged table costs no transfer).
+    """
+    if not ROUTING_TABLE_KEY:
+        return {}
+    if _routing_cache["table"] is not None and time.time() - _routing_cache["checked_at"] < ROUTING_CACHE_SECONDS:
+        return _routing_cache["table"]
+    kwargs = {"Bucket": bucket_name, "Key": ROUTING_TABLE_KEY}
+    if _routing_cache["etag"]:
+        kwargs["IfNoneMatch"] = _routing_cache["etag"]
+    try:
+        response = s3_client.get_object(**kwargs)
+        _routing_cache["table"] = json.loads(response["Body"].read())
+        _routing_cache["etag"] = response["ETag"]
+        logger.info(f"Loaded reference routing table s3://{bucket_name}/{ROUTING_TABLE_KEY}")
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("304", "NotModified"):
+            pass
+        elif _is_absent(e):
+            logger.warning(f"No routing table at s3://{bucket_name}/{ROUTING_TABLE_KEY}; "
+                           f"routing every sample to '{DEFAULT_REFERENCE_GENOME}'.")
+            _routing_cache.update(table={}, etag=None)
+        else:
+            raise
+    _routing_cache["checked_at"] = time.time()
+    return _routing_cache["table"]
+
 
+def _read_sidecar(bucket_name, object_key, srr_id):
+    """Returns the sample's `<sample>.metadata.json` next to the upload, or {} if there is none."""
+    prefix = os.path.dirname(object_key)
+    sidecar_key = f"{prefix}/{srr_id}.metadata.json" if prefix else f"{srr_id}.metadata.json"
     try:
-        s3_record = event["Records"][0]["s3"]
-        bucket_name = s3_record["bucket"]["name"]
-        object_key = urllib.parse.unquote_plus(s3_record["object"]["key"], encoding='utf-8')
-    except (KeyError, IndexError) as e:
-        logger.error(f"Failed to parse S3 event record: {e}")
-        raise RuntimeError("Could not parse S3 event.") from e
+        return json.loads(s3_client.get_object(Bucket=bucket_name, Key=sidecar_key)["Body"].read())
+    except ClientError as e:
+        if not _is_absent(e):
+            raise
+        return {}
+
+
+def resolve_route(bucket_name, object_key, srr_id):
+    """
+    Picks the reference genome and resource profile for a sample. Returns
+    {"reference_name": ..., "resources": {"vcpu": str, "memory": str, "shards": int}};
+    vCPU and memory are strings because Batch ResourceRequirements take strings.
+    """
+    table = load_routing_table(bucket_name)
+    default = table.get("default", {})
+    sidecar = _read_sidecar(bucket_name, object_key, srr_id)
+    tag_set = s3_client.get_object_tagging(Bucket=bucket_name, Key=object_key)["TagSet"]
+    tags = {tag["Key"]: tag["Value"] for tag in tag_set}
+
+    route = {}
+    for candidate in table.get("routes", []):
+        if not object_key.startswith(candidate.get("prefix", "")):
+            continue
+        if any(tags.get(key) != value for key, value in candidate.get("tags", {}).items()):
+            continue
+        route = candidate
+        break
+
+    def pick(field, tag_name):
+        for source in (sidecar.get(field), tags.get(tag_name), route.get(field), default.get(field)):
+            if source:
+                return source
+        return None
+
+    reference_name = pick("reference_name", "reference_name") or DEFAULT_REFERENCE_GENOME
+    profile_name = pick("profile", "resource_profile") or "standard"
+    profiles = table.get("profiles", {})
+    if profile_name not in profiles and profile_name != "standard":
+        raise ValueError(f"Sample '{srr_id}' routed to unknown resource profile '{profile_name}'.")
+    resources = {**DEFAULT_RESOURCE_PROFILE, **profiles.get(profile_name, {}), **sidecar.get("resources", {})}
+    logger.info(f"Routing '{srr_id}' to reference '{reference_name}' with profile '{profile_name}': {resources}")
+    return {
+        "reference_name": reference_name,
+        "resources": {"vcpu": str(resources["vcpu"]), "memory": str(resources["memory"]), "shards": int(resources["shards"])},
+    }
+
+
+def parse_s3_records(event):
+    """
+    Flattens an invocation into a list of (message_id, bucket, key, etag) tuples.
 
+    Accepts both direct S3 notifications and SQS messages wrapping them. For
+    SQS, message_id identifies the message so failures can be reported back
+    per message; for direct S3 events it is None.
+    """
+    parsed = []
+    for record in event.get("Records", []):
+        if record.get("eventSource") == "aws:sqs":
+            message_id = record["messageId"]
+            body = json.loads(record["body"])
+            if body.get("Event") == "s3:TestEvent":
+                logger.info("Ignoring S3 test event.")
+                continue
+            s3_records = body.get("Records", [])
+        else:
+            message_id = None
+            s3_records = [record]
+
+        for s3_record in s3_records:
+            try:
+                bucket_name = s3_record["s3"]["bucket"]["name"]
+                object_key = urllib.parse.unquote_plus(s3_record["s3"]["object"]["key"], encoding='utf-8')
+            except KeyError as e:
+                logger.error(f"Failed to parse S3 event record: {e}")
+                raise RuntimeError("Could not parse S3 event.") from e
+            s3_object = s3_record["s3"]["object"]
+            etag = (s3_object.get("eTag") or s3_object.get("sequencer") or "").strip('"')
+            parsed.append((message_id, bucket_name, object_key, etag))
+    return parsed
+
+
+def extract_srr_id(object_key):
+    """
+    Derives the sample ID and mate from an object key, e.g.
+    'raw_reads/small_test.fastq.gz' -> ('small_test', None) and
+    'raw_reads/SRR1_2.fastq.gz' -> ('SRR1', '2').
+    """
     # --- CRITICAL LOGIC: Extract srr_id from the object key ---
-    # Example object_key: 'raw_reads/small_test.fastq.gz'
-    # We want to extract 'small_test'
     try:
         filename = os.path.basename(object_key)
         # Split on the first dot to handle extensions like .fastq.gz
@@ -54,28 +254,181 @@ def handler(event, context):
     except Exception as e:
         logger.error(f"Could not parse srr_id from object key: '{object_key}'. Error: {e}")
         raise ValueError(f"Invalid filename format for parsing SRR ID.") from e
+    match = MATE_PATTERN.match(srr_id)
+    if match:
+        return match.group("sample"), match.group("mate")
+    return srr_id, None
 
-    logger.info(f"Triggering pipeline for srr_id: '{srr_id}' from file s3://{bucket_name}/{object_key}")
 
-    # --- CRITICAL LOGIC: Construct the exact input payload for Step Functions ---
-    pipeline_input = {
-        "srr_id": srr_id,
-        "reference_name": DEFAULT_REFERENCE_GENOME
-    }
+def execution_name(prefix, etags):
+    """
+    Deterministic execution name: the sample (or cohort) ID plus a digest of
+    the input objects' ETags. Re-uploading identical content reuses the name,
+    which Step Functions rejects (or returns the running execution for)
+    without starting any work.
+    """
+    digest = hashlib.sha1("|".join(etags).encode("utf-8")).hexdigest()[:16]
+    safe_prefix = re.sub(r"[^A-Za-z0-9_-]", "-", prefix)[:80 - len(digest) - 1]
+    return f"{safe_prefix}-{digest}"
+
 
+def start_execution_with_retry(state_machine_arn, pipeline_input, name=None):
+    """Starts an execution, backing off exponentially (with full jitter) while throttled."""
+    kwargs = {"stateMachineArn": state_machine_arn, "input": json.dumps(pipeline_input)}
+    if name:
+        kwargs["name"] = name
+    for attempt in range(START_MAX_ATTEMPTS):
+        try:
+            return sfn_client.start_execution(**kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in THROTTLING_ERRORS or attempt == START_MAX_ATTEMPTS - 1:
+                raise
+            delay = random.uniform(0, min(10.0, 0.2 * 2 ** attempt))
+            logger.warning(f"StartExecution throttled (attempt {attempt + 1}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def cohort_id_for(srr_ids):
+    """Deterministic cohort name for a set of samples; matches tasks.cohort_id_for."""
+    digest = hashlib.sha1(",".join(sorted(srr_ids)).encode("utf-8")).hexdigest()[:12]
+    return f"cohort-{digest}"
+
+
+def start_named_execution(state_machine_arn, pipeline_input, name):
+    """Starts an execution by deterministic name; an existing execution with that name counts as started."""
     try:
-        response = sfn_client.start_execution(
-            stateMachineArn=STATE_MACHINE_ARN,
-            input=json.dumps(pipeline_input)
-        )
-        logger.info(f"## Started Step Function execution: {response['executionArn']}")
+        return start_execution_with_retry(state_machine_arn, pipeline_input, name=name)["executionArn"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ExecutionAlreadyExists":
+            raise
+        logger.info(f"Execution '{name}' already exists; skipping duplicate upload.")
+        return f"{state_machine_arn.replace(':stateMachine:', ':execution:')}:{name}"
 
-        return {
-            "statusCode": 200,
-            "body": json.dumps({"executionArn": response["executionArn"]})
+
+def start_sample_executions(samples):
+    """Starts one pipeline execution per sample. Returns {srr_id: executionArn or exception}."""
+    def start(srr_id):
+        route = resolve_route(samples[srr_id]["bucket"], samples[srr_id]["keys"][0], srr_id)
+        # --- CRITICAL LOGIC: Construct the exact input payload for Step Functions ---
+        pipeline_input = {
+            "srr_id": srr_id,
+            "reference_name": route["reference_name"],
+            "resources": route["resources"]
         }
+        logger.info(f"Triggering pipeline for srr_id: '{srr_id}' from file(s) {', '.join(samples[srr_id]['keys'])}")
+        return start_named_execution(STATE_MACHINE_ARN, pipeline_input, execution_name(srr_id, samples[srr_id]["etags"]))
 
-    except Exception as e:
-        logger.error(f"Failed to start Step Function execution: {e}")
-        raise
+    results = {}
+    with ThreadPoolExecutor(max_workers=MAX_START_CONCURRENCY) as pool:
+        futures = {srr_id: pool.submit(start, srr_id) for srr_id in samples}
+        for srr_id, future in futures.items():
+            try:
+                results[srr_id] = future.result()
+                logger.info(f"## Started Step Function execution: {results[srr_id]}")
+            except Exception as e:
+                logger.error(f"Failed to start Step Function execution for '{srr_id}': {e}")
+                results[srr_id] = e
+    return results
 
+
+def start_cohort_executions(samples):
+    """
+    Starts one cohort execution per reference genome (joint calling needs a
+    shared reference). Returns {srr_id: executionArn or exception}.
+    """
+    results = {}
+    cohorts = {}
+    with ThreadPoolExecutor(max_workers=MAX_START_CONCURRENCY) as pool:
+        futures = {srr_id: pool.submit(resolve_route, sample["bucket"], sample["keys"][0], srr_id)
+                   for srr_id, sample in samples.items()}
+        for srr_id, future in futures.items():
+            try:
+                route = future.result()
+                cohorts.setdefault(route["reference_name"], {})[srr_id] = route
+            except Exception as e:
+                logger.error(f"Failed to route sample '{srr_id}': {e}")
+                results[srr_id] = e
+
+    for reference_name, routes in cohorts.items():
+        srr_ids = sorted(routes)
+        cohort_id = cohort_id_for(srr_ids)
+        cohort_input = {
+            "cohort_id": cohort_id,
+            "srr_ids": ",".join(srr_ids),
+            "reference_name": reference_name,
+            "samples": [{"srr_id": srr_id, **routes[srr_id]} for srr_id in srr_ids],
+        }
+        logger.info(f"Triggering cohort '{cohort_id}' on '{reference_name}' for {len(srr_ids)} samples: {', '.join(srr_ids)}")
+        try:
+            etags = [etag for srr_id in srr_ids for etag in samples[srr_id]["etags"]]
+            execution_arn = start_named_execution(COHORT_STATE_MACHINE_ARN, cohort_input, execution_name(cohort_id, etags))
+            logger.info(f"## Started cohort Step Function execution: {execution_arn}")
+        except Exception as e:
+            logger.error(f"Failed to start cohort Step Function execution: {e}")
+            execution_arn = e
+        results.update({srr_id: execution_arn for srr_id in srr_ids})
+    return results
+
+
+def handler(event, context):
+    """
+    Lambda handler triggered by S3 object creation events, delivered either
+    directly or through the SQS batching queue.
+
+    Every record in the invocation is processed and uploads are deduplicated
+    by sample ID (srr_id). Paired-end mates are held in the pairing index until
+    all have arrived. Each sample is routed to a reference genome and resource
+    profile, then either one TerraFlow Step Function execution is started per
+    sample or, in cohort mode, one execution per reference for the batch,
+    named deterministically so duplicate uploads never start a second run.
+    """
+    logger.info("## EVENT RECEIVED")
+    logger.info(json.dumps(event))
+
+    # (srr_id, mate) -> the latest object seen for it, plus every SQS message that mentioned it.
+    uploads = {}
+    for message_id, bucket_name, object_key, etag in parse_s3_records(event):
+        srr_id, mate = extract_srr_id(object_key)
+        upload = uploads.setdefault((srr_id, mate), {"message_ids": set()})
+        upload.update(bucket=bucket_name, key=object_key, etag=etag)
+        if message_id:
+            upload["message_ids"].add(message_id)
+
+    samples = {}
+    for (srr_id, mate), upload in uploads.items():
+        if mate is None:
+            keys, etags = [upload["key"]], [upload["etag"]]
+        else:
+            mates = pairing_index.record_mate(srr_id, mate, upload["key"], upload["etag"])
+            missing = [m for m in EXPECTED_MATES if m not in mates]
+            if missing:
+                logger.info(f"Sample '{srr_id}': mate {mate} arrived, waiting for mate(s) {', '.join(missing)}.")
+                continue
+            keys = [mates[m]["key"] for m in EXPECTED_MATES]
+            etags = [mates[m]["etag"] for m in EXPECTED_MATES]
+        sample = samples.setdefault(srr_id, {"bucket": upload["bucket"], "message_ids": set()})
+        sample.update(keys=keys, etags=etags)
+        sample["message_ids"] |= upload["message_ids"]
+
+    if not samples:
+        logger.info("No complete samples in event; nothing to start.")
+        return {"statusCode": 200, "body": json.dumps({"executions": {}}), "batchItemFailures": []}
+
+    if BATCH_MODE == "cohort" and len(samples) > 1:
+        results = start_cohort_executions(samples)
+    else:
+        results = start_sample_executions(samples)
+
+    failed = [srr_id for srr_id, result in results.items() if isinstance(result, Exception)]
+    from_sqs = any(sample["message_ids"] for sample in samples.values())
+    if failed and not from_sqs:
+        # Direct S3 invocations are retried as a whole by Lambda's async retry policy.
+        raise RuntimeError(f"Failed to start executions for: {', '.join(failed)}")
+
+    # With ReportBatchItemFailures, only the messages behind failed samples return to the queue.
+    failed_messages = sorted({message_id for srr_id in failed for message_id in samples[srr_id]["message_ids"]})
+    return {
+        "statusCode": 200 if not failed else 207,
+        "body": json.dumps({"executions": {srr_id: str(result) for srr_id, result in results.items()}}),
+        "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed_messages],
+    }
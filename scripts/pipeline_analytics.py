@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Vectorised analytics over pipeline execution records (NumPy).
+
+Used by query_pipeline_duration.py, importable on its own:
+
+- ExecutionFrame: columnar arrays built once from execution records
+- summary(): count/mean/min/max and p50/p90/p99 of durations
+- rolling(): the same per UTC day or ISO week
+- per_sample(): per-sample run counts and mean/p50 durations
+- version_regressions(): compares each APP_VERSION (image tag) cohort to the
+  one deployed before it and flags slowdowns
+- size_outliers(): flags runs far slower/faster than their input size predicts
+- throughput(): GB processed per hour and samples per vCPU-hour
+- write_report(): JSON, CSV (one file per table) or Parquet (needs pyarrow)
+"""
+
+import csv
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+SECONDS_PER_DAY = 86400
+# 1970-01-01 was a Thursday; shifting by 3 days puts week boundaries on Mondays (ISO weeks).
+EPOCH_WEEK_SHIFT_DAYS = 3
+
+
+class ExecutionFrame:
+    """
+    Column arrays for a set of execution records. Each record is a dict with
+    execution_name, sample_id, status, start (datetime), duration_seconds and,
+    when known, version, input_bytes and vcpu_seconds. Missing numbers are NaN;
+    a missing version is "unknown".
+    """
+
+    def __init__(self, records):
+        records = list(records)
+        self.size = len(records)
+        self.name = np.array([r["execution_name"] for r in records], dtype=object)
+        self.sample_id = np.array([r["sample_id"] for r in records], dtype=object)
+        self.status = np.array([r["status"] for r in records], dtype=object)
+        self.version = np.array([r.get("version") or "unknown" for r in records], dtype=object)
+        self.start = np.array([r["start"].timestamp() for r in records], dtype=np.float64)
+        self.duration = np.array([r["duration_seconds"] for r in records], dtype=np.float64)
+        self.input_bytes = np.array([_nan(r.get("input_bytes")) for r in records], dtype=np.float64)
+        self.vcpu_seconds = np.array([_nan(r.get("vcpu_seconds")) for r in records], dtype=np.float64)
+
+    def where(self, selection):
+        """A new frame holding only the rows selected by a boolean mask or an index array."""
+        subset = ExecutionFrame([])
+        for column in ("name", "sample_id", "status", "version", "start", "duration", "input_bytes", "vcpu_seconds"):
+            setattr(subset, column, getattr(self, column)[selection])
+        subset.size = len(subset.start)
+        return subset
+
+    def finished(self):
+        """Rows with a measured duration (SUCCEEDED or FAILED)."""
+        return self.where(np.isin(self.status, ["SUCCEEDED", "FAILED"]))
+
+
+def _nan(value):
+    return np.nan if value is None else value
+
+
+def _stats(values):
+    """count/mean/min/max/p50/p90/p99 of a 1-D array (NaNs ignored)."""
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return {"count": 0}
+    p = np.percentile(values, PERCENTILES)
+    stats = {"count": int(values.size), "mean": float(values.mean()), "min": float(values.min()), "max": float(values.max())}
+    stats.update({f"p{q}": float(v) for q, v in zip(PERCENTILES, p)})
+    return stats
+
+
+def summary(frame):
+    """Duration statistics over every finished execution."""
+    return _stats(frame.finished().duration)
+
+
+def _group(keys):
+    """(unique keys, inverse index) with keys in sorted order."""
+    return np.unique(keys, return_inverse=True)
+
+
+def per_sample(frame):
+    """One row per sample: runs, mean and p50 duration."""
+    finished = frame.finished()
+    if finished.size == 0:
+        return []
+    samples, inverse = _group(finished.sample_id.astype(str))
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(samples) + 1))
+    rows = []
+    for i, sample in enumerate(samples):
+        durations = finished.duration[order[bounds[i]:bounds[i + 1]]]
+        rows.append({"sample_id": str(sample), "runs": int(durations.size),
+                     "mean_seconds": float(durations.mean()), "p50_seconds": float(np.median(durations))})
+    return rows
+
+
+def rolling(frame, window="day"):
+    """
+    Duration statistics, run counts and throughput per UTC day or ISO week,
+    oldest first. Each row is labelled with the window's start date.
+    """
+    finished = frame.finished()
+    if finished.size == 0:
+        return []
+    days = np.floor(finished.start / SECONDS_PER_DAY).astype(np.int64)
+    if window == "week":
+        buckets = (days + EPOCH_WEEK_SHIFT_DAYS) // 7 * 7 - EPOCH_WEEK_SHIFT_DAYS
+    elif window == "day":
+        buckets = days
+    else:
+        raise ValueError(f"Unknown rolling window '{window}' (expected 'day' or 'week')")
+
+    keys, inverse = _group(buckets)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(keys) + 1))
+    rows = []
+    for i, key in enumerate(keys):
+        rows_in_window = order[bounds[i]:bounds[i + 1]]
+        row = {"window_start": datetime.fromtimestamp(int(key) * SECONDS_PER_DAY, timezone.utc).strftime("%Y-%m-%d"),
+               "succeeded": int(np.count_nonzero(finished.status[rows_in_window] == "SUCCEEDED")),
+               "failed": int(np.count_nonzero(finished.status[rows_in_window] == "FAILED"))}
+        row.update({f"{k}_seconds" if k != "count" else "runs": v
+                    for k, v in _stats(finished.duration[rows_in_window]).items()})
+        row.update(throughput(finished.where(rows_in_window)))
+        rows.append(row)
+    return rows
+
+
+def version_regressions(frame, threshold=0.10, min_runs=5):
+    """
+    Groups successful runs by version (image tag) in deployment order - the
+    first time each version was seen - and compares each cohort's p50 and p90
+    to the previous cohort's. When input sizes are known the comparison uses
+    seconds per GB so a batch of larger samples is not mistaken for a slowdown.
+    A cohort is flagged when p50 is more than `threshold` slower and both
+    cohorts have at least `min_runs` runs.
+    """
+    succeeded = frame.where(frame.status == "SUCCEEDED")
+    if succeeded.size == 0:
+        return []
+    gb = succeeded.input_bytes / 1e9
+    normalise = bool(np.all(~np.isnan(gb)) and np.all(gb > 0))
+    metric = succeeded.duration / gb if normalise else succeeded.duration
+    unit = "seconds_per_gb" if normalise else "seconds"
+
+    versions, inverse = _group(succeeded.version.astype(str))
+    first_seen = np.full(len(versions), np.inf)
+    np.minimum.at(first_seen, inverse, succeeded.start)
+    rows = []
+    previous = None
+    for v in np.argsort(first_seen):
+        values = metric[inverse == v]
+        p50, p90 = np.percentile(values, [50, 90])
+        row = {"version": str(versions[v]), "first_seen": datetime.fromtimestamp(first_seen[v], timezone.utc).isoformat(),
+               "runs": int(values.size), "unit": unit, "p50": float(p50), "p90": float(p90),
+               "p50_change": None, "p90_change": None, "regression": False}
+        if previous is not None:
+            row["p50_change"] = float(p50 / previous["p50"] - 1) if previous["p50"] else None
+            row["p90_change"] = float(p90 / previous["p90"] - 1) if previous["p90"] else None
+            row["regression"] = bool(
+                row["p50_change"] is not None and row["p50_change"] > threshold
+                and values.size >= min_runs and previous["runs"] >= min_runs
+            )
+        rows.append(row)
+        previous = row
+    return rows
+
+
+def size_outliers(frame, threshold=3.5):
+    """
+    Fits log(duration) against log(input size) over successful runs and flags
+    runs whose residual has a robust z-score (median/MAD) beyond `threshold`.
+    Positive z means slower than the input size predicts.
+    """
+    succeeded = frame.where((frame.status == "SUCCEEDED") & (frame.input_bytes > 0) & (frame.duration > 0))
+    if succeeded.size < 3:
+        return []
+    x = np.log(succeeded.input_bytes)
+    y = np.log(succeeded.duration)
+    if np.ptp(x) > 0:
+        slope, intercept = np.polyfit(x, y, 1)
+    else:
+        slope, intercept = 0.0, float(np.mean(y))
+    residuals = y - (slope * x + intercept)
+    mad = np.median(np.abs(residuals - np.median(residuals)))
+    if mad == 0:
+        return []
+    z = 0.6745 * (residuals - np.median(residuals)) / mad
+    flagged = np.flatnonzero(np.abs(z) > threshold)
+    expected = np.exp(slope * x + intercept)
+    return [
+        {"execution_name": str(succeeded.name[i]), "sample_id": str(succeeded.sample_id[i]),
+         "input_gb": float(succeeded.input_bytes[i] / 1e9), "duration_seconds": float(succeeded.duration[i]),
+         "expected_seconds": float(expected[i]), "robust_z": float(z[i])}
+        for i in flagged[np.argsort(-np.abs(z[flagged]))]
+    ]
+
+
+def throughput(frame):
+    """
+    GB of input processed per hour of execution time, and successful samples
+    per vCPU-hour. Each is None when the input sizes or vCPU usage are unknown.
+    """
+    succeeded = frame.where(frame.status == "SUCCEEDED")
+    hours = succeeded.duration.sum() / 3600.0
+    sized = ~np.isnan(succeeded.input_bytes)
+    metered = ~np.isnan(succeeded.vcpu_seconds)
+    gb_per_hour = None
+    if sized.any() and succeeded.duration[sized].sum() > 0:
+        gb_per_hour = float(succeeded.input_bytes[sized].sum() / 1e9 / (succeeded.duration[sized].sum() / 3600.0))
+    samples_per_vcpu_hour = None
+    if metered.any() and succeeded.vcpu_seconds[metered].sum() > 0:
+        samples_per_vcpu_hour = float(np.count_nonzero(metered) / (succeeded.vcpu_seconds[metered].sum() / 3600.0))
+    return {"execution_hours": float(hours), "gb_per_hour": gb_per_hour, "samples_per_vcpu_hour": samples_per_vcpu_hour}
+
+
+def analyse(frame, window="day", regression_threshold=0.10, outlier_threshold=3.5):
+    """Every analysis above, as one report dict of tables (lists of rows) and scalars."""
+    return {
+        "summary": summary(frame),
+        "throughput": throughput(frame),
+        "per_sample": per_sample(frame),
+        "rolling": rolling(frame, window),
+        "versions": version_regressions(frame, threshold=regression_threshold),
+        "size_outliers": size_outliers(frame, threshold=outlier_threshold),
+    }
+
+
+def write_report(report, path):
+    """
+    Writes an analyse() report by file extension:
+    - .json: the whole report
+    - .csv: one file per table, named <stem>.<table>.csv
+    - .parquet: one file per table, named <stem>.<table>.parquet (requires pyarrow)
+    Returns the paths written.
+    """
+    stem, extension = os.path.splitext(path)
+    extension = extension.lower()
+    if extension == ".json":
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        return [path]
+
+    tables = {name: rows if isinstance(rows, list) else [rows] for name, rows in report.items()}
+    written = []
+    if extension == ".csv":
+        for name, rows in tables.items():
+            if not rows:
+                continue
+            table_path = f"{stem}.{name}.csv"
+            with open(table_path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+            written.append(table_path)
+        return written
+    if extension == ".parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)") from e
+        for name, rows in tables.items():
+            if not rows:
+                continue
+            table_path = f"{stem}.{name}.parquet"
+            pq.write_table(pa.Table.from_pylist(rows), table_path)
+            written.append(table_path)
+        return written
+    raise ValueError(f"Unsupported report format '{extension}' (use .json, .csv or .parquet)")
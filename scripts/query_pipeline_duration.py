@@ -8,19 +8,41 @@ Query Step Functions executions and calculate total pipeline duration.
 - Smart unit formatting for Runtime (s/m/h)
 - Prints per-execution rows + overall and per-sample summaries
 - Optional CSV export (--csv filename)
-- Status filter (--status SUCCEEDED|FAILED|RUNNING|...)
+- Status filter (--status SUCCEEDED|FAILED|RUNNING|...|ALL)
+- Follows nextToken across the full history, bounded by --since/--until
+- Describes executions on a bounded thread pool (--workers) with throttling
+  backoff, printing rows as they arrive
+- Keeps a local SQLite cache (--cache); each run only syncs executions started
+  since the last sync plus any still RUNNING, then reports from the cache
+  (--offline skips the sync, --no-cache queries the API directly)
+- Optional per-stage breakdown (--stages) from execution history: Batch queue
+  wait vs. job runtime per state, p50/p90/p99 per stage, a critical-path view,
+  and CSV export (--stages-csv filename)
+- Summaries come from pipeline_analytics (NumPy); --analyze adds rolling
+  day/week windows, APP_VERSION cohort regressions, input-size outliers and
+  throughput, and --report writes them as JSON, CSV or Parquet
 """
 
 import os
+import re
 import json
 import csv
+import time
+import random
 import argparse
 import shutil
+import sqlite3
 from collections import defaultdict
-from statistics import mean, median
-from datetime import timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from statistics import median
+from datetime import datetime, timedelta, timezone
 
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import numpy as np
+
+import pipeline_analytics
 
 AWS_REGION = os.environ.get("AWS_REGION", "eu-west-2")
 STATE_MACHINE_ARN = os.environ.get("SFN_ARN")  # must be set in your env
@@ -29,18 +51,418 @@ if not STATE_MACHINE_ARN:
     print("FATAL: SFN_ARN environment variable is not set.")
     exit(1)
 
-sfn_client = boto3.client("stepfunctions", region_name=AWS_REGION)
+DEFAULT_WORKERS = 8
+# Execution ARNs bound per stage_timings lookup (SQLite allows 999 variables on older builds).
+STAGE_QUERY_BATCH = 500
+DEFAULT_CACHE_PATH = os.environ.get("EXECUTION_CACHE", os.path.expanduser("~/.cache/geyser/executions.sqlite"))
+MAX_ATTEMPTS = 8
+THROTTLING_ERRORS = {"ThrottlingException", "TooManyRequestsException", "RequestLimitExceeded"}
+
+# Enough pooled connections for every worker; retries are handled in call_with_retry.
+sfn_client = boto3.client(
+    "stepfunctions",
+    region_name=AWS_REGION,
+    config=Config(max_pool_connections=32, retries={"max_attempts": 1, "mode": "standard"}),
+)
+# Data lake bucket; when set, --analyze looks up raw input sizes for throughput and outliers.
+BUCKET_NAME = os.environ.get("BUCKET_NAME")
+s3_client = boto3.client("s3", region_name=AWS_REGION, config=Config(max_pool_connections=32))
 
 # ---------- helpers ----------
 
-def list_executions(state_machine_arn, status=None, max_results=50):
-    kwargs = {"stateMachineArn": state_machine_arn, "maxResults": max_results}
+def call_with_retry(operation, **kwargs):
+    """Calls an SFN API operation, backing off exponentially (full jitter) while throttled."""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return operation(**kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in THROTTLING_ERRORS or attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, min(20.0, 0.25 * 2 ** attempt)))
+
+def parse_time(value: str):
+    """Parses an ISO date/time (UTC assumed) or a relative age such as '90m', '12h', '7d', '2w'."""
+    if not value:
+        return None
+    match = re.fullmatch(r"(\d+)([mhdw])", value.strip())
+    if match:
+        unit = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}[match.group(2)]
+        return datetime.now(timezone.utc) - timedelta(**{unit: int(match.group(1))})
+    dt = datetime.fromisoformat(value)
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def list_executions(state_machine_arn, status=None, since=None, until=None, limit=None):
+    """
+    Yields executions newest-first, following nextToken across the whole
+    history. Stops as soon as a page reaches executions older than `since`.
+    """
+    kwargs = {"stateMachineArn": state_machine_arn, "maxResults": 1000}
     if status:
         kwargs["statusFilter"] = status
-    return sfn_client.list_executions(**kwargs).get("executions", [])
+    yielded = 0
+    while True:
+        page = call_with_retry(sfn_client.list_executions, **kwargs)
+        for exe in page.get("executions", []):
+            if since and exe["startDate"] < since:
+                return
+            if until and exe["startDate"] > until:
+                continue
+            yield exe
+            yielded += 1
+            if limit and yielded >= limit:
+                return
+        if not page.get("nextToken"):
+            return
+        kwargs["nextToken"] = page["nextToken"]
 
 def describe_execution(execution_arn):
-    return sfn_client.describe_execution(executionArn=execution_arn)
+    return call_with_retry(sfn_client.describe_execution, executionArn=execution_arn)
+
+def fan_out(executions, fetch, workers=DEFAULT_WORKERS):
+    """
+    Runs fetch(executionArn) on a thread pool, yielding (execution, result) as
+    each call completes. At most workers*4 calls are in flight, so listing and
+    fetching overlap and memory stays flat on long histories.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        for exe in executions:
+            in_flight[pool.submit(fetch, exe["executionArn"])] = exe
+            if len(in_flight) >= workers * 4:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future.result()
+        for future in list(in_flight):
+            yield in_flight.pop(future), future.result()
+
+def describe_executions(executions, workers=DEFAULT_WORKERS):
+    """Describes executions in parallel, yielding (execution, details) as they arrive."""
+    return fan_out(executions, describe_execution, workers)
+
+def get_execution_history(execution_arn):
+    """Returns every history event of an execution, following nextToken."""
+    kwargs = {"executionArn": execution_arn, "maxResults": 1000}
+    events = []
+    while True:
+        page = call_with_retry(sfn_client.get_execution_history, **kwargs)
+        events.extend(page.get("events", []))
+        if not page.get("nextToken"):
+            return events
+        kwargs["nextToken"] = page["nextToken"]
+
+# ---------- per-stage timings ----------
+
+def _batch_job_info(payload):
+    """
+    Queue wait, runtime, image tag and vCPUs from a Batch job description - the
+    result of a `batch:submitJob.sync` task, or the cause of its failure. Fields
+    that cannot be read are None.
+    """
+    info = {"queue_seconds": None, "run_seconds": None, "version": None, "vcpus": None}
+    try:
+        job = json.loads(payload or "")
+    except (ValueError, TypeError):
+        return info
+    if not isinstance(job, dict):
+        return info
+    if all(key in job for key in ("CreatedAt", "StartedAt", "StoppedAt")):
+        info["queue_seconds"] = (job["StartedAt"] - job["CreatedAt"]) / 1000.0
+        info["run_seconds"] = (job["StoppedAt"] - job["StartedAt"]) / 1000.0
+    container = job.get("Container") or {}
+    image = container.get("Image") or ""
+    if ":" in image.rsplit("/", 1)[-1]:
+        info["version"] = image.rsplit(":", 1)[-1]
+    requirements = {r.get("Type"): r.get("Value") for r in container.get("ResourceRequirements", [])}
+    vcpus = requirements.get("VCPU") or container.get("Vcpus")
+    info["vcpus"] = float(vcpus) if vcpus else None
+    return info
+
+def stage_timings(events):
+    """
+    Reconstructs per-Task-state timings from history events. Each task event is
+    traced back through previousEventId to the state it belongs to, so this
+    also holds for Map iterations running in parallel. Returns a list of
+    {stage, entered, exited, queue_seconds, run_seconds, total_seconds, version,
+    vcpus}; queue, run, version (image tag) and vcpus come from the Batch job
+    when the state ran one, otherwise queue/version/vcpus are None and run is
+    the whole state duration.
+    """
+    by_id = {event["id"]: event for event in events}
+    stages = {}  # TaskStateEntered event id -> timing
+
+    def owning_state(event):
+        while event and event["type"] != "TaskStateEntered":
+            event = by_id.get(event.get("previousEventId"))
+        return event
+
+    for event in events:
+        kind = event["type"]
+        if kind == "TaskStateEntered":
+            stages[event["id"]] = {"stage": event["stateEnteredEventDetails"]["name"], "entered": event["timestamp"],
+                                   "exited": None, "queue_seconds": None, "run_seconds": None,
+                                   "version": None, "vcpus": None}
+        elif kind in ("TaskSucceeded", "TaskFailed"):
+            state = owning_state(event)
+            if state and state["id"] in stages:
+                details = event.get("taskSucceededEventDetails") or event.get("taskFailedEventDetails") or {}
+                stages[state["id"]].update(_batch_job_info(details.get("output") or details.get("cause")))
+        elif kind == "TaskStateExited" or kind == "ExecutionFailed":
+            state = owning_state(by_id.get(event.get("previousEventId")))
+            if state and state["id"] in stages and stages[state["id"]]["exited"] is None:
+                stages[state["id"]]["exited"] = event["timestamp"]
+
+    timings = []
+    for timing in stages.values():
+        if timing["exited"] is None:
+            continue
+        timing["total_seconds"] = (timing["exited"] - timing["entered"]).total_seconds()
+        if timing["run_seconds"] is None:
+            timing["run_seconds"] = timing["total_seconds"]
+        timings.append(timing)
+    return timings
+
+def percentile(values, q):
+    """Linear-interpolated percentile (q in 0..100) of a non-empty list."""
+    return float(np.percentile(values, q))
+
+def print_stage_report(stage_rows, execution_starts):
+    """
+    Prints per-stage p50/p90/p99 of queue wait, job runtime and total state
+    time, then a critical-path view: stages in execution order with their
+    median offset from execution start and share of median wall time.
+    """
+    by_stage = defaultdict(list)
+    for row in stage_rows:
+        by_stage[row["stage"]].append(row)
+
+    def pcts(values):
+        if not values:
+            return f"{'---':>26}"
+        return " ".join(f"{smart_format(percentile(values, q)):>8}" for q in (50, 90, 99))
+
+    print(f"\nPer-Stage Durations ({len(execution_starts)} executions)  [p50 p90 p99]:")
+    print(f"  {'Stage':<28} {'N':>5}  {'Queue wait':<26}  {'Job runtime':<26}  {'State total':<26}")
+    order = sorted(by_stage, key=lambda stage: median(
+        (r["entered"] - execution_starts[r["execution_arn"]]).total_seconds() for r in by_stage[stage]))
+    for stage in order:
+        rows = by_stage[stage]
+        queue = [r["queue_seconds"] for r in rows if r["queue_seconds"] is not None]
+        print(f"  {trunc(stage, 28):<28} {len(rows):>5}  {pcts(queue)}  "
+              f"{pcts([r['run_seconds'] for r in rows])}  {pcts([r['total_seconds'] for r in rows])}")
+
+    # Critical path: the pipeline runs its Task states one after another, so the
+    # median start offset and duration of each stage lay out where wall time goes.
+    wall = defaultdict(float)
+    in_stages = defaultdict(float)
+    for row in stage_rows:
+        end = (row["exited"] - execution_starts[row["execution_arn"]]).total_seconds()
+        wall[row["execution_arn"]] = max(wall[row["execution_arn"]], end)
+        in_stages[row["execution_arn"]] += row["total_seconds"]
+    median_wall = median(wall.values())
+    bar_width = 40
+    print(f"\nCritical Path (median wall time {smart_format(median_wall)}):")
+    for stage in order:
+        rows = by_stage[stage]
+        offset = median((r["entered"] - execution_starts[r["execution_arn"]]).total_seconds() for r in rows)
+        queue = median(r["queue_seconds"] or 0.0 for r in rows)
+        total = median(r["total_seconds"] for r in rows)
+        share = total / median_wall if median_wall else 0.0
+        lead = int(bar_width * offset / median_wall) if median_wall else 0
+        queued = int(bar_width * queue / median_wall) if median_wall else 0
+        busy = max(1, int(bar_width * total / median_wall) - queued) if median_wall else 1
+        bar = (" " * lead + "." * queued + "#" * busy)[:bar_width]
+        print(f"  {trunc(stage, 28):<28} |{bar:<{bar_width}}| +{smart_format(offset):>8} {smart_format(total):>8} {share:6.1%}")
+    tracked = median(in_stages.values())
+    print(f"  {'(orchestration/other)':<28} {'':{bar_width + 2}} {'':>9} {smart_format(max(median_wall - tracked, 0.0)):>8}")
+    print("  legend: '.' Batch queue wait, '#' job runtime")
+
+def _input_size(sample_id):
+    """Bytes of a sample's raw upload: raw_reads/<id>.fastq.gz, or both paired-end mates."""
+    for keys in ([f"raw_reads/{sample_id}.fastq.gz"],
+                 [f"raw_reads/{sample_id}_1.fastq.gz", f"raw_reads/{sample_id}_2.fastq.gz"]):
+        try:
+            return sum(s3_client.head_object(Bucket=BUCKET_NAME, Key=key)["ContentLength"] for key in keys)
+        except ClientError:
+            continue
+    return None
+
+def fetch_input_sizes(sample_ids, workers=DEFAULT_WORKERS):
+    """{sample_id: bytes} for the samples whose raw upload still exists (needs BUCKET_NAME)."""
+    if not BUCKET_NAME or not sample_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sizes = dict(zip(sample_ids, pool.map(_input_size, sample_ids)))
+    return {sample_id: size for sample_id, size in sizes.items() if size is not None}
+
+# ---------- local execution cache ----------
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS executions (
+    execution_arn     TEXT PRIMARY KEY,
+    state_machine_arn TEXT NOT NULL,
+    name              TEXT NOT NULL,
+    status            TEXT NOT NULL,
+    start_date        REAL NOT NULL,
+    stop_date         REAL,
+    input             TEXT
+);
+CREATE INDEX IF NOT EXISTS executions_by_start ON executions (state_machine_arn, start_date);
+CREATE TABLE IF NOT EXISTS stage_timings (
+    execution_arn TEXT NOT NULL,
+    stage         TEXT NOT NULL,
+    entered       REAL NOT NULL,
+    exited        REAL NOT NULL,
+    queue_seconds REAL,
+    run_seconds   REAL NOT NULL,
+    version       TEXT,
+    vcpus         REAL
+);
+CREATE INDEX IF NOT EXISTS stage_timings_by_execution ON stage_timings (execution_arn);
+CREATE TABLE IF NOT EXISTS stage_sync (
+    execution_arn TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS input_sizes (
+    sample_id   TEXT PRIMARY KEY,
+    input_bytes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    state_machine_arn TEXT PRIMARY KEY,
+    newest_start_date REAL NOT NULL,
+    synced_at         REAL NOT NULL
+);
+"""
+
+def _epoch(dt):
+    return dt.timestamp() if dt else None
+
+def _datetime(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc) if epoch is not None else None
+
+class ExecutionCache:
+    """
+    SQLite store of described executions. Terminal executions never change, so
+    each is described once; a sync lists only executions started since the
+    newest one already cached and re-describes the ones last seen RUNNING.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(CACHE_SCHEMA)
+        # Caches written before stage timings carried the job's image tag and vCPUs.
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(stage_timings)")}
+        for column, kind in (("version", "TEXT"), ("vcpus", "REAL")):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE stage_timings ADD COLUMN {column} {kind}")
+
+    def newest_start_date(self, state_machine_arn):
+        row = self.db.execute(
+            "SELECT newest_start_date FROM sync_state WHERE state_machine_arn = ?", (state_machine_arn,)
+        ).fetchone()
+        return _datetime(row[0]) if row else None
+
+    def upsert(self, state_machine_arn, name, details):
+        self.db.execute(
+            "INSERT OR REPLACE INTO executions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (details["executionArn"], state_machine_arn, name, details["status"],
+             _epoch(details["startDate"]), _epoch(details.get("stopDate")), details.get("input")),
+        )
+
+    def sync(self, state_machine_arn, workers=DEFAULT_WORKERS):
+        """Brings the cache up to date; returns (new, refreshed) execution counts."""
+        newest = self.newest_start_date(state_machine_arn)
+        running = self.db.execute(
+            "SELECT execution_arn, name FROM executions WHERE state_machine_arn = ? AND status = 'RUNNING'",
+            (state_machine_arn,),
+        ).fetchall()
+        seen = set()
+        counts = {"new": 0, "refreshed": 0}
+        high_water = [newest]
+
+        def to_describe():
+            # Executions started at or after the newest cached start (ties are re-described, harmlessly).
+            for exe in list_executions(state_machine_arn, since=newest):
+                seen.add(exe["executionArn"])
+                high_water[0] = max(high_water[0], exe["startDate"]) if high_water[0] else exe["startDate"]
+                counts["new"] += 1
+                yield exe
+            for arn, name in running:
+                if arn not in seen:
+                    counts["refreshed"] += 1
+                    yield {"executionArn": arn, "name": name}
+
+        for exe, details in describe_executions(to_describe(), workers=workers):
+            self.upsert(state_machine_arn, exe["name"], details)
+        if high_water[0]:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                (state_machine_arn, _epoch(high_water[0]), time.time()),
+            )
+        self.db.commit()
+        return counts["new"], counts["refreshed"]
+
+    def stage_timings(self, execution_arns, workers=DEFAULT_WORKERS):
+        """
+        Returns stage timings for the given terminal executions, fetching the
+        history only for executions not already in the cache.
+        """
+        missing = [{"executionArn": arn} for arn in execution_arns
+                   if not self.db.execute("SELECT 1 FROM stage_sync WHERE execution_arn = ?", (arn,)).fetchone()]
+        for exe, events in fan_out(missing, get_execution_history, workers):
+            for timing in stage_timings(events):
+                self.db.execute(
+                    "INSERT INTO stage_timings VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (exe["executionArn"], timing["stage"], _epoch(timing["entered"]), _epoch(timing["exited"]),
+                     timing["queue_seconds"], timing["run_seconds"], timing["version"], timing["vcpus"]),
+                )
+            self.db.execute("INSERT OR REPLACE INTO stage_sync VALUES (?)", (exe["executionArn"],))
+        self.db.commit()
+
+        # Look rows up through the execution index in batches that stay under SQLite's bound-variable limit.
+        rows = []
+        arns = list(dict.fromkeys(execution_arns))
+        for start in range(0, len(arns), STAGE_QUERY_BATCH):
+            batch = arns[start:start + STAGE_QUERY_BATCH]
+            placeholders = ", ".join("?" * len(batch))
+            for arn, stage, entered, exited, queue, run, version, vcpus in self.db.execute(
+                    "SELECT execution_arn, stage, entered, exited, queue_seconds, run_seconds, version, vcpus "
+                    f"FROM stage_timings WHERE execution_arn IN ({placeholders})", batch):
+                rows.append({"execution_arn": arn, "stage": stage, "entered": _datetime(entered),
+                             "exited": _datetime(exited), "queue_seconds": queue, "run_seconds": run,
+                             "total_seconds": exited - entered, "version": version, "vcpus": vcpus})
+        return rows
+
+    def input_sizes(self, sample_ids, workers=DEFAULT_WORKERS):
+        """Raw input bytes per sample, looking up (and caching) only samples not seen before."""
+        known = dict(self.db.execute("SELECT sample_id, input_bytes FROM input_sizes"))
+        missing = [sample_id for sample_id in set(sample_ids) if sample_id not in known]
+        for sample_id, size in fetch_input_sizes(missing, workers).items():
+            self.db.execute("INSERT OR REPLACE INTO input_sizes VALUES (?, ?)", (sample_id, size))
+            known[sample_id] = size
+        self.db.commit()
+        return {sample_id: known[sample_id] for sample_id in sample_ids if sample_id in known}
+
+    def executions(self, state_machine_arn, status=None, since=None, until=None, limit=None):
+        """Yields cached (execution, details) pairs newest-first, shaped like describe_executions output."""
+        query = "SELECT execution_arn, name, status, start_date, stop_date, input FROM executions WHERE state_machine_arn = ?"
+        params = [state_machine_arn]
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        if since:
+            query += " AND start_date >= ?"
+            params.append(_epoch(since))
+        if until:
+            query += " AND start_date <= ?"
+            params.append(_epoch(until))
+        query += " ORDER BY start_date DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        for arn, name, status, start, stop, payload in self.db.execute(query, params):
+            details = {"executionArn": arn, "status": status, "startDate": _datetime(start),
+                       "stopDate": _datetime(stop), "input": payload}
+            yield {"executionArn": arn, "name": name}, details
 
 def extract_sample_id(execution_details: dict) -> str:
     """Extract SampleId (srr_id) from execution input JSON."""
@@ -118,15 +540,39 @@ def compute_layout():
 def main():
     parser = argparse.ArgumentParser(description="Query Step Functions pipeline durations.")
     parser.add_argument("--csv", help="Export results to a CSV file", default=None)
-    parser.add_argument("--status", help="Filter by status (e.g. SUCCEEDED, FAILED, RUNNING)", default="SUCCEEDED")
+    parser.add_argument("--status", help="Filter by status (e.g. SUCCEEDED, FAILED, RUNNING, or ALL)", default="SUCCEEDED")
+    parser.add_argument("--since", help="Only executions started after this (ISO time, or age like 12h, 7d, 2w)", default=None)
+    parser.add_argument("--until", help="Only executions started before this (ISO time, or age like 1d)", default=None)
+    parser.add_argument("--limit", type=int, help="Stop after this many executions", default=None)
+    parser.add_argument("--workers", type=int, help="Concurrent describe_execution calls", default=DEFAULT_WORKERS)
+    parser.add_argument("--cache", help=f"SQLite execution cache (default {DEFAULT_CACHE_PATH})", default=DEFAULT_CACHE_PATH)
+    parser.add_argument("--offline", action="store_true", help="Report from the cache without syncing")
+    parser.add_argument("--no-cache", action="store_true", help="Query the API directly, bypassing the cache")
+    parser.add_argument("--stages", action="store_true", help="Add a per-stage breakdown from execution history")
+    parser.add_argument("--stages-csv", help="Export per-stage timings to a CSV file (implies --stages)", default=None)
+    parser.add_argument("--analyze", action="store_true", help="Add rolling windows, version regressions, size outliers and throughput")
+    parser.add_argument("--window", choices=["day", "week"], default="day", help="--analyze: rolling window size")
+    parser.add_argument("--report", help="Write the analytics report to FILE.json, FILE.csv or FILE.parquet (implies --analyze)", default=None)
     args = parser.parse_args()
 
-    print(f"Fetching recent executions for {STATE_MACHINE_ARN} in {AWS_REGION} with status={args.status}...\n")
+    status = None if args.status.upper() == "ALL" else args.status
+    since, until = parse_time(args.since), parse_time(args.until)
+    window = f" started {fmt_ts(since) if since else 'any time'} .. {fmt_ts(until) if until else 'now'}"
 
-    executions = list_executions(STATE_MACHINE_ARN, status=args.status, max_results=50)
-    if not executions:
-        print("No executions found.")
-        return
+    if args.no_cache:
+        print(f"Fetching executions for {STATE_MACHINE_ARN} in {AWS_REGION} with status={args.status}{window}...\n")
+        executions = describe_executions(
+            list_executions(STATE_MACHINE_ARN, status=status, since=since, until=until, limit=args.limit),
+            workers=args.workers,
+        )
+    else:
+        cache = ExecutionCache(args.cache)
+        if not args.offline:
+            print(f"Syncing execution cache {args.cache} for {STATE_MACHINE_ARN} in {AWS_REGION}...")
+            new, refreshed = cache.sync(STATE_MACHINE_ARN, workers=args.workers)
+            print(f"  {new} new, {refreshed} RUNNING refreshed")
+        print(f"Reporting cached executions with status={args.status}{window}...\n")
+        executions = cache.executions(STATE_MACHINE_ARN, status=status, since=since, until=until, limit=args.limit)
 
     widths, sep_len = compute_layout()
     # Header (requested order)
@@ -141,12 +587,11 @@ def main():
     )
     print("-" * sep_len)
 
-    durations = []
-    sample_durations = defaultdict(list)
     rows = []
+    records = []  # per-execution records for pipeline_analytics
+    finished = {}  # executionArn -> (name, sample_id, startDate) of terminal executions
 
-    for exe in executions:
-        details = describe_execution(exe["executionArn"])
+    for exe, details in executions:
         start = details["startDate"]
         stop = details.get("stopDate")
         status = details["status"]
@@ -155,9 +600,10 @@ def main():
         runtime_str = smart_format(duration)
 
         # Collect for summaries
-        if status in ("SUCCEEDED", "FAILED"):
-            durations.append(duration)
-            sample_durations[sample_id].append(duration)
+        records.append({"execution_arn": details["executionArn"], "execution_name": exe["name"],
+                        "sample_id": sample_id, "status": status, "start": start, "duration_seconds": duration})
+        if stop:
+            finished[details["executionArn"]] = (exe["name"], sample_id, start)
 
         # Row (respect widths + truncation for name)
         print(
@@ -181,24 +627,29 @@ def main():
             exe["name"],
         ])
 
+    if not rows:
+        print("No executions found.")
+        return
+
+    frame = pipeline_analytics.ExecutionFrame(records)
+
     # Overall summary
-    if durations:
-        avg_dur = mean(durations)
-        min_dur = min(durations)
-        max_dur = max(durations)
-        med_dur = median(durations)
-        print("\nOverall Summary ({} runs with status={}):".format(len(durations), args.status))
-        print(f"  Average: {smart_format(avg_dur)} ({avg_dur:.2f}s)")
-        print(f"  Median:  {smart_format(med_dur)} ({med_dur:.2f}s)")
-        print(f"  Min:     {smart_format(min_dur)} ({min_dur:.2f}s)")
-        print(f"  Max:     {smart_format(max_dur)} ({max_dur:.2f}s)")
+    overall = pipeline_analytics.summary(frame)
+    if overall["count"]:
+        print("\nOverall Summary ({} runs with status={}):".format(overall["count"], args.status))
+        print(f"  Average: {smart_format(overall['mean'])} ({overall['mean']:.2f}s)")
+        print(f"  Median:  {smart_format(overall['p50'])} ({overall['p50']:.2f}s)")
+        print(f"  p90:     {smart_format(overall['p90'])} ({overall['p90']:.2f}s)")
+        print(f"  p99:     {smart_format(overall['p99'])} ({overall['p99']:.2f}s)")
+        print(f"  Min:     {smart_format(overall['min'])} ({overall['min']:.2f}s)")
+        print(f"  Max:     {smart_format(overall['max'])} ({overall['max']:.2f}s)")
 
     # Per-sample summary
-    if sample_durations:
+    samples = pipeline_analytics.per_sample(frame)
+    if samples:
         print("\nPer-Sample Average Durations:")
-        for sample, runs in sorted(sample_durations.items()):
-            avg = mean(runs)
-            print(f"  {sample:<20} {smart_format(avg)} (avg over {len(runs)} runs)")
+        for sample in samples:
+            print(f"  {sample['sample_id']:<20} {smart_format(sample['mean_seconds'])} (avg over {sample['runs']} runs)")
 
     # CSV export
     if args.csv:
@@ -208,5 +659,91 @@ def main():
             writer.writerows(rows)
         print(f"\nExported {len(rows)} rows to {args.csv}")
 
+    want_stages = args.stages or args.stages_csv
+    want_analytics = args.analyze or args.report
+    if not finished or not (want_stages or want_analytics):
+        return
+
+    # Execution history backs both the stage breakdown and the version/vCPU columns of the analytics.
+    print(f"\nFetching execution history for {len(finished)} finished executions...")
+    if args.no_cache:
+        stage_rows = []
+        for exe, events in fan_out([{"executionArn": arn} for arn in finished], get_execution_history, args.workers):
+            stage_rows.extend(dict(timing, execution_arn=exe["executionArn"]) for timing in stage_timings(events))
+    else:
+        stage_rows = cache.stage_timings(list(finished), workers=args.workers)
+
+    # Per-stage breakdown
+    if want_stages:
+        if not stage_rows:
+            print("No Task states found in execution history.")
+        else:
+            print_stage_report(stage_rows, {arn: start for arn, (_, _, start) in finished.items()})
+
+        if stage_rows and args.stages_csv:
+            with open(args.stages_csv, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["ExecutionName", "SampleId", "Stage", "EnteredUTC", "ExitedUTC",
+                                 "QueueSeconds", "RunSeconds", "TotalSeconds"])
+                for row in sorted(stage_rows, key=lambda r: (r["execution_arn"], r["entered"])):
+                    name, sample_id, _ = finished[row["execution_arn"]]
+                    queue = "" if row["queue_seconds"] is None else f"{row['queue_seconds']:.2f}"
+                    writer.writerow([name, sample_id, row["stage"], fmt_ts(row["entered"]), fmt_ts(row["exited"]),
+                                     queue, f"{row['run_seconds']:.2f}", f"{row['total_seconds']:.2f}"])
+            print(f"\nExported {len(stage_rows)} stage rows to {args.stages_csv}")
+
+    if want_analytics:
+        print_analytics(records, stage_rows, args, None if args.no_cache else cache)
+
+def print_analytics(records, stage_rows, args, cache):
+    """Enriches execution records with version, vCPU-seconds and input size, then prints the analytics report."""
+    versions = defaultdict(lambda: defaultdict(int))
+    vcpu_seconds = defaultdict(float)
+    for row in stage_rows:
+        if row["version"]:
+            versions[row["execution_arn"]][row["version"]] += 1
+        if row["vcpus"]:
+            vcpu_seconds[row["execution_arn"]] += row["vcpus"] * row["run_seconds"]
+    sample_ids = sorted({r["sample_id"] for r in records})
+    sizes = cache.input_sizes(sample_ids, args.workers) if cache else fetch_input_sizes(sample_ids, args.workers)
+    for record in records:
+        arn = record["execution_arn"]
+        if versions.get(arn):
+            record["version"] = max(versions[arn], key=versions[arn].get)
+        record["vcpu_seconds"] = vcpu_seconds.get(arn)
+        record["input_bytes"] = sizes.get(record["sample_id"])
+
+    report = pipeline_analytics.analyse(pipeline_analytics.ExecutionFrame(records), window=args.window)
+
+    rate = report["throughput"]
+    print("\nThroughput (successful runs):")
+    print(f"  Execution hours:       {rate['execution_hours']:.2f}")
+    gb_per_hour, per_vcpu_hour = rate["gb_per_hour"], rate["samples_per_vcpu_hour"]
+    print(f"  GB processed per hour: {'---' if gb_per_hour is None else f'{gb_per_hour:.2f}'}")
+    print(f"  Samples per vCPU-hour: {'---' if per_vcpu_hour is None else f'{per_vcpu_hour:.3f}'}")
+
+    print(f"\nRolling ({args.window}) [runs, failed, p50, p90]:")
+    for row in report["rolling"]:
+        print(f"  {row['window_start']}  {row['runs']:>5} {row['failed']:>5}  "
+              f"{smart_format(row['p50_seconds']):>8} {smart_format(row['p90_seconds']):>8}")
+
+    if report["versions"]:
+        unit = report["versions"][0]["unit"]
+        print(f"\nVersion Cohorts (deployment order, {unit}) [runs, p50, p90, p50 change]:")
+        for row in report["versions"]:
+            change = "" if row["p50_change"] is None else f"{row['p50_change']:+.1%}"
+            flag = "  <-- REGRESSION" if row["regression"] else ""
+            print(f"  {trunc(row['version'], 24):<24} {row['runs']:>5} {row['p50']:>10.1f} {row['p90']:>10.1f} {change:>8}{flag}")
+
+    if report["size_outliers"]:
+        print("\nInput-Size Outliers [input GB, actual, expected, robust z]:")
+        for row in report["size_outliers"]:
+            print(f"  {trunc(row['execution_name'], 30):<30} {row['input_gb']:>8.2f} "
+                  f"{smart_format(row['duration_seconds']):>8} {smart_format(row['expected_seconds']):>8} {row['robust_z']:+6.1f}")
+
+    if args.report:
+        for path in pipeline_analytics.write_report(report, args.report):
+            print(f"\nWrote {path}")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,35 @@
+"""
+Shared setup for the unit tests. The modules under test are scripts rather
+than an installed package, so their directories go on sys.path; tasks.py and
+the trigger Lambda read their configuration from the environment at import.
+"""
+
+import os
+import sys
+
+import boto3
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("app", "scripts", os.path.join("lambda", "trigger")):
+    sys.path.insert(0, os.path.join(REPO_ROOT, directory))
+
+os.environ.setdefault("BUCKET_NAME", "geyser-unit-tests")
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-2")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("STATE_MACHINE_ARN", "arn:aws:states:eu-west-2:123456789012:stateMachine:geyser-unit-tests")
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """A moto-backed S3 with the tasks.py bucket created, swapped in for tasks.s3_client."""
+    from moto import mock_aws
+
+    with mock_aws():
+        client = boto3.client("s3", region_name="eu-west-2")
+        client.create_bucket(Bucket=os.environ["BUCKET_NAME"],
+                             CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        import tasks
+        monkeypatch.setattr(tasks, "s3_client", client)
+        yield client
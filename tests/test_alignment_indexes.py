@@ -0,0 +1,44 @@
+import shlex
+
+import tasks
+
+
+def put(s3, *keys):
+    for key in keys:
+        s3.put_object(Bucket=tasks.BUCKET_NAME, Key=key, Body=b"x")
+
+
+def keys(s3):
+    return sorted(obj["Key"] for obj in s3.list_objects_v2(Bucket=tasks.BUCKET_NAME).get("Contents", []))
+
+
+def test_every_old_index_is_dropped(s3):
+    put(s3, "alignments/S1.bam", "alignments/S1.bam.bai", "alignments/S1.bam.csi",
+        "alignments/S1.bam.manifest.json", "alignments/S10.bam.bai")
+    tasks.remove_stale_alignment_indexes("alignments/S1.bam")
+    assert keys(s3) == ["alignments/S1.bam", "alignments/S1.bam.manifest.json", "alignments/S10.bam.bai"]
+    assert tasks.find_alignment_index_key("alignments/S1.bam") is None
+
+
+def test_new_index_is_kept(s3):
+    put(s3, "alignments/S1.bam", "alignments/S1.bam.bai", "alignments/S1.bam.csi")
+    tasks.remove_stale_alignment_indexes("alignments/S1.bam", keep="alignments/S1.bam.csi")
+    assert tasks.find_alignment_index_key("alignments/S1.bam") == "alignments/S1.bam.csi"
+
+
+def test_sort_options_precede_the_stdin_input():
+    argv = shlex.split(tasks.sort_command("ref.fa", "-", 4, temp_prefix="/tmp/S1.sort"))
+    assert argv[-1] == "-"
+    assert argv[argv.index("-T") + 1] == "/tmp/S1.sort"
+    assert "-T" not in tasks.sort_command("ref.fa", "out.bam", 4)
+
+
+def test_index_type_follows_format_and_contig_length(tmp_path):
+    fai = tmp_path / "ref.fa.fai"
+    fai.write_text("chr1\t248956422\t6\t60\t61\n")
+    assert tasks.alignment_index_ext("S1.bam", str(tmp_path / "ref.fa")) == ".bai"
+    assert tasks.alignment_index_ext("S1.cram", str(tmp_path / "ref.fa")) == ".crai"
+    fai.write_text(f"big\t{tasks.BAI_MAX_CONTIG_BP + 1}\t6\t60\t61\n")
+    assert tasks.alignment_index_ext("S1.bam", str(tmp_path / "ref.fa")) == ".csi"
+    assert tasks.index_command("-", "S1.bam.csi")[:3] == ["samtools", "index", "-c"]
+    assert tasks.index_command("-", "S1.bam.csi")[-2:] == ["-", "S1.bam.csi"]
@@ -0,0 +1,64 @@
+import gzip
+import shutil
+import threading
+
+import pytest
+
+import tasks
+
+PAYLOAD = b"".join(b"@read%d\nACGTACGTNN\n+\nIIIIIIIIII\n" % i for i in range(20000))
+BACKENDS = ["zlib"] + [name for name in ("gunzip",) if shutil.which(name)]
+
+
+def decompress(backend, data, chunk_size=4096):
+    """Runs `data` through a backend the way decompress_task does; returns the output or raises."""
+    decompressor = tasks.open_decompressor(data[:64], backend)
+    chunks = (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+    errors = []
+
+    def feed():
+        try:
+            decompressor.feed(chunks)
+        except Exception as e:
+            errors.append(e)
+
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    output = decompressor.stdout.read()
+    feeder.join()
+    decompressor.wait()
+    if errors:
+        raise errors[0]
+    return output
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_single_and_multi_member(backend):
+    single = gzip.compress(PAYLOAD)
+    multi = gzip.compress(PAYLOAD[:100000]) + gzip.compress(PAYLOAD[100000:])
+    assert decompress(backend, single) == PAYLOAD
+    assert decompress(backend, multi) == PAYLOAD
+    # A member boundary falling exactly on a chunk boundary.
+    first = gzip.compress(PAYLOAD[:5000])
+    assert decompress(backend, first + gzip.compress(PAYLOAD[5000:]), chunk_size=len(first)) == PAYLOAD
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("corrupt", [
+    lambda data: data[:len(data) // 2],  # truncated mid-member
+    lambda data: data[:-4],  # missing the size trailer
+    lambda data: data + b"trailing garbage",
+    lambda data: data[:20] + bytes(b ^ 0xFF for b in data[20:40]) + data[40:],
+    lambda data: b"",
+])
+def test_corrupt_input_fails_on_every_backend(backend, corrupt):
+    with pytest.raises((ValueError, tasks.subprocess.CalledProcessError)):
+        decompress(backend, corrupt(gzip.compress(PAYLOAD)))
+
+
+def test_bgzf_truncated_and_empty():
+    block = gzip.compress(PAYLOAD[:1000])  # not BGZF: no BC subfield
+    with pytest.raises(ValueError):
+        decompress("bgzf", block)
+    with pytest.raises(ValueError):
+        decompress("bgzf", b"")
@@ -0,0 +1,30 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import tasks
+
+
+def test_ranged_download_reassembles_the_object(s3, tmp_path, monkeypatch):
+    monkeypatch.setattr(tasks, "S3_CHUNK_SIZE", 1000)
+    body = bytes(range(256)) * 20
+    s3.put_object(Bucket=tasks.BUCKET_NAME, Key="raw_reads/S1.fastq.gz", Body=body)
+
+    assert tasks.download_object("raw_reads/S1.fastq.gz", str(tmp_path / "S1")) == len(body)
+    assert (tmp_path / "S1").read_bytes() == body
+
+
+def test_overwrite_during_download_fails_instead_of_mixing_versions(s3, tmp_path, monkeypatch):
+    monkeypatch.setattr(tasks, "S3_CHUNK_SIZE", 1000)
+    s3.put_object(Bucket=tasks.BUCKET_NAME, Key="raw_reads/S1.fastq.gz", Body=b"a" * 5000)
+    real_head_object = s3.head_object
+
+    def head_object(**kwargs):
+        head = real_head_object(**kwargs)
+        s3.put_object(Bucket=tasks.BUCKET_NAME, Key=kwargs["Key"], Body=b"b" * 5000)
+        return head
+
+    monkeypatch.setattr(s3, "head_object", head_object)
+    with pytest.raises(ClientError) as error:
+        tasks.download_object("raw_reads/S1.fastq.gz", str(tmp_path / "S1"))
+    assert error.value.response["Error"]["Code"] in ("412", "PreconditionFailed")
+    assert not (tmp_path / "S1").exists()
@@ -0,0 +1,87 @@
+import random
+
+import tasks
+
+
+def fastq_records(count, seed=7):
+    """Variable-length records; some quality lines start with '@' to look like headers."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        length = rng.randint(20, 120)
+        sequence = "".join(rng.choice("ACGTN") for _ in range(length))
+        quality = "".join(rng.choice("@ABCDI#") for _ in range(length))
+        records.append(f"@read{i} extra\n{sequence}\n+\n{quality}\n".encode())
+    return records
+
+
+def plan(s3, monkeypatch, data, chunk_bytes):
+    s3.put_object(Bucket=tasks.BUCKET_NAME, Key="decompressed/S1.fastq", Body=data)
+    monkeypatch.setattr(tasks, "ALIGN_CHUNK_BYTES", chunk_bytes)
+    monkeypatch.setattr(tasks, "FASTQ_BOUNDARY_WINDOW", 4096)
+    return tasks.plan_fastq_chunks("decompressed/S1.fastq")
+
+
+def test_chunks_cover_the_file_on_record_boundaries(s3, monkeypatch):
+    records = fastq_records(2000)
+    data = b"".join(records)
+    record_starts = set()
+    offset = 0
+    for record in records:
+        record_starts.add(offset)
+        offset += len(record)
+
+    ranges = plan(s3, monkeypatch, data, chunk_bytes=len(data) // 9)
+    assert len(ranges) == 10
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data) - 1
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end + 1 == start
+    assert all(start in record_starts for start, _ in ranges)
+
+
+def test_small_file_is_one_chunk(s3, monkeypatch):
+    data = b"".join(fastq_records(10))
+    assert plan(s3, monkeypatch, data, chunk_bytes=1 << 20) == [[0, len(data) - 1]]
+
+
+def test_shard_count_is_capped(s3, monkeypatch):
+    data = b"".join(fastq_records(500))
+    monkeypatch.setattr(tasks, "ALIGN_MAX_SHARDS", 3)
+    assert len(plan(s3, monkeypatch, data, chunk_bytes=100)) == 3
+
+
+def interleaved_pairs(count, suffixes=(b"", b""), singles=()):
+    """Interleaved mates (names optionally ending /1, /2); indices in `singles` are unpaired reads."""
+    records = []
+    for i in range(count):
+        mates = [suffixes[0]] if i in singles else list(suffixes)
+        for suffix in mates:
+            length = 50 + i % 30
+            records.append(b"@SRR1.%d%s len=%d\n%s\n+\n%s\n" % (i, suffix, length, b"A" * length, b"@" * length))
+    return records
+
+
+def mates_split(ranges, data):
+    """True if any chunk boundary falls between two reads with the same name."""
+    for start, _ in ranges[1:]:
+        previous = data[:start].rstrip(b"\n").rsplit(b"\n", 3)[0].rsplit(b"\n", 1)[-1]
+        following = data[start:].split(b"\n", 1)[0]
+        if tasks._fastq_read_name(previous) == tasks._fastq_read_name(following):
+            return True
+    return False
+
+
+def test_boundaries_never_separate_mates(s3, monkeypatch):
+    for suffixes in [(b"", b""), (b"/1", b"/2")]:
+        data = b"".join(interleaved_pairs(3000, suffixes, singles={7, 500, 1200}))
+        for shards in (7, 13, 29):
+            ranges = plan(s3, monkeypatch, data, chunk_bytes=len(data) // shards)
+            assert ranges[0][0] == 0 and ranges[-1][1] == len(data) - 1
+            assert not mates_split(ranges, data)
+            assert all(data[start:start + 1] == b"@" for start, _ in ranges)
+
+
+def test_read_names_ignore_comments_and_mate_suffixes():
+    assert tasks._fastq_read_name(b"@SRR1.5/1 extra words") == b"SRR1.5"
+    assert tasks._fastq_read_name(b"@SRR1.5 1:N:0") == tasks._fastq_read_name(b"@SRR1.5 2:N:0")
+    assert tasks._fastq_read_name(b"@") == b""
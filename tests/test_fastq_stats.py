@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+import fastq_stats
+from fastq_stats import FastqStats
+
+
+def fastq(*reads):
+    """FASTQ bytes for (sequence, quality) pairs."""
+    return "".join(f"@r{i}\n{seq}\n+\n{qual}\n" for i, (seq, qual) in enumerate(reads)).encode()
+
+
+def stats_of(data, chunk=None):
+    stats = FastqStats()
+    chunk = chunk or len(data) or 1
+    for start in range(0, len(data), chunk):
+        stats.update(data[start:start + chunk])
+    return stats.report()
+
+
+def test_fixed_length_reads():
+    report = stats_of(fastq(("ACGT", "IIII"), ("GGCC", "!!!!")))
+
+    assert report["reads"] == 2 and report["bases"] == 8
+    assert report["length"] == {"min": 4, "max": 4, "mean": 4.0}
+    assert report["gc_percent"] == 75.0
+    assert report["per_position"][0]["mean_quality"] == 20.0
+    assert report["per_position"][0]["A_percent"] == 50.0 and report["per_position"][0]["G_percent"] == 50.0
+    assert report["per_read_quality"] == [{"mean_quality": 0, "reads": 1}, {"mean_quality": 40, "reads": 1}]
+    assert report["modules"]["sequence_length_distribution"] == "pass"
+
+
+def test_variable_length_reads_match_fixed_length_path():
+    variable = stats_of(fastq(("ACGTN", "IIII5"), ("AC", "II"), ("", "")))
+
+    assert variable["length_distribution"] == [{"length": 0, "reads": 1}, {"length": 2, "reads": 1},
+                                               {"length": 5, "reads": 1}]
+    assert [p["reads"] for p in variable["per_position"]] == [2, 2, 1, 1, 1]
+    assert variable["n_percent"] == round(100 / 7, 4)
+    assert variable["modules"]["sequence_length_distribution"] == "fail"
+
+    # Per-read figures for the non-empty reads agree with the vectorised fixed-length path.
+    fixed = stats_of(fastq(("ACGTN", "IIII5")))
+    assert fixed["per_read_quality"] == [{"mean_quality": 36, "reads": 1}]
+    assert {"mean_quality": 36, "reads": 1} in variable["per_read_quality"]
+    assert fixed["gc_distribution"] == [{"gc_percent": 40, "reads": 1}]
+
+
+def test_records_may_span_update_calls(monkeypatch):
+    monkeypatch.setattr(fastq_stats, "BATCH_BYTES", 16)
+    data = fastq(*[("ACGTACGT", "IIIIIIII")] * 10 + [("TTTT", "####")])
+
+    assert stats_of(data, chunk=7) == stats_of(data)
+
+
+def test_crlf_and_missing_final_newline():
+    data = fastq(("ACGT", "IIII")).replace(b"\n", b"\r\n").rstrip()
+    report = stats_of(data)
+
+    assert report["reads"] == 1 and report["bases"] == 4
+
+
+def test_duplication_and_overrepresented_sequences():
+    report = stats_of(fastq(*[("ACGTACGT", "IIIIIIII")] * 9 + [("TTTTTTTT", "IIIIIIII")]))
+
+    assert report["duplication"]["tracked_sequences"] == 2
+    assert report["duplication"]["percent_remaining_if_deduplicated"] == 20.0
+    assert report["overrepresented"][0] == {"sequence": "ACGTACGT", "count": 9, "percent": 90.0}
+    assert report["modules"]["overrepresented_sequences"] == "fail"
+
+
+def test_malformed_records_raise():
+    with pytest.raises(ValueError, match="'@' header"):
+        stats_of(b"r0\nACGT\n+\nIIII\n")
+    with pytest.raises(ValueError, match="differs in length"):
+        stats_of(b"@r0\nACGT\n+\nIII\n")
+
+
+def test_truncated_input_is_an_error():
+    stats = FastqStats()
+    stats.update(fastq(("ACGT", "IIII")) + b"@r1\nACGT\n")
+    with pytest.raises(ValueError, match="incomplete record"):
+        stats.report()
+
+
+def test_end_segment_drops_a_partial_sampled_record():
+    record = fastq(("ACGT", "IIII"))
+    stats = FastqStats()
+    stats.update(record + b"@r1\nAC")
+    stats.end_segment()
+    stats.update(record)
+    report = stats.report()
+
+    assert report["reads"] == 2
+    assert report["bytes_examined"] == 2 * len(record)
+
+
+def test_empty_input():
+    report = FastqStats().report()
+
+    assert report["reads"] == 0 and report["per_position"] == []
+    assert report["length"] == {"min": 0, "max": 0, "mean": 0.0}
+
+
+def test_write_report_json(tmp_path):
+    report = stats_of(fastq(("ACGT", "IIII")))
+    [path] = fastq_stats.write_report(report, str(tmp_path / "qc.json"))
+
+    assert json.loads(open(path).read()) == json.loads(json.dumps(report))
+    with pytest.raises(ValueError):
+        fastq_stats.write_report(report, str(tmp_path / "qc.html"))
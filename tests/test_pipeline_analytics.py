@@ -0,0 +1,136 @@
+import csv
+import json
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+import pipeline_analytics as pa
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)  # a Monday
+
+
+def record(i, duration, status="SUCCEEDED", sample_id=None, start=None, **extra):
+    return dict({"execution_name": f"exe-{i}", "sample_id": sample_id or f"SRR{i}", "status": status,
+                 "start": start or T0 + timedelta(hours=i), "duration_seconds": duration}, **extra)
+
+
+def test_summary_ignores_unfinished_runs():
+    frame = pa.ExecutionFrame([record(0, 10.0), record(1, 30.0, status="FAILED"),
+                               record(2, float("nan"), status="RUNNING")])
+    stats = pa.summary(frame)
+
+    assert stats["count"] == 2
+    assert stats["mean"] == 20.0 and stats["min"] == 10.0 and stats["max"] == 30.0
+    assert stats["p50"] == 20.0
+
+
+def test_summary_of_nothing_is_an_empty_count():
+    assert pa.summary(pa.ExecutionFrame([])) == {"count": 0}
+    assert pa.per_sample(pa.ExecutionFrame([])) == []
+    assert pa.rolling(pa.ExecutionFrame([])) == []
+
+
+def test_where_keeps_columns_aligned():
+    frame = pa.ExecutionFrame([record(0, 10.0, version="v1"), record(1, 20.0, version="v2")])
+    subset = frame.where(frame.version == "v2")
+
+    assert subset.size == 1
+    assert list(subset.name) == ["exe-1"] and list(subset.duration) == [20.0]
+    assert list(pa.ExecutionFrame([record(0, 1.0)]).version) == ["unknown"]
+
+
+def test_per_sample_groups_runs():
+    frame = pa.ExecutionFrame([record(0, 10.0, sample_id="SRRB"), record(1, 30.0, sample_id="SRRA"),
+                               record(2, 50.0, sample_id="SRRA")])
+
+    assert pa.per_sample(frame) == [
+        {"sample_id": "SRRA", "runs": 2, "mean_seconds": 40.0, "p50_seconds": 40.0},
+        {"sample_id": "SRRB", "runs": 1, "mean_seconds": 10.0, "p50_seconds": 10.0},
+    ]
+
+
+def test_rolling_day_and_iso_week_windows():
+    starts = [T0 - timedelta(days=1), T0, T0 + timedelta(hours=23), T0 + timedelta(days=6, hours=23)]
+    frame = pa.ExecutionFrame([record(i, 60.0, start=start, status="FAILED" if i == 1 else "SUCCEEDED")
+                               for i, start in enumerate(starts)])
+
+    days = pa.rolling(frame, "day")
+    assert [row["window_start"] for row in days] == ["2023-12-31", "2024-01-01", "2024-01-07"]
+    assert [(row["runs"], row["succeeded"], row["failed"]) for row in days] == [(1, 1, 0), (2, 1, 1), (1, 1, 0)]
+
+    weeks = pa.rolling(frame, "week")
+    assert [row["window_start"] for row in weeks] == ["2023-12-25", "2024-01-01"]
+    assert [row["runs"] for row in weeks] == [1, 3]
+
+    with pytest.raises(ValueError):
+        pa.rolling(frame, "month")
+
+
+def test_version_regression_is_flagged_in_deployment_order():
+    # v10 sorts before v9 but was deployed after it.
+    runs = [record(i, 100.0, version="v9") for i in range(5)]
+    runs += [record(i, 130.0, version="v10") for i in range(5, 10)]
+    rows = pa.version_regressions(pa.ExecutionFrame(runs))
+
+    assert [row["version"] for row in rows] == ["v9", "v10"]
+    assert rows[0]["regression"] is False and rows[0]["p50_change"] is None
+    assert rows[1]["p50_change"] == pytest.approx(0.30)
+    assert rows[1]["regression"] is True and rows[1]["unit"] == "seconds"
+
+
+def test_version_regression_normalises_by_input_size():
+    # Twice the input in 1.5x the time is faster per GB, not a regression.
+    runs = [record(i, 100.0, version="v1", input_bytes=1e9) for i in range(5)]
+    runs += [record(i, 150.0, version="v2", input_bytes=2e9) for i in range(5, 10)]
+    rows = pa.version_regressions(pa.ExecutionFrame(runs))
+
+    assert rows[1]["unit"] == "seconds_per_gb"
+    assert rows[1]["p50"] == 75.0 and rows[1]["regression"] is False
+
+
+def test_version_regression_needs_enough_runs():
+    runs = [record(0, 100.0, version="v1"), record(1, 200.0, version="v2")]
+    assert [row["regression"] for row in pa.version_regressions(pa.ExecutionFrame(runs))] == [False, False]
+
+
+def test_size_outliers_flag_runs_slow_for_their_input():
+    sizes = np.geomspace(1e8, 1e10, 12)
+    runs = [record(i, 2e-7 * size * (1 + 0.02 * (i % 3)), input_bytes=size) for i, size in enumerate(sizes)]
+    runs[6]["duration_seconds"] *= 10
+    outliers = pa.size_outliers(pa.ExecutionFrame(runs))
+
+    assert [row["execution_name"] for row in outliers] == ["exe-6"]
+    assert outliers[0]["robust_z"] > 0
+    assert outliers[0]["duration_seconds"] > outliers[0]["expected_seconds"]
+
+
+def test_size_outliers_need_three_sized_runs():
+    runs = [record(0, 10.0, input_bytes=1e9), record(1, 500.0, input_bytes=1e9), record(2, 10.0)]
+    assert pa.size_outliers(pa.ExecutionFrame(runs)) == []
+
+
+def test_throughput():
+    runs = [record(0, 1800.0, input_bytes=3e9, vcpu_seconds=7200.0),
+            record(1, 1800.0, input_bytes=1e9, vcpu_seconds=7200.0),
+            record(2, 900.0, status="FAILED", input_bytes=5e9, vcpu_seconds=3600.0)]
+    result = pa.throughput(pa.ExecutionFrame(runs))
+
+    assert result == {"execution_hours": 1.0, "gb_per_hour": 4.0, "samples_per_vcpu_hour": 0.5}
+    assert pa.throughput(pa.ExecutionFrame([record(0, 60.0)]))["gb_per_hour"] is None
+
+
+def test_write_report_json_and_csv(tmp_path):
+    report = pa.analyse(pa.ExecutionFrame([record(i, 60.0 + i, version="v1") for i in range(3)]))
+
+    [json_path] = pa.write_report(report, str(tmp_path / "report.json"))
+    assert json.loads(open(json_path).read())["summary"]["count"] == 3
+
+    written = pa.write_report(report, str(tmp_path / "report.csv"))
+    # Empty tables (no outliers here) are skipped.
+    assert sorted(p.rsplit(".", 2)[-2] for p in written) == ["per_sample", "rolling", "summary", "throughput", "versions"]
+    with open(tmp_path / "report.per_sample.csv") as f:
+        assert [row["sample_id"] for row in csv.DictReader(f)] == ["SRR0", "SRR1", "SRR2"]
+
+    with pytest.raises(ValueError):
+        pa.write_report(report, str(tmp_path / "report.xlsx"))
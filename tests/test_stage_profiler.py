@@ -0,0 +1,49 @@
+import threading
+
+import tasks
+
+
+def copy_under_profiler(s3, srr_id, size, profilers, ready):
+    tasks._profiler_state.profiler = profiler = tasks.StageProfiler("Copy", srr_id)
+    profilers[srr_id] = profiler
+    try:
+        ready.wait()
+        pipeline = tasks.StreamPipeline(f"copy {srr_id}")
+        pipeline.s3_sink(pipeline.s3_source(f"in/{srr_id}"), f"out/{srr_id}")
+        pipeline.run()
+    finally:
+        tasks._profiler_state.profiler = None
+        profiler._stop.set()
+
+
+def test_stream_bytes_go_to_the_task_that_built_the_pipeline(s3):
+    sizes = {"S1": 1_000, "S2": 300_000}
+    for srr_id, size in sizes.items():
+        s3.put_object(Bucket=tasks.BUCKET_NAME, Key=f"in/{srr_id}", Body=b"x" * size)
+    profilers, ready = {}, threading.Barrier(len(sizes))
+    threads = [threading.Thread(target=copy_under_profiler, args=(s3, srr_id, size, profilers, ready))
+               for srr_id, size in sizes.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for srr_id, size in sizes.items():
+        phases = profilers[srr_id].phases
+        assert sum(phase["bytes_in"] for phase in phases) == size
+        assert sum(phase["bytes_out"] for phase in phases) == size
+
+
+def test_bound_helper_reports_to_the_binding_task():
+    profiler = tasks.StageProfiler("Copy", "S1")
+    try:
+        tasks._profiler_state.profiler = profiler
+        bound = tasks.bind_profiler(tasks.profile_bytes)
+        tasks._profiler_state.profiler = None
+        worker = threading.Thread(target=bound, args=("in", 42))
+        worker.start()
+        worker.join()
+        tasks.profile_bytes("in", 7)  # no task on this thread: not attributed anywhere
+    finally:
+        profiler._stop.set()
+    assert [phase["bytes_in"] for phase in profiler.phases] == [42]
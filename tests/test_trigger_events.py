@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import index
+
+
+def s3_record(key, etag="abc", bucket="uploads"):
+    return {"eventSource": "aws:s3", "s3": {"bucket": {"name": bucket}, "object": {"key": key, "eTag": etag}}}
+
+
+def sqs_record(message_id, *s3_records):
+    return {"eventSource": "aws:sqs", "messageId": message_id, "body": json.dumps({"Records": list(s3_records)})}
+
+
+def test_every_direct_record_is_parsed_and_keys_are_unquoted():
+    event = {"Records": [s3_record("raw_reads/S1.fastq.gz", "e1"), s3_record("raw_reads/my+sample%281%29.fastq.gz", '"e2"')]}
+    assert index.parse_s3_records(event) == [
+        (None, "uploads", "raw_reads/S1.fastq.gz", "e1"),
+        (None, "uploads", "raw_reads/my sample(1).fastq.gz", "e2"),
+    ]
+
+
+def test_sqs_messages_are_unwrapped_and_test_events_skipped():
+    event = {"Records": [
+        sqs_record("m1", s3_record("raw_reads/S1.fastq.gz"), s3_record("raw_reads/S2.fastq.gz")),
+        {"eventSource": "aws:sqs", "messageId": "m2", "body": json.dumps({"Event": "s3:TestEvent"})},
+    ]}
+    assert [(message_id, key) for message_id, _, key, _ in index.parse_s3_records(event)] == [
+        ("m1", "raw_reads/S1.fastq.gz"), ("m1", "raw_reads/S2.fastq.gz")]
+
+
+def test_malformed_record_raises():
+    with pytest.raises(RuntimeError):
+        index.parse_s3_records({"Records": [{"s3": {"object": {"key": "x"}}}]})
+
+
+def test_only_messages_behind_failed_samples_are_returned(monkeypatch):
+    monkeypatch.setattr(index, "resolve_route", lambda bucket, key, srr_id: {"reference_name": "chr20.fa", "resources": {}})
+
+    def start(state_machine_arn, pipeline_input, name):
+        if pipeline_input["srr_id"] == "S2":
+            raise RuntimeError("boom")
+        return f"arn:execution:{name}"
+
+    monkeypatch.setattr(index, "start_named_execution", start)
+    event = {"Records": [
+        sqs_record("m1", s3_record("raw_reads/S1.fastq.gz")),
+        sqs_record("m2", s3_record("raw_reads/S2.fastq.gz")),
+        sqs_record("m3", s3_record("raw_reads/S2.fastq.gz", "again")),
+    ]}
+    response = index.handler(event, None)
+    assert response["statusCode"] == 207
+    assert response["batchItemFailures"] == [{"itemIdentifier": "m2"}, {"itemIdentifier": "m3"}]
+
+
+def test_direct_invocation_failure_raises(monkeypatch):
+    monkeypatch.setattr(index, "resolve_route", lambda bucket, key, srr_id: {"reference_name": "chr20.fa", "resources": {}})
+    monkeypatch.setattr(index, "start_named_execution", lambda *args: (_ for _ in ()).throw(RuntimeError("boom")))
+    with pytest.raises(RuntimeError):
+        index.handler({"Records": [s3_record("raw_reads/S1.fastq.gz")]}, None)
@@ -0,0 +1,48 @@
+import pytest
+
+import index
+
+
+@pytest.mark.parametrize("key, expected", [
+    ("raw_reads/small_test.fastq.gz", ("small_test", None)),
+    ("raw_reads/SRR1_1.fastq.gz", ("SRR1", "1")),
+    ("raw_reads/nested/SRR1_2.fq.gz", ("SRR1", "2")),
+    ("raw_reads/SRR1_3.fastq.gz", ("SRR1_3", None)),
+])
+def test_extract_srr_id(key, expected):
+    assert index.extract_srr_id(key) == expected
+
+
+def test_execution_names_are_deterministic_and_valid():
+    name = index.execution_name("sample with spaces/and:colons", ["e1", "e2"])
+    assert name == index.execution_name("sample with spaces/and:colons", ["e1", "e2"])
+    assert name != index.execution_name("sample with spaces/and:colons", ["e1", "e3"])
+    assert len(name) <= 80 and all(c.isalnum() or c in "-_" for c in name)
+    assert len(index.execution_name("x" * 200, ["e1"])) <= 80
+
+
+def test_mates_are_held_until_both_arrive(monkeypatch):
+    monkeypatch.setattr(index, "pairing_index", index.LocalPairingIndex())
+    monkeypatch.setattr(index, "resolve_route", lambda bucket, key, srr_id: {"reference_name": "chr20.fa", "resources": {}})
+    started = []
+    monkeypatch.setattr(index, "start_named_execution", lambda arn, pipeline_input, name: started.append((pipeline_input["srr_id"], name)) or name)
+
+    def upload(key, etag):
+        record = {"s3": {"bucket": {"name": "uploads"}, "object": {"key": key, "eTag": etag}}}
+        return index.handler({"Records": [record]}, None)
+
+    upload("raw_reads/SRR1_2.fastq.gz", "b")
+    assert started == []
+    upload("raw_reads/SRR1_1.fastq.gz", "a")
+    assert started == [("SRR1", index.execution_name("SRR1", ["a", "b"]))]
+
+
+def test_both_mates_in_one_event_start_once(monkeypatch):
+    monkeypatch.setattr(index, "pairing_index", index.LocalPairingIndex())
+    monkeypatch.setattr(index, "resolve_route", lambda bucket, key, srr_id: {"reference_name": "chr20.fa", "resources": {}})
+    started = []
+    monkeypatch.setattr(index, "start_named_execution", lambda arn, pipeline_input, name: started.append(name) or name)
+    records = [{"s3": {"bucket": {"name": "uploads"}, "object": {"key": f"raw_reads/SRR1_{mate}.fastq.gz", "eTag": mate}}}
+               for mate in ("1", "2", "1")]
+    index.handler({"Records": records}, None)
+    assert started == [index.execution_name("SRR1", ["1", "2"])]
@@ -0,0 +1,92 @@
+import json
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+import index
+
+BUCKET = "uploads"
+TABLE_KEY = "config/reference_routing.json"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    with mock_aws():
+        client = boto3.client("s3", region_name="eu-west-2")
+        client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        monkeypatch.setattr(index, "s3_client", client)
+        monkeypatch.setattr(index, "ROUTING_TABLE_KEY", TABLE_KEY)
+        monkeypatch.setattr(index, "_routing_cache", {"table": None, "etag": None, "checked_at": 0.0})
+        yield client
+
+
+def upload(s3, key, tags=None):
+    s3.put_object(Bucket=BUCKET, Key=key, Body=b"reads")
+    if tags:
+        s3.put_object_tagging(Bucket=BUCKET, Key=key,
+                              Tagging={"TagSet": [{"Key": k, "Value": v} for k, v in tags.items()]})
+
+
+def test_no_table_and_no_sidecar_routes_to_default(s3):
+    upload(s3, "raw_reads/S1.fastq.gz")
+    route = index.resolve_route(BUCKET, "raw_reads/S1.fastq.gz", "S1")
+    assert route == {"reference_name": index.DEFAULT_REFERENCE_GENOME,
+                     "resources": {"vcpu": "2", "memory": "4096", "shards": 1}}
+
+
+@pytest.mark.parametrize("denied_key", [TABLE_KEY, "raw_reads/S1.metadata.json"])
+def test_access_denied_is_not_treated_as_absent(s3, monkeypatch, denied_key):
+    upload(s3, "raw_reads/S1.fastq.gz")
+    real_get_object = s3.get_object
+
+    def get_object(**kwargs):
+        if kwargs["Key"] == denied_key:
+            raise ClientError({"Error": {"Code": "AccessDenied", "Message": "Access Denied"}}, "GetObject")
+        return real_get_object(**kwargs)
+
+    monkeypatch.setattr(s3, "get_object", get_object)
+    with pytest.raises(ClientError):
+        index.resolve_route(BUCKET, "raw_reads/S1.fastq.gz", "S1")
+
+
+def test_other_errors_still_fail(s3, monkeypatch):
+    upload(s3, "raw_reads/S1.fastq.gz")
+
+    def get_object(**kwargs):
+        raise ClientError({"Error": {"Code": "SlowDown", "Message": "Slow Down"}}, "GetObject")
+
+    monkeypatch.setattr(s3, "get_object", get_object)
+    with pytest.raises(ClientError):
+        index.resolve_route(BUCKET, "raw_reads/S1.fastq.gz", "S1")
+
+
+def test_precedence_sidecar_then_tags_then_route_then_default(s3):
+    table = {
+        "default": {"reference_name": "chr20.fa"},
+        "profiles": {"wgs": {"vcpu": 8, "memory": 32768, "shards": 64}},
+        "routes": [{"prefix": "raw_reads/wgs/", "reference_name": "GRCh38.fa", "profile": "wgs"},
+                   {"tags": {"organism": "mouse"}, "reference_name": "GRCm39.fa"}],
+    }
+    s3.put_object(Bucket=BUCKET, Key=TABLE_KEY, Body=json.dumps(table).encode())
+    upload(s3, "raw_reads/wgs/W1.fastq.gz")
+    upload(s3, "raw_reads/M1.fastq.gz", tags={"organism": "mouse"})
+    upload(s3, "raw_reads/T1.fastq.gz", tags={"reference_name": "custom.fa"})
+    upload(s3, "raw_reads/wgs/C1.fastq.gz")
+    s3.put_object(Bucket=BUCKET, Key="raw_reads/wgs/C1.metadata.json",
+                  Body=json.dumps({"reference_name": "sidecar.fa", "resources": {"shards": 4}}).encode())
+
+    wgs = index.resolve_route(BUCKET, "raw_reads/wgs/W1.fastq.gz", "W1")
+    assert wgs == {"reference_name": "GRCh38.fa", "resources": {"vcpu": "8", "memory": "32768", "shards": 64}}
+    assert index.resolve_route(BUCKET, "raw_reads/M1.fastq.gz", "M1")["reference_name"] == "GRCm39.fa"
+    assert index.resolve_route(BUCKET, "raw_reads/T1.fastq.gz", "T1")["reference_name"] == "custom.fa"
+    sidecar = index.resolve_route(BUCKET, "raw_reads/wgs/C1.fastq.gz", "C1")
+    assert sidecar["reference_name"] == "sidecar.fa" and sidecar["resources"]["shards"] == 4
+
+
+def test_unknown_profile_is_rejected(s3):
+    s3.put_object(Bucket=BUCKET, Key=TABLE_KEY, Body=json.dumps({"default": {"profile": "huge"}}).encode())
+    upload(s3, "raw_reads/S1.fastq.gz")
+    with pytest.raises(ValueError):
+        index.resolve_route(BUCKET, "raw_reads/S1.fastq.gz", "S1")
@@ -0,0 +1,65 @@
+import shlex
+
+import pytest
+
+import tasks
+
+
+@pytest.fixture
+def fai(tmp_path):
+    def write(contigs):
+        path = tmp_path / "ref.fa.fai"
+        path.write_text("".join(f"{name}\t{length}\t0\t60\t61\n" for name, length in contigs))
+        return str(path)
+    return write
+
+
+def region_bounds(region):
+    name, span = region.rsplit(":", 1)
+    start, end = span.split("-")
+    return name.strip("{}"), int(start), int(end)
+
+
+def test_regions_tile_each_contig_in_order(fai):
+    contigs = [("chr1", 5_000_000), ("chr2", 2_500_001), ("chrM", 16_569)]
+    regions = [region_bounds(r) for r in tasks.plan_variant_regions(fai(contigs), 4)]
+
+    assert [name for name, _, _ in regions] == sorted((name for name, _, _ in regions), key=[c for c, _ in contigs].index)
+    for name, length in contigs:
+        spans = [(start, end) for contig, start, end in regions if contig == name]
+        assert spans[0][0] == 1 and spans[-1][1] == length
+        assert all(prev_end + 1 == start for (_, prev_end), (start, _) in zip(spans, spans[1:]))
+
+
+def test_regions_respect_minimum_size(fai):
+    regions = tasks.plan_variant_regions(fai([("chr1", 3 * tasks.MIN_REGION_BP)]), 1000)
+    assert len(regions) == 3
+
+
+def test_single_shard_is_one_region_per_contig(fai):
+    assert tasks.plan_variant_regions(fai([("chr1", 10), ("chr2", 20)]), 1) == ["{chr1}:1-10", "{chr2}:1-20"]
+
+
+def test_contig_names_with_colons_are_braced(fai):
+    [region] = tasks.plan_variant_regions(fai([("HLA-A*01:01:01:01", 3503)]), 1)
+    assert region == "{HLA-A*01:01:01:01}:1-3503"
+
+
+def test_sharded_and_unsharded_commands_differ_only_by_region():
+    unsharded = tasks.variant_call_command("/ref/chr20.fa", ["/tmp/S1.bam"], "/tmp/out.vcf.gz")
+    sharded = tasks.variant_call_command("/ref/chr20.fa", ["/tmp/S1.bam"], "/tmp/out.vcf.gz", region="{chr20}:1-100")
+    assert "--no-version" in unsharded
+    assert sharded.replace(" -r '{chr20}:1-100'", "") == unsharded
+
+
+def test_region_is_shell_quoted():
+    command = tasks.variant_call_command("/ref.fa", ["/tmp/S1.bam"], region="{HLA-A*01:01}:1-10")
+    mpileup = command.split("; ", 1)[1].split(" | ")[0]
+    assert shlex.split(mpileup)[shlex.split(mpileup).index("-r") + 1] == "{HLA-A*01:01}:1-10"
+
+
+def test_annotations_only_when_requested():
+    assert "-a" not in tasks.variant_call_command("/ref.fa", ["/tmp/S1.bam"]).split()
+    joint = tasks.variant_call_command("/ref.fa", ["/tmp/S1.bam", "/tmp/S2.bam"], read_groups="/tmp/rg.txt",
+                                       annotations=tasks.JOINT_ANNOTATIONS)
+    assert f"-a {tasks.JOINT_ANNOTATIONS}" in joint and "--read-groups /tmp/rg.txt" in joint